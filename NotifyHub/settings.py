@@ -183,6 +183,125 @@ SPECTACULAR_SETTINGS = {
     },
 }
 
+# Email configuration
+
+EMAIL_BACKEND = config(
+    "EMAIL_BACKEND", default="django.core.mail.backends.smtp.EmailBackend"
+)
+EMAIL_HOST = config("EMAIL_HOST", default="localhost")
+EMAIL_PORT = config("EMAIL_PORT", default=25, cast=int)
+EMAIL_HOST_USER = config("EMAIL_HOST_USER", default="")
+EMAIL_HOST_PASSWORD = config("EMAIL_HOST_PASSWORD", default="")
+EMAIL_USE_TLS = config("EMAIL_USE_TLS", default=False, cast=bool)
+DEFAULT_FROM_EMAIL = config("DEFAULT_FROM_EMAIL", default="NotifyHub <no-reply@notifyhub.local>")
+
+# Notification delivery configuration
+
+# Number of deliveries written per bulk_create batch during fan-out.
+NOTIFICATION_FANOUT_CHUNK_SIZE = config(
+    "NOTIFICATION_FANOUT_CHUNK_SIZE", default=1000, cast=int
+)
+# Fan-out engine for global notifications: "python" or "sql" (single INSERT ... SELECT).
+NOTIFICATION_FANOUT_ENGINE = config("NOTIFICATION_FANOUT_ENGINE", default="python")
+# Store global notifications once and materialize in-app deliveries only when read.
+NOTIFICATION_GLOBAL_FANOUT_ON_READ = config(
+    "NOTIFICATION_GLOBAL_FANOUT_ON_READ", default=False, cast=bool
+)
+# Channel backends used by the dispatcher. CONCURRENCY is the size of the thread pool
+# sending batches of BATCH_SIZE deliveries for that channel, OPTIONS are passed to the backend.
+# RATE_LIMIT is a token bucket ({"rate": sends per second, "burst": bucket size}) shared by
+# every worker; PROVIDER names an entry of NOTIFICATION_PROVIDER_RATE_LIMITS.
+# For offline throughput tests use "notification.backends.FakeBackend" with
+# "OPTIONS": {"latency": 0.05, "failure_rate": 0.01}.
+NOTIFICATION_CHANNEL_BACKENDS = {
+    "in_app": {"BACKEND": "notification.backends.InAppBackend"},
+    "email": {
+        # Use "notification.backends.SmtpEmailBackend" to send through EMAIL_BACKEND.
+        "BACKEND": config(
+            "NOTIFICATION_EMAIL_BACKEND",
+            default="notification.backends.ConsoleEmailBackend",
+        ),
+        "CONCURRENCY": config("NOTIFICATION_EMAIL_CONCURRENCY", default=4, cast=int),
+        "BATCH_SIZE": config("NOTIFICATION_EMAIL_BATCH_SIZE", default=100, cast=int),
+        "OPTIONS": {
+            "connection_lifetime": config(
+                "NOTIFICATION_EMAIL_CONNECTION_LIFETIME", default=60, cast=int
+            ),
+        },
+        "RATE_LIMIT": {
+            "rate": config("NOTIFICATION_EMAIL_RATE_LIMIT", default=50, cast=float),
+            "burst": config("NOTIFICATION_EMAIL_RATE_BURST", default=100, cast=int),
+        },
+    },
+    "sms": {
+        "BACKEND": "notification.backends.ConsoleSmsBackend",
+        "CONCURRENCY": config("NOTIFICATION_SMS_CONCURRENCY", default=4, cast=int),
+        "BATCH_SIZE": 100,
+        "RATE_LIMIT": {
+            "rate": config("NOTIFICATION_SMS_RATE_LIMIT", default=10, cast=float),
+            "burst": config("NOTIFICATION_SMS_RATE_BURST", default=20, cast=int),
+        },
+    },
+}
+# Limits shared by every channel sending through the same provider, e.g.
+# {"twilio": {"rate": 30, "burst": 30}}.
+NOTIFICATION_PROVIDER_RATE_LIMITS = {}
+# How long a claimed delivery is leased to a dispatcher before it can be claimed again.
+NOTIFICATION_DISPATCH_LEASE_SECONDS = config(
+    "NOTIFICATION_DISPATCH_LEASE_SECONDS", default=300, cast=int
+)
+# Failed deliveries are retried with exponential backoff and jitter:
+# delay = min(MAX, BASE * 2 ** (attempts - 1)), then dead-lettered after MAX_ATTEMPTS.
+NOTIFICATION_RETRY_BASE_SECONDS = config(
+    "NOTIFICATION_RETRY_BASE_SECONDS", default=30, cast=int
+)
+NOTIFICATION_RETRY_MAX_SECONDS = config(
+    "NOTIFICATION_RETRY_MAX_SECONDS", default=3600, cast=int
+)
+NOTIFICATION_RETRY_MAX_ATTEMPTS = config(
+    "NOTIFICATION_RETRY_MAX_ATTEMPTS", default=5, cast=int
+)
+# Maximum number of events accepted by a single bulk trigger request.
+NOTIFICATION_BULK_TRIGGER_MAX_EVENTS = config(
+    "NOTIFICATION_BULK_TRIGGER_MAX_EVENTS", default=5000, cast=int
+)
+# Triggers repeating an idempotency key within this window return the original notification.
+NOTIFICATION_IDEMPOTENCY_WINDOW_SECONDS = config(
+    "NOTIFICATION_IDEMPOTENCY_WINDOW_SECONDS", default=86400, cast=int
+)
+# Events with a collapse key are coalesced into deliveries created within this window.
+NOTIFICATION_COLLAPSE_WINDOW_SECONDS = config(
+    "NOTIFICATION_COLLAPSE_WINDOW_SECONDS", default=300, cast=int
+)
+# Notification type of the digests emitted by the notification_digest command.
+NOTIFICATION_DIGEST_TYPE = config("NOTIFICATION_DIGEST_TYPE", default="weekly_summary")
+# SMS renditions are truncated to this many segments (160 GSM-7 / 70 UCS-2 characters each).
+NOTIFICATION_SMS_MAX_SEGMENTS = config("NOTIFICATION_SMS_MAX_SEGMENTS", default=1, cast=int)
+# Preference storage: "rows" (one NotificationPreference per channel) or "bitmask" (one
+# NotificationPreferenceMask per type). Convert existing data with convert_preferences.
+NOTIFICATION_PREFERENCE_STORAGE = config("NOTIFICATION_PREFERENCE_STORAGE", default="rows")
+# Users follow NotificationType.default_channels until they override a channel. When True,
+# signup still writes the default preferences of every type for the new user.
+NOTIFICATION_EAGER_PREFERENCES = config("NOTIFICATION_EAGER_PREFERENCES", default=False, cast=bool)
+# Cache of the channels each user enabled per notification type. BACKEND names an
+# optional Django cache alias shared by all processes, next to the in-process LRU.
+NOTIFICATION_PREFERENCE_CACHE = {
+    "MAX_SIZE": config("NOTIFICATION_PREFERENCE_CACHE_SIZE", default=10000, cast=int),
+    "LOCAL_TTL": config("NOTIFICATION_PREFERENCE_CACHE_LOCAL_TTL", default=60, cast=int),
+    "BACKEND": config("NOTIFICATION_PREFERENCE_CACHE_BACKEND", default=None),
+    "TIMEOUT": config("NOTIFICATION_PREFERENCE_CACHE_TIMEOUT", default=300, cast=int),
+}
+# Seconds a process keeps its snapshot of the notification types. Saving a type refreshes
+# the saving process immediately, the others after this delay.
+NOTIFICATION_TYPE_REGISTRY_TTL = config("NOTIFICATION_TYPE_REGISTRY_TTL", default=60, cast=int)
+# Queries a history or unread request may issue: the JWT user lookup plus one per feed
+# source. Requests above it are logged as warnings.
+NOTIFICATION_FEED_QUERY_BUDGET = config("NOTIFICATION_FEED_QUERY_BUDGET", default=3, cast=int)
+# Running jobs without a checkpoint for this long are considered abandoned and resumed.
+NOTIFICATION_JOB_LEASE_SECONDS = config(
+    "NOTIFICATION_JOB_LEASE_SECONDS", default=300, cast=int
+)
+
 # Logger configuration
 
 LOG_DIR = os.path.abspath(os.path.join(BASE_DIR, ".", "logs"))
@@ -1,40 +1,63 @@
 from django.contrib import admin
 
-from .models import (Notification, NotificationDelivery,
-                     NotificationPreference, NotificationType)
+from .models import (DigestEntry, Notification, NotificationDelivery,
+                     NotificationJob, NotificationPreference,
+                     NotificationPreferenceMask, NotificationType,
+                     PreferenceBackfill, RateLimitBucket, UnreadCounter)
 
 
 @admin.register(NotificationType)
 class NotificationTypeAdmin(admin.ModelAdmin):
-    list_display = ("id", "notification_code", "name", "is_active")
+    list_display = (
+        "id",
+        "notification_code",
+        "name",
+        "is_active",
+        "is_targeted",
+        "is_digestible",
+    )
     search_fields = ("notification_code", "name")
-    list_filter = ("is_active",)
+    list_filter = ("is_active", "is_targeted", "is_digestible")
 
     fieldsets = (
         (None, {"fields": ("notification_code", "name", "description")}),
-        ("Settings", {"fields": ("is_active",)}),
+        (
+            "Settings",
+            {"fields": ("is_active", "is_targeted", "is_digestible", "default_channels")},
+        ),
+        ("Templates", {"fields": ("templates", "template_version")}),
     )
+    readonly_fields = ("template_version",)
 
 
 @admin.register(NotificationPreference)
 class NotificationPreferenceAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "notification_type", "channel")
-    list_filter = ("channel",)
+    list_display = ("id", "user", "notification_type", "channel", "enabled")
+    list_filter = ("channel", "enabled")
     search_fields = ("user__email", "notification_type__notification_code")
 
-    fieldsets = ((None, {"fields": ("user", "notification_type", "channel")}),)
+    fieldsets = ((None, {"fields": ("user", "notification_type", "channel", "enabled")}),)
+
+
+@admin.register(NotificationPreferenceMask)
+class NotificationPreferenceMaskAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "notification_type", "channels", "overridden")
+    list_filter = ("notification_type",)
+    search_fields = ("user__email", "notification_type__notification_code")
 
 
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
     list_display = ("title", "notification_type", "is_global", "created_at")
-    search_fields = ("title", "content")
+    search_fields = ("title", "content", "idempotency_key")
     list_filter = ("is_global",)
 
     fieldsets = (
         (None, {"fields": ("title", "notification_type", "content")}),
-        ("Advanced Options", {"fields": ("is_global", "metadata")}),
+        ("Advanced Options", {"fields": ("is_global", "metadata", "idempotency_key", "collapse_key")}),
+        ("Renditions", {"fields": ("content_html", "content_text", "content_sms")}),
     )
+    readonly_fields = ("content_html", "content_text", "content_sms")
 
 
 @admin.register(NotificationDelivery)
@@ -61,10 +84,83 @@ class NotificationDeliveryAdmin(admin.ModelAdmin):
                     "is_read",
                     "sent_at",
                     "last_attempted_at",
+                    "next_attempt_at",
                     "attempts",
                     "error_message",
                 )
             },
         ),
+        ("Collapsing", {"fields": ("collapse_key", "collapsed_count")}),
+    )
+    readonly_fields = (
+        "sent_at",
+        "last_attempted_at",
+        "next_attempt_at",
+        "attempts",
+        "error_message",
+        "collapsed_count",
+    )
+
+
+@admin.register(NotificationJob)
+class NotificationJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "notification",
+        "status",
+        "attempts",
+        "processed",
+        "total",
+        "delivery_count",
+        "locked_by",
+        "created_at",
     )
-    readonly_fields = ("sent_at", "last_attempted_at", "attempts", "error_message")
+    list_filter = ("status",)
+    search_fields = ("notification__title", "locked_by")
+    readonly_fields = ("created_at", "updated_at")
+    actions = ["requeue_jobs"]
+
+    @admin.action(description="Requeue selected failed jobs (resume from checkpoint)")
+    def requeue_jobs(self, request, queryset):
+        # Completed jobs would replay their last chunk and dispatch again.
+        updated = queryset.filter(status="failed").update(
+            status="queued", finished_at=None, error_message=None
+        )
+        self.message_user(request, f"{updated} failed job(s) requeued.")
+
+
+@admin.register(RateLimitBucket)
+class RateLimitBucketAdmin(admin.ModelAdmin):
+    list_display = ("key", "tokens", "refilled_at")
+    search_fields = ("key",)
+
+
+@admin.register(DigestEntry)
+class DigestEntryAdmin(admin.ModelAdmin):
+    list_display = ("id", "notification", "user", "channel", "created_at", "digested_at")
+    list_filter = ("channel",)
+    search_fields = ("user__email", "notification__title")
+    readonly_fields = ("created_at", "updated_at", "digested_at")
+
+
+@admin.register(PreferenceBackfill)
+class PreferenceBackfillAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "notification_type",
+        "status",
+        "processed",
+        "total",
+        "started_at",
+        "finished_at",
+    )
+    list_filter = ("status", "notification_type")
+    readonly_fields = ("created_at", "updated_at")
+
+
+@admin.register(UnreadCounter)
+class UnreadCounterAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "channel", "count", "updated_at")
+    list_filter = ("channel",)
+    search_fields = ("user__email",)
+    readonly_fields = ("created_at", "updated_at")
@@ -0,0 +1,255 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .rendering import render_deliveries
+
+logger = logging.getLogger("django")
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def mark_sent(delivery):
+    delivery.status = "sent"
+    delivery.sent_at = timezone.now()
+    delivery.error_message = None
+
+
+def mark_failed(delivery, error):
+    delivery.status = "failed"
+    delivery.error_message = str(error)
+    logger.error(
+        f"Failed to send notification: user={delivery.user_id}, "
+        f"channel={delivery.channel}, error={error}"
+    )
+
+
+class BaseChannelBackend:
+    """
+    Sends deliveries of one channel.
+
+    The dispatcher calls send_batch(deliveries) with deliveries whose user and
+    notification are already loaded. Implementations set the outcome on every
+    delivery with mark_sent / mark_failed and must not touch the database, since
+    batches of the same channel may run concurrently in a thread pool; the
+    dispatcher persists the statuses afterwards. The default send_batch calls
+    send() for each delivery; backends sending rendered content use
+    render_deliveries() to render the whole batch at once.
+    """
+
+    def __init__(
+        self,
+        channel,
+        concurrency=1,
+        batch_size=100,
+        rate_limit=None,
+        provider=None,
+        **options,
+    ):
+        self.channel = channel
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.rate_limit = rate_limit
+        self.provider = provider
+        self.options = options
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """
+        Bounded thread pool of `concurrency` workers, created on first use and
+        shared by every dispatch of this process.
+        """
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.concurrency,
+                        thread_name_prefix=f"notification-{self.channel}",
+                    )
+        return self._executor
+
+    def send_batch(self, deliveries):
+        for delivery in deliveries:
+            try:
+                self.send(delivery)
+                mark_sent(delivery)
+            except Exception as e:
+                mark_failed(delivery, e)
+
+    def send(self, delivery):
+        raise NotImplementedError("Channel backends must implement send() or send_batch().")
+
+
+class InAppBackend(BaseChannelBackend):
+    """
+    In-app notifications are read from the database, sending only marks them sent.
+    """
+
+    def send(self, delivery):
+        logger.debug(f"In-app notification queued for user={delivery.user_id}")
+
+
+class ConsoleEmailBackend(BaseChannelBackend):
+    """
+    Mock email backend, logs the message instead of sending it.
+    """
+
+    def send_batch(self, deliveries):
+        for delivery, content in zip(deliveries, render_deliveries(self.channel, deliveries)):
+            logger.debug(
+                f"[MOCK EMAIL] To: {delivery.user.email} - {content['content_text']}"
+            )
+            mark_sent(delivery)
+
+
+class SmtpEmailBackend(BaseChannelBackend):
+    """
+    Sends each batch of email deliveries over one reused connection, so the SMTP
+    handshake is paid once per batch instead of once per delivery.
+
+    Messages are sent one at a time on the shared connection and each delivery
+    is marked sent or failed as it goes, so a failure never causes the messages
+    already accepted to be sent again. After a failure the connection is
+    reopened for the rest of the batch.
+
+    Each worker thread keeps its own connection open for `connection_lifetime`
+    seconds. `email_backend` selects the Django email backend and defaults to
+    EMAIL_BACKEND, e.g. the locmem backend for tests.
+    """
+
+    def __init__(self, channel, email_backend=None, connection_lifetime=60, **kwargs):
+        super().__init__(channel, **kwargs)
+        self.email_backend = email_backend
+        self.connection_lifetime = connection_lifetime
+        self._local = threading.local()
+
+    def get_connection(self):
+        connection = getattr(self._local, "connection", None)
+        opened_at = getattr(self._local, "opened_at", 0)
+        if connection is not None and time.monotonic() - opened_at < self.connection_lifetime:
+            return connection
+
+        self.close_connection()
+        connection = get_connection(self.email_backend, fail_silently=False)
+        connection.open()
+        self._local.connection = connection
+        self._local.opened_at = time.monotonic()
+        return connection
+
+    def close_connection(self):
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception as e:
+                logger.warning(f"Failed to close email connection: {e}")
+
+    def render(self, delivery, content):
+        message = EmailMultiAlternatives(
+            subject=delivery.notification.title,
+            body=content["content_text"],
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[delivery.user.email],
+        )
+        message.attach_alternative(content["content_html"], "text/html")
+        return message
+
+    def send_batch(self, deliveries):
+        for delivery, content in zip(deliveries, render_deliveries(self.channel, deliveries)):
+            if not delivery.user.email:
+                mark_failed(delivery, "User has no email address.")
+                continue
+            try:
+                sent = self.get_connection().send_messages([self.render(delivery, content)])
+            except Exception as e:
+                self.close_connection()
+                mark_failed(delivery, e)
+                continue
+            if sent:
+                mark_sent(delivery)
+            else:
+                mark_failed(delivery, "Email was not accepted by the server.")
+
+
+class ConsoleSmsBackend(BaseChannelBackend):
+    """
+    Mock SMS backend, logs the message instead of sending it.
+    """
+
+    def send_batch(self, deliveries):
+        for delivery, content in zip(deliveries, render_deliveries(self.channel, deliveries)):
+            recipient = getattr(delivery.user, "phone_number", delivery.user.username)
+            logger.debug(f"[MOCK SMS] To: {recipient} - {content['content_sms']}")
+            mark_sent(delivery)
+
+
+class FakeBackend(BaseChannelBackend):
+    """
+    Simulated provider for offline throughput testing. Each send sleeps for
+    `latency` seconds and fails with probability `failure_rate`.
+    """
+
+    def __init__(self, channel, latency=0.0, failure_rate=0.0, seed=None, **kwargs):
+        super().__init__(channel, **kwargs)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def send(self, delivery):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._random_lock:
+            failed = self._random.random() < self.failure_rate
+        if failed:
+            raise RuntimeError(f"Simulated {self.channel} provider failure.")
+
+
+def get_backend(channel) -> BaseChannelBackend:
+    """
+    Returns the backend configured for a channel in NOTIFICATION_CHANNEL_BACKENDS.
+    Backends are instantiated once per process.
+    """
+    backend = _backends.get(channel)
+    if backend is not None:
+        return backend
+
+    with _backends_lock:
+        if channel not in _backends:
+            try:
+                config = settings.NOTIFICATION_CHANNEL_BACKENDS[channel]
+            except KeyError:
+                raise ValueError(f"No backend configured for channel '{channel}'.")
+
+            backend_class = import_string(config["BACKEND"])
+            _backends[channel] = backend_class(
+                channel,
+                concurrency=config.get("CONCURRENCY", 1),
+                batch_size=config.get("BATCH_SIZE", 100),
+                rate_limit=config.get("RATE_LIMIT"),
+                provider=config.get("PROVIDER"),
+                **config.get("OPTIONS", {}),
+            )
+        return _backends[channel]
+
+
+@receiver(setting_changed)
+def reset_backends(setting, **kwargs):
+    if setting == "NOTIFICATION_CHANNEL_BACKENDS":
+        for backend in _backends.values():
+            if backend._executor is not None:
+                backend._executor.shutdown(wait=False)
+        _backends.clear()
@@ -0,0 +1,121 @@
+import logging
+from collections import defaultdict
+
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import NotificationChannel, NotificationDelivery, UnreadCounter
+
+logger = logging.getLogger("django")
+
+# Only in-app deliveries are ever marked read.
+COUNTED_CHANNELS = [NotificationChannel.IN_APP.value]
+
+
+def count_unread(deliveries) -> dict:
+    """
+    Returns the number of unread deliveries of the queryset per (user_id, channel)
+    with one grouped query.
+    """
+    rows = (
+        deliveries.filter(is_read=False, channel__in=COUNTED_CHANNELS)
+        .values("user_id", "channel")
+        .annotate(unread=Count("id"))
+        .order_by()
+    )
+    return {(row["user_id"], row["channel"]): row["unread"] for row in rows}
+
+
+def record_new_deliveries(deliveries, since):
+    """
+    Adds the unread deliveries of the queryset created since `since` to the
+    counters. Rows that already existed, such as collapsed deliveries repointed
+    to a new notification, are older and are not counted again. Must run in
+    the transaction that created the deliveries.
+    """
+    increment_unread(count_unread(deliveries.filter(created_at__gte=since)))
+
+
+def increment_unread(counts):
+    """
+    Adds {(user_id, channel): n} to the counters with atomic F() updates, one
+    UPDATE per (channel, n) group, creating the missing counters first.
+    """
+    if not counts:
+        return
+    UnreadCounter.objects.bulk_create(
+        [
+            UnreadCounter(user_id=user_id, channel=channel)
+            for user_id, channel in counts
+        ],
+        ignore_conflicts=True,
+    )
+    groups = defaultdict(list)
+    for (user_id, channel), n in counts.items():
+        groups[(channel, n)].append(user_id)
+    now = timezone.now()
+    for (channel, n), user_ids in groups.items():
+        UnreadCounter.objects.filter(user_id__in=user_ids, channel=channel).update(
+            count=F("count") + n, updated_at=now
+        )
+
+
+def decrement_unread(user_id, channel, n):
+    if not n:
+        return
+    UnreadCounter.objects.filter(user_id=user_id, channel=channel).update(
+        count=Greatest(F("count") - n, 0), updated_at=timezone.now()
+    )
+
+
+def get_unread_counts(user) -> dict:
+    """
+    Returns the counters of a user as {channel: count}, with 0 for the counted
+    channels without a counter yet.
+    """
+    counts = dict.fromkeys(COUNTED_CHANNELS, 0)
+    counts.update(
+        UnreadCounter.objects.filter(user=user).values_list("channel", "count")
+    )
+    return counts
+
+
+def reconcile_counters(user_ids) -> int:
+    """
+    Recomputes the counters of the users from their deliveries and returns the
+    number of counters that drifted. Must run inside a transaction.
+
+    The missing counters are created first, so every counter of the users
+    exists and is locked before the deliveries are counted: increments of
+    concurrent fan-outs either committed before the recount, which then
+    includes their deliveries, or wait for the reconcile and are applied on top
+    of it.
+    """
+    UnreadCounter.objects.bulk_create(
+        [
+            UnreadCounter(user_id=user_id, channel=channel)
+            for user_id in user_ids
+            for channel in COUNTED_CHANNELS
+        ],
+        ignore_conflicts=True,
+    )
+    counters = list(
+        UnreadCounter.objects.select_for_update().filter(
+            user_id__in=user_ids, channel__in=COUNTED_CHANNELS
+        )
+    )
+    actual = count_unread(NotificationDelivery.objects.filter(user_id__in=user_ids))
+
+    now = timezone.now()
+    drifted = []
+    for counter in counters:
+        unread = actual.get((counter.user_id, counter.channel), 0)
+        if counter.count != unread:
+            counter.count = unread
+            counter.updated_at = now
+            drifted.append(counter)
+    UnreadCounter.objects.bulk_update(drifted, ["count", "updated_at"])
+    if drifted:
+        logger.info(f"Unread counters reconciled: {len(drifted)} drifted")
+    return len(drifted)
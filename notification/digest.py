@@ -0,0 +1,122 @@
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .fanout import get_chunk_size
+from .models import (DigestEntry, Notification, NotificationChannel,
+                     NotificationDelivery, NotificationType)
+from .registry import registry
+from .rendering import render
+from .renditions import set_renditions
+
+logger = logging.getLogger("django")
+
+
+def emit_digests(until=None, chunk_size=None) -> int:
+    """
+    Emits one digest notification per user for the entries buffered before
+    `until`, and returns the number of digests emitted.
+
+    Users are walked in keyset chunks. Each chunk is aggregated with grouped
+    queries, its notifications and deliveries are written with bulk_create and
+    its entries are marked digested in the same transaction. The entries are
+    locked with SKIP LOCKED, so concurrent runs never digest an entry twice.
+    The deliveries are due immediately and are sent by the retry scheduler.
+    """
+    until = until or timezone.now()
+    chunk_size = get_chunk_size(chunk_size)
+    digest_type = registry.get(settings.NOTIFICATION_DIGEST_TYPE)
+    if digest_type is None:
+        raise NotificationType.DoesNotExist(
+            f"Digest notification type not found: {settings.NOTIFICATION_DIGEST_TYPE}"
+        )
+    pending = DigestEntry.objects.filter(digested_at__isnull=True, created_at__lt=until)
+
+    emitted = 0
+    after = None
+    while True:
+        users = pending.order_by("user_id").values_list("user_id", flat=True).distinct()
+        if after is not None:
+            users = users.filter(user_id__gt=after)
+        user_ids = list(users[:chunk_size])
+        if not user_ids:
+            break
+
+        with transaction.atomic():
+            emitted += emit_chunk(digest_type, pending.filter(user_id__in=user_ids))
+        after = user_ids[-1]
+
+    logger.info(f"Digests emitted: {emitted}")
+    return emitted
+
+
+def emit_chunk(digest_type, entries) -> int:
+    """
+    Aggregates the entries of one chunk of users into their digest notifications.
+    Must run inside a transaction.
+    """
+    entry_ids = list(
+        entries.select_for_update(skip_locked=True).values_list("id", flat=True)
+    )
+    if not entry_ids:
+        return 0
+    entries = DigestEntry.objects.filter(id__in=entry_ids).order_by()
+
+    items = defaultdict(list)
+    for row in (
+        entries.values(
+            "user_id",
+            "notification__notification_type__notification_code",
+            "notification__notification_type__name",
+        )
+        .annotate(count=Count("notification", distinct=True))
+        .order_by("user_id", "notification__notification_type__name")
+    ):
+        items[row["user_id"]].append(
+            {
+                "code": row["notification__notification_type__notification_code"],
+                "name": row["notification__notification_type__name"],
+                "count": row["count"],
+            }
+        )
+
+    channels = defaultdict(list)
+    for user_id, channel in entries.values_list("user_id", "channel").distinct():
+        channels[user_id].append(channel)
+
+    notifications = []
+    for user_id, user_items in items.items():
+        metadata = {"user_id": str(user_id), "items": user_items}
+        notifications.append(
+            Notification(
+                notification_type=digest_type,
+                title=digest_type.name,
+                content=render(digest_type, NotificationChannel.IN_APP, metadata),
+                is_global=False,
+                metadata=metadata,
+            )
+        )
+    for notification in notifications:
+        set_renditions(notification)
+    Notification.objects.bulk_create(notifications)
+
+    now = timezone.now()
+    NotificationDelivery.objects.bulk_create(
+        [
+            NotificationDelivery(
+                notification=notification,
+                user_id=user_id,
+                channel=channel,
+                next_attempt_at=now,
+            )
+            for notification, user_id in zip(notifications, items)
+            for channel in channels[user_id]
+        ],
+        ignore_conflicts=True,
+    )
+    entries.update(digested_at=now, updated_at=now)
+    return len(notifications)
@@ -0,0 +1,213 @@
+import logging
+import random
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .backends import get_backend, mark_failed
+from .models import NotificationDelivery
+from .ratelimit import acquire, get_limiters
+
+logger = logging.getLogger("django")
+
+DELIVERY_UPDATE_FIELDS = [
+    "status",
+    "sent_at",
+    "error_message",
+    "attempts",
+    "last_attempted_at",
+    "next_attempt_at",
+    "updated_at",
+]
+
+RETRYABLE_STATUSES = ["pending", "failed"]
+
+
+def claim_deliveries(queryset, batch_size, ordering):
+    """
+    Claims up to batch_size deliveries with SELECT ... FOR UPDATE SKIP LOCKED and
+    leases them by pushing next_attempt_at NOTIFICATION_DISPATCH_LEASE_SECONDS
+    ahead. The claim commits immediately, so sending happens outside of any
+    transaction; if the process dies mid-send the retry scheduler picks the
+    deliveries up again once the lease expires.
+    """
+    lease_until = timezone.now() + timedelta(
+        seconds=settings.NOTIFICATION_DISPATCH_LEASE_SECONDS
+    )
+    with transaction.atomic():
+        ids = list(
+            queryset.select_for_update(skip_locked=True, of=("self",))
+            .order_by(ordering)
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if ids:
+            NotificationDelivery.objects.filter(id__in=ids).update(
+                next_attempt_at=lease_until
+            )
+
+    if not ids:
+        return []
+    return list(
+        NotificationDelivery.objects.filter(id__in=ids)
+        .select_related("user", "notification__notification_type")
+        .order_by("id")
+    )
+
+
+def dispatch_notification(notification, batch_size=None, heartbeat=None) -> int:
+    """
+    Sends every pending delivery of a notification that was not handed to the
+    retry scheduler yet.
+
+    Deliveries are claimed in batches so several workers can drain the same
+    notification without sending twice, and the resulting statuses are written
+    back with a single bulk_update per batch. `heartbeat` is called after every
+    batch, e.g. to renew the lease of the calling job. Returns the number of
+    deliveries processed.
+    """
+    batch_size = batch_size or settings.NOTIFICATION_FANOUT_CHUNK_SIZE
+    pending = NotificationDelivery.objects.filter(
+        notification=notification, status="pending", next_attempt_at__isnull=True
+    )
+
+    processed = 0
+    while True:
+        deliveries = claim_deliveries(pending, batch_size, "id")
+        if not deliveries:
+            break
+        send_deliveries(deliveries)
+        processed += len(deliveries)
+        if heartbeat is not None:
+            heartbeat()
+
+    logger.info(
+        f"Dispatched {processed} deliveries for notification id={notification.id}"
+    )
+    return processed
+
+
+def dispatch_due(batch_size=None, now=None) -> int:
+    """
+    Claims one batch of pending or failed deliveries whose next_attempt_at is due
+    and sends them. The claim walks the (status, next_attempt_at) index and uses
+    SKIP LOCKED, so several schedulers can share the backlog. Returns the number
+    of deliveries claimed.
+    """
+    batch_size = batch_size or settings.NOTIFICATION_FANOUT_CHUNK_SIZE
+    now = now or timezone.now()
+
+    due = NotificationDelivery.objects.filter(
+        status__in=RETRYABLE_STATUSES, next_attempt_at__lte=now
+    )
+    deliveries = claim_deliveries(due, batch_size, "next_attempt_at")
+    if deliveries:
+        send_deliveries(deliveries)
+    return len(deliveries)
+
+
+def get_retry_delay(attempts: int) -> float:
+    """
+    Exponential backoff with jitter: the delay doubles with every attempt up to
+    NOTIFICATION_RETRY_MAX_SECONDS and is then drawn from [delay / 2, delay] so
+    retries after a provider outage do not all fire at the same moment.
+    """
+    delay = min(
+        settings.NOTIFICATION_RETRY_MAX_SECONDS,
+        settings.NOTIFICATION_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0),
+    )
+    return random.uniform(delay / 2, delay)
+
+
+def schedule_retry(delivery, now):
+    """
+    Schedules the next attempt of a failed delivery or dead-letters it once it
+    reached NOTIFICATION_RETRY_MAX_ATTEMPTS.
+    """
+    if delivery.attempts >= settings.NOTIFICATION_RETRY_MAX_ATTEMPTS:
+        delivery.status = "dead"
+        delivery.next_attempt_at = None
+        logger.warning(
+            f"Delivery dead-lettered after {delivery.attempts} attempts: "
+            f"id={delivery.id}, channel={delivery.channel}"
+        )
+        return
+
+    delivery.next_attempt_at = now + timedelta(
+        seconds=get_retry_delay(delivery.attempts)
+    )
+
+
+def send_deliveries(deliveries):
+    """
+    Sends the given deliveries through their channel backends and persists the
+    outcome with one bulk_update. Failed deliveries get their next attempt
+    scheduled (or are dead-lettered) before being written back.
+
+    Deliveries are grouped per channel and split into the backend's BATCH_SIZE.
+    Channels with a CONCURRENCY above one send their batches on the backend's
+    own bounded thread pool, so a slow email or sms provider neither serializes
+    the other channels nor its own batches.
+
+    Channels with a rate limit only send as many deliveries as the shared token
+    buckets allow; the rest keep their status and are deferred to the moment
+    enough tokens are refilled, without counting as an attempt.
+    """
+    now = timezone.now()
+    by_channel = defaultdict(list)
+    for delivery in deliveries:
+        delivery.updated_at = now
+        by_channel[delivery.channel].append(delivery)
+
+    attempted = []
+    futures = []
+    inline = []
+    for channel, channel_deliveries in by_channel.items():
+        backend = get_backend(channel)
+
+        limiters = get_limiters(backend)
+        if limiters:
+            granted, wait = acquire(limiters, len(channel_deliveries))
+            defer_until = now + timedelta(seconds=wait)
+            for delivery in channel_deliveries[granted:]:
+                delivery.next_attempt_at = defer_until
+            channel_deliveries = channel_deliveries[:granted]
+
+        for delivery in channel_deliveries:
+            delivery.attempts += 1
+            delivery.last_attempted_at = now
+        attempted.extend(channel_deliveries)
+
+        for i in range(0, len(channel_deliveries), backend.batch_size):
+            batch = channel_deliveries[i : i + backend.batch_size]
+            if backend.concurrency > 1:
+                futures.append(backend.executor.submit(send_batch, backend, batch))
+            else:
+                inline.append((backend, batch))
+
+    for backend, batch in inline:
+        send_batch(backend, batch)
+    for future in futures:
+        future.result()
+
+    for delivery in attempted:
+        if delivery.status == "failed":
+            schedule_retry(delivery, now)
+        else:
+            delivery.next_attempt_at = None
+
+    NotificationDelivery.objects.bulk_update(deliveries, DELIVERY_UPDATE_FIELDS)
+
+
+def send_batch(backend, batch):
+    """
+    Runs one backend batch. A batch-level error marks every delivery of the batch
+    as failed instead of aborting the whole dispatch.
+    """
+    try:
+        backend.send_batch(batch)
+    except Exception as e:
+        for delivery in batch:
+            mark_failed(delivery, e)
@@ -0,0 +1,411 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Case, Count, F, Q, Value, When
+from django.utils import timezone
+
+from .counters import record_new_deliveries
+from .models import DigestEntry, NotificationChannel, NotificationDelivery
+from .preferences import (get_audience_preferences, preference_source_sql,
+                          resolve_channels)
+
+User = get_user_model()
+
+logger = logging.getLogger("django")
+
+FANOUT_ENGINE_PYTHON = "python"
+FANOUT_ENGINE_SQL = "sql"
+
+
+def get_chunk_size(chunk_size=None) -> int:
+    """
+    Returns the fan-out chunk size, falling back to NOTIFICATION_FANOUT_CHUNK_SIZE.
+    """
+    return chunk_size or settings.NOTIFICATION_FANOUT_CHUNK_SIZE
+
+
+def get_target_users(notification):
+    """
+    Resolves which users should receive the notification. Global notifications
+    go to everybody, targeted ones to the user_id stored in the metadata.
+    """
+    if notification.is_global:
+        return User.objects.all()
+
+    user_id = (notification.metadata or {}).get("user_id")
+    if user_id:
+        return User.objects.filter(id=user_id)
+    return User.objects.none()
+
+
+def iter_user_chunks(users, after=None, chunk_size=None):
+    """
+    Walks the audience in keyset order over User.id and yields (upper, size) for
+    each chunk, where the chunk covers after < id <= upper.
+
+    Only the chunk boundary is read from the database, so the user ids never need
+    to be materialized. The last chunk is open ended and yields upper=None.
+    """
+    chunk_size = get_chunk_size(chunk_size)
+    users = users.order_by("id")
+
+    while True:
+        remaining = users.filter(id__gt=after) if after is not None else users
+        upper = remaining.values_list("id", flat=True)[chunk_size - 1 : chunk_size]
+        upper = next(iter(upper), None)
+
+        if upper is None:
+            size = remaining.count()
+            if size:
+                yield None, size
+            return
+
+        yield upper, chunk_size
+        after = upper
+
+
+def get_chunk_users(users, after=None, upper=None):
+    """
+    Restricts the audience to the keyset chunk after < id <= upper.
+    """
+    if after is not None:
+        users = users.filter(id__gt=after)
+    if upper is not None:
+        users = users.filter(id__lte=upper)
+    return users
+
+
+def fan_out_chunk(notification, notif_type, users, after=None, upper=None, engine=None) -> int:
+    """
+    Creates the deliveries of one keyset chunk using the configured engine.
+
+    The SQL engine only applies to global notifications, since their audience is
+    every user holding a preference for the type; targeted notifications always go
+    through the Python engine. Both engines skip rows that already exist, so a
+    chunk can safely be replayed after a crash.
+
+    Deliveries of the chunk sharing the notification's collapse key are coalesced
+    first; the engines then skip those users' channels through the unique
+    constraint. The unread counters of the chunk are updated in the same
+    transaction.
+    """
+    engine = engine or settings.NOTIFICATION_FANOUT_ENGINE
+    chunk_users = get_chunk_users(users, after, upper)
+    started = timezone.now()
+    collapse_deliveries(notification, chunk_users)
+    if engine == FANOUT_ENGINE_SQL and notification.is_global:
+        count = sql_create_deliveries(notification, notif_type, after, upper)
+    else:
+        count = create_deliveries(notification, notif_type, chunk_users)
+    record_new_deliveries(
+        NotificationDelivery.objects.filter(notification=notification, user__in=chunk_users),
+        started,
+    )
+    return count
+
+
+def create_deliveries(notification, notif_type, users, chunk_size=None) -> int:
+    """
+    Builds one pending delivery per (user, preferred channel) for the given audience.
+
+    Preferences of a global audience are fetched with a single streaming join
+    per chunk; targeted audiences are small and are resolved through the
+    preference cache. The deliveries are written with chunked bulk_create, so
+    the number of queries grows with the number of chunks rather than the
+    number of users. Email and SMS preferences of digestible types become
+    digest entries instead.
+
+    Returns the number of deliveries actually inserted: rows skipped because
+    they already exist, e.g. when a chunk is replayed, are not counted.
+    """
+    chunk_size = get_chunk_size(chunk_size)
+    started = timezone.now()
+    if notification.is_global:
+        # In-app items of fan-out-on-read notifications are materialized on read.
+        preferences = get_audience_preferences(
+            notif_type,
+            users,
+            exclude_channel=NotificationChannel.IN_APP if notification.fanout_on_read else None,
+        )
+    else:
+        channels = resolve_channels(
+            (user_id, notif_type.id) for user_id in users.values_list("id", flat=True)
+        )
+        preferences = [
+            (user_id, channel)
+            for (user_id, _), user_channels in channels.items()
+            for channel in sorted(user_channels)
+        ]
+
+    batch = []
+    entries = []
+    for user_id, channel in preferences:
+        if notif_type.is_digestible and channel != NotificationChannel.IN_APP:
+            entries.append(
+                DigestEntry(notification=notification, user_id=user_id, channel=channel)
+            )
+        else:
+            batch.append(
+                NotificationDelivery(
+                    notification=notification,
+                    user_id=user_id,
+                    channel=channel,
+                    collapse_key=notification.collapse_key,
+                )
+            )
+
+        if len(batch) >= chunk_size:
+            _bulk_create_deliveries(batch, chunk_size)
+            batch = []
+        if len(entries) >= chunk_size:
+            _bulk_create_digest_entries(entries, chunk_size)
+            entries = []
+
+    if batch:
+        _bulk_create_deliveries(batch, chunk_size)
+    if entries:
+        _bulk_create_digest_entries(entries, chunk_size)
+
+    # ignore_conflicts does not report the skipped rows, the inserted ones are
+    # the rows created by this call.
+    count = NotificationDelivery.objects.filter(
+        notification=notification, user__in=users, created_at__gte=started
+    ).count()
+    logger.info(f"Total deliveries created: {count}")
+    return count
+
+
+def _bulk_create_deliveries(batch, chunk_size):
+    NotificationDelivery.objects.bulk_create(
+        batch, batch_size=chunk_size, ignore_conflicts=True
+    )
+
+
+def _bulk_create_digest_entries(entries, chunk_size):
+    DigestEntry.objects.bulk_create(entries, batch_size=chunk_size, ignore_conflicts=True)
+    logger.info(f"Digest entries buffered: {len(entries)}")
+
+
+def collapse_deliveries(notification, users, count=1, due=False) -> int:
+    """
+    Coalesces the given users' deliveries sharing the notification's collapse key
+    into the new notification instead of creating new rows.
+
+    A delivery is collapsible while it is pending and not claimed by a dispatcher,
+    or an unread in-app item, and was created less than
+    NOTIFICATION_COLLAPSE_WINDOW_SECONDS ago, so the window is fixed from the
+    first event of a burst. Collapsed deliveries point to the new notification,
+    which carries the latest content, and add `count` to their counter in a
+    single UPDATE. `due` makes collapsed pending deliveries due immediately for
+    the retry scheduler. Returns the number of collapsed deliveries.
+    """
+    if not notification.collapse_key:
+        return 0
+
+    now = timezone.now()
+    window_start = now - timedelta(seconds=settings.NOTIFICATION_COLLAPSE_WINDOW_SECONDS)
+    unclaimed = Q(status="pending") & (
+        Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)
+    )
+    unread = Q(channel=NotificationChannel.IN_APP, is_read=False)
+    deliveries = NotificationDelivery.objects.filter(
+        unclaimed | unread,
+        user__in=users,
+        collapse_key=notification.collapse_key,
+        created_at__gte=window_start,
+    ).exclude(notification=notification)
+    if notification.fanout_on_read:
+        deliveries = deliveries.exclude(channel=NotificationChannel.IN_APP)
+
+    updates = {
+        "notification": notification,
+        "collapsed_count": F("collapsed_count") + count,
+        # Already delivered in-app items move to the top of the feed.
+        "sent_at": Case(When(status="sent", then=Value(now)), default=F("sent_at")),
+        "updated_at": now,
+    }
+    if due:
+        updates["next_attempt_at"] = Case(
+            When(status="pending", then=Value(now)), default=F("next_attempt_at")
+        )
+
+    collapsed = deliveries.order_by().update(**updates)
+    if collapsed:
+        logger.info(
+            f"Collapsed {collapsed} deliveries into notification id={notification.id}"
+        )
+    return collapsed
+
+
+def create_targeted_deliveries(notifications, chunk_size=None) -> dict:
+    """
+    Creates the deliveries of many targeted notifications at once, as used by the
+    bulk trigger. The channels of every (user, type) pair are resolved through
+    the preference cache, with one query for the misses, and the deliveries are
+    written with bulk_create.
+
+    There is no outbox job for these notifications, so the deliveries are due
+    immediately and are sent by the retry scheduler. Returns the number of
+    deliveries inserted per notification id.
+
+    Notifications of the same user sharing a collapse key are coalesced: only the
+    latest one of the batch gets deliveries, counting the ones it replaced.
+    Email and SMS notifications of digestible types are buffered as digest
+    entries.
+    """
+    chunk_size = get_chunk_size(chunk_size)
+    targets = [
+        (notification, str((notification.metadata or {}).get("user_id") or ""))
+        for notification in notifications
+    ]
+    targets = [(notification, user_id) for notification, user_id in targets if user_id]
+
+    latest = {}
+    for notification, user_id in targets:
+        if notification.collapse_key:
+            key = (user_id, notification.collapse_key)
+            _, count = latest.get(key, (None, 0))
+            latest[key] = (notification, count + 1)
+    collapsed_counts = {}
+    for (user_id, _), (notification, count) in latest.items():
+        collapsed_counts[(notification, user_id)] = count
+        collapse_deliveries(
+            notification, User.objects.filter(id=user_id), count=count, due=True
+        )
+    targets = [
+        (notification, user_id)
+        for notification, user_id in targets
+        if not notification.collapse_key or (notification, user_id) in collapsed_counts
+    ]
+    if not targets:
+        return {}
+
+    channels = resolve_channels(
+        (user_id, notification.notification_type_id) for notification, user_id in targets
+    )
+
+    now = timezone.now()
+    deliveries = []
+    entries = []
+    for notification, user_id in targets:
+        digestible = notification.notification_type.is_digestible
+        for channel in sorted(channels[(user_id, notification.notification_type_id)]):
+            if digestible and channel != NotificationChannel.IN_APP:
+                entries.append(
+                    DigestEntry(notification=notification, user_id=user_id, channel=channel)
+                )
+                continue
+            deliveries.append(
+                NotificationDelivery(
+                    notification=notification,
+                    user_id=user_id,
+                    channel=channel,
+                    next_attempt_at=now,
+                    collapse_key=notification.collapse_key,
+                    collapsed_count=collapsed_counts.get((notification, user_id), 1),
+                )
+            )
+    NotificationDelivery.objects.bulk_create(
+        deliveries, batch_size=chunk_size, ignore_conflicts=True
+    )
+    target_deliveries = NotificationDelivery.objects.filter(
+        notification__in={notification for notification, _ in targets}
+    )
+    record_new_deliveries(target_deliveries, now)
+    if entries:
+        _bulk_create_digest_entries(entries, chunk_size)
+
+    counts = dict(
+        target_deliveries.filter(created_at__gte=now)
+        .values("notification_id")
+        .annotate(inserted=Count("id"))
+        .values_list("notification_id", "inserted")
+        .order_by()
+    )
+    logger.info(f"Targeted deliveries created: {sum(counts.values())}")
+    return counts
+
+
+def sql_create_deliveries(notification, notif_type, after=None, upper=None) -> int:
+    """
+    Builds the deliveries of a global notification with a single INSERT ... SELECT
+    over the effective preferences (see preference_source_sql), so the audience
+    never leaves the database.
+    after/upper restrict the statement to one keyset chunk of users.
+
+    Rows are inserted as pending, like the Python engine, and are sent later by
+    the dispatcher. Email and SMS preferences of digestible types are buffered
+    with a second INSERT ... SELECT into the digest entries. Returns the number
+    of inserted deliveries.
+    """
+    delivery_table = connection.ops.quote_name(NotificationDelivery._meta.db_table)
+    digest_table = connection.ops.quote_name(DigestEntry._meta.db_table)
+    source, source_params = preference_source_sql(notif_type)
+    user_pk = User._meta.pk
+    now = timezone.now()
+    in_app = NotificationChannel.IN_APP.value
+
+    where = "1 = 1"
+    where_params = []
+    if after is not None:
+        where += " AND pref.user_id > %s"
+        where_params.append(user_pk.get_db_prep_value(after, connection))
+    if upper is not None:
+        where += " AND pref.user_id <= %s"
+        where_params.append(user_pk.get_db_prep_value(upper, connection))
+
+    delivery_where = where
+    delivery_params = list(where_params)
+    if notification.fanout_on_read:
+        # In-app items of fan-out-on-read notifications are materialized on read.
+        delivery_where += " AND pref.channel <> %s"
+        delivery_params.append(in_app)
+    if notif_type.is_digestible:
+        delivery_where += " AND pref.channel = %s"
+        delivery_params.append(in_app)
+
+    sql = f"""
+        INSERT INTO {delivery_table}
+            (created_at, updated_at, notification_id, user_id, channel,
+             status, is_read, attempts, collapse_key, collapsed_count)
+        SELECT %s, %s, %s, pref.user_id, pref.channel, %s, %s, %s, %s, %s
+        FROM {source} AS pref
+        WHERE {delivery_where}
+        ON CONFLICT DO NOTHING
+    """
+    params = [
+        now,
+        now,
+        notification.id,
+        "pending",
+        False,
+        0,
+        notification.collapse_key,
+        1,
+        *source_params,
+        *delivery_params,
+    ]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        count = cursor.rowcount
+
+        if notif_type.is_digestible:
+            cursor.execute(
+                f"""
+                INSERT INTO {digest_table}
+                    (created_at, updated_at, notification_id, user_id, channel)
+                SELECT %s, %s, %s, pref.user_id, pref.channel
+                FROM {source} AS pref
+                WHERE {where} AND pref.channel <> %s
+                ON CONFLICT DO NOTHING
+                """,
+                [now, now, notification.id, *source_params, *where_params, in_app],
+            )
+            logger.info(f"Digest entries buffered (sql engine): {cursor.rowcount}")
+
+    logger.info(f"Total deliveries created (sql engine): {count}")
+    return count
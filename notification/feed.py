@@ -0,0 +1,171 @@
+from django.db.models import (BigIntegerField, BooleanField, Exists, F,
+                              IntegerField, OuterRef, Q, Value)
+from django.db.models.functions import Coalesce
+
+from .models import Notification, NotificationChannel, NotificationDelivery
+from .preferences import preference_exists
+
+# Both sides of the feed union are projected to these columns, in this order.
+FEED_FIELDS = [
+    "item_id",
+    "item_notification",
+    "item_content",
+    "item_is_read",
+    "item_count",
+    "item_at",
+]
+
+
+def get_delivery_items(user, unread_only=False):
+    """
+    Personal deliveries of the user, projected to the feed columns.
+    """
+    deliveries = NotificationDelivery.objects.filter(user=user)
+    if unread_only:
+        deliveries = deliveries.filter(is_read=False, channel=NotificationChannel.IN_APP)
+
+    return (
+        deliveries.order_by()
+        .annotate(
+            item_id=F("id"),
+            item_notification=F("notification_id"),
+            item_content=F("notification__content_html"),
+            item_is_read=F("is_read"),
+            item_count=F("collapsed_count"),
+            item_at=Coalesce("sent_at", "created_at"),
+        )
+        .values(*FEED_FIELDS)
+    )
+
+
+def get_unread_global_notifications(user):
+    """
+    Global notifications stored once in fan-out-on-read mode that the user has
+    not read yet: newer than the user's join date, enabled for the in-app channel
+    in their preferences and not materialized as a delivery.
+    """
+    return Notification.objects.filter(
+        is_global=True,
+        fanout_on_read=True,
+        created_at__gte=user.created_at,
+    ).filter(
+        preference_exists(user, NotificationChannel.IN_APP),
+        ~Exists(
+            NotificationDelivery.objects.filter(
+                user=user,
+                notification=OuterRef("pk"),
+                channel=NotificationChannel.IN_APP,
+            )
+        ),
+    )
+
+
+def get_global_items(user):
+    """
+    Unread global notifications, projected to the same columns as the deliveries.
+    They have no delivery yet, so item_id is null.
+    """
+    return (
+        get_unread_global_notifications(user)
+        .order_by()
+        .annotate(
+            item_id=Value(None, output_field=BigIntegerField()),
+            item_notification=F("id"),
+            item_content=F("content_html"),
+            item_is_read=Value(False, output_field=BooleanField()),
+            item_count=Value(1, output_field=IntegerField()),
+            item_at=F("created_at"),
+        )
+        .values(*FEED_FIELDS)
+    )
+
+
+class FeedSource:
+    """
+    One side of the feed: a projected queryset and the column identifying its
+    items. Items are ordered by (item_at, rank, key) descending, so deliveries
+    (rank 1) come before global notifications (rank 0) at the same instant.
+    """
+
+    def __init__(self, rank, key, queryset):
+        self.rank = rank
+        self.key = key
+        self.queryset = queryset
+
+    def position(self, item) -> tuple:
+        return (item["item_at"], self.rank, item[self.key])
+
+    def page(self, limit, after=None, since=None, until=None):
+        """
+        Up to `limit` items of the source, newest first, strictly after the
+        (item_at, rank, key) position `after`, newer than `since` and not newer
+        than `until`. Each bound is a range on the index key, so the cost does
+        not depend on how deep the position is.
+        """
+        items = self.queryset
+        if since is not None:
+            items = items.filter(item_at__gt=since)
+        if until is not None:
+            items = items.filter(item_at__lte=until)
+        if after is not None:
+            at, rank, key = after
+            if self.rank < rank:
+                items = items.filter(item_at__lte=at)
+            elif self.rank > rank:
+                items = items.filter(item_at__lt=at)
+            else:
+                items = items.filter(
+                    Q(item_at__lt=at) | Q(item_at=at, **{f"{self.key}__lt": key})
+                )
+        return list(items.order_by("-item_at", f"-{self.key}")[:limit])
+
+
+def get_feed_sources(user, unread_only=False) -> list:
+    """
+    The user's personal deliveries and the global notifications that are fanned
+    out on read, merged by get_feed_page.
+    """
+    return [
+        FeedSource(1, "item_id", get_delivery_items(user, unread_only)),
+        FeedSource(0, "item_notification", get_global_items(user)),
+    ]
+
+
+def get_feed_page(sources, limit, after=None, since=None, until=None):
+    """
+    Merges the next `limit` items of every source, newest first. Each source is
+    read with its own keyset query, so no OFFSET or COUNT is needed. Returns the
+    items and the position of the last one when more items follow, else None.
+    """
+    candidates = [
+        (source.position(item), item)
+        for source in sources
+        for item in source.page(limit + 1, after, since, until)
+    ]
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+    page = candidates[:limit]
+    next_position = page[-1][0] if len(candidates) > limit else None
+    return [item for _, item in page], next_position
+
+
+def mark_global_notifications_read(user, notification_ids) -> int:
+    """
+    Materializes the in-app delivery of fan-out-on-read global notifications the
+    first time the user reads them. Returns the number of notifications marked.
+    """
+    notifications = get_unread_global_notifications(user).filter(
+        id__in=notification_ids
+    )
+    deliveries = [
+        NotificationDelivery(
+            notification_id=notification_id,
+            user=user,
+            channel=NotificationChannel.IN_APP,
+            status="sent",
+            sent_at=created_at,
+            is_read=True,
+        )
+        for notification_id, created_at in notifications.values_list("id", "created_at")
+    ]
+    NotificationDelivery.objects.bulk_create(deliveries, ignore_conflicts=True)
+    return len(deliveries)
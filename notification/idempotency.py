@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Notification
+
+
+def find_notifications(keys) -> tuple:
+    """
+    Looks the idempotency keys up with one query on the unique index.
+
+    Returns the notification id of every key used within
+    NOTIFICATION_IDEMPOTENCY_WINDOW_SECONDS, and the keys whose window expired
+    and may be reused.
+    """
+    keys = [key for key in keys if key]
+    if not keys:
+        return {}, []
+
+    window_start = timezone.now() - timedelta(
+        seconds=settings.NOTIFICATION_IDEMPOTENCY_WINDOW_SECONDS
+    )
+    recent = {}
+    expired = []
+    for key, notification_id, created_at in Notification.objects.filter(
+        idempotency_key__in=keys
+    ).values_list("idempotency_key", "id", "created_at"):
+        if created_at >= window_start:
+            recent[key] = notification_id
+        else:
+            expired.append(key)
+    return recent, expired
+
+
+def release_keys(keys):
+    """
+    Frees expired keys from their old notifications so they can be used again.
+    """
+    if keys:
+        Notification.objects.filter(idempotency_key__in=keys).update(
+            idempotency_key=None
+        )
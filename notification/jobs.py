@@ -0,0 +1,145 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .dispatch import dispatch_notification
+from .fanout import fan_out_chunk, get_target_users, iter_user_chunks
+from .models import NotificationJob
+
+logger = logging.getLogger("django")
+error_log = logging.getLogger("error_logger")
+
+CHECKPOINT_FIELDS = ["last_user_id", "processed", "delivery_count"]
+
+
+class LeaseLost(Exception):
+    """
+    The job was reclaimed by another worker after its lease expired.
+    """
+
+
+def enqueue_notification(notification) -> NotificationJob:
+    """
+    Writes the outbox entry that a worker will pick up to fan out and dispatch
+    the notification.
+    """
+    job = NotificationJob.objects.create(notification=notification)
+    logger.info(f"Notification job queued: id={job.id}, notification={notification.id}")
+    return job
+
+
+def claim_job(worker_id: str):
+    """
+    Claims the oldest runnable job with SELECT ... FOR UPDATE SKIP LOCKED, so
+    concurrent workers never pick the same job. Running jobs whose last checkpoint
+    is older than NOTIFICATION_JOB_LEASE_SECONDS are treated as abandoned by a
+    crashed worker and claimed again. Returns None when the queue is empty.
+    """
+    stale_before = timezone.now() - timedelta(
+        seconds=settings.NOTIFICATION_JOB_LEASE_SECONDS
+    )
+    with transaction.atomic():
+        job = (
+            NotificationJob.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status="queued") | Q(status="running", updated_at__lt=stale_before)
+            )
+            .order_by("created_at")
+            .first()
+        )
+        if job is None:
+            return None
+
+        if job.status == "running":
+            logger.warning(
+                f"Resuming abandoned notification job: id={job.id}, "
+                f"previous worker={job.locked_by}, checkpoint={job.last_user_id}"
+            )
+
+        job.status = "running"
+        job.locked_by = worker_id
+        job.attempts += 1
+        job.started_at = job.started_at or timezone.now()
+        job.save(
+            update_fields=["status", "locked_by", "attempts", "started_at", "updated_at"]
+        )
+
+    return job
+
+
+def save_job(job: NotificationJob, fields):
+    """
+    Writes the given fields of a claimed job and renews its lease. The update only
+    matches while the job is still running under this worker; raises LeaseLost
+    when another worker reclaimed it in the meantime.
+    """
+    updates = {field: getattr(job, field) for field in fields}
+    updates["updated_at"] = job.updated_at = timezone.now()
+    updated = NotificationJob.objects.filter(
+        pk=job.pk, status="running", locked_by=job.locked_by
+    ).update(**updates)
+    if not updated:
+        raise LeaseLost(f"Notification job {job.id} is no longer held by {job.locked_by}.")
+
+
+def run_job(job: NotificationJob):
+    """
+    Runs the fan-out and the dispatch of a claimed job and records the outcome.
+
+    The audience is walked in keyset chunks over User.id. Each chunk commits its
+    deliveries together with the job checkpoint, so a failed or crashed job resumes
+    after the last committed chunk and the deliveries become visible (and are
+    dispatched) while the job is still running.
+
+    Every checkpoint renews the job's lease, and so does every batch sent by the
+    dispatch between chunks. If the lease expired and another worker reclaimed
+    the job, the next write raises LeaseLost and this worker stops without
+    touching the job again.
+    """
+    notification = job.notification
+    notif_type = notification.notification_type
+    try:
+        users = get_target_users(notification)
+        if job.total is None:
+            job.total = users.count()
+            save_job(job, ["total"])
+
+        after = job.last_user_id
+        for upper, size in iter_user_chunks(users, after=after):
+            with transaction.atomic():
+                job.delivery_count += fan_out_chunk(
+                    notification, notif_type, users, after=after, upper=upper
+                )
+                job.processed = min(job.processed + size, job.total)
+                if upper is not None:
+                    job.last_user_id = str(upper)
+                save_job(job, CHECKPOINT_FIELDS)
+
+            dispatch_notification(notification, heartbeat=lambda: save_job(job, []))
+            after = upper
+
+        job.status = "completed"
+        job.error_message = None
+    except LeaseLost as e:
+        logger.warning(f"Notification job abandoned: {e}")
+        return job
+    except Exception as e:
+        job.status = "failed"
+        job.error_message = str(e)
+        error_log.error(f"Notification job failed: id={job.id}, error={e}")
+
+    job.finished_at = timezone.now()
+    try:
+        save_job(job, ["status", "error_message", "finished_at"])
+    except LeaseLost as e:
+        logger.warning(f"Notification job abandoned: {e}")
+        return job
+    logger.info(
+        f"Notification job finished: id={job.id}, status={job.status}, "
+        f"processed={job.processed}/{job.total}, deliveries={job.delivery_count}"
+    )
+    return job
@@ -0,0 +1,121 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from notification.fanout import get_chunk_users, iter_user_chunks
+from notification.models import NotificationType, PreferenceBackfill
+from notification.preferences import provision_default_preferences
+
+User = get_user_model()
+
+CHECKPOINT_FIELDS = ["last_user_id", "processed", "updated_at"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Stores the default preferences of a notification type for the existing users, "
+        "in keyset chunks of users. Progress is checkpointed, so an interrupted run "
+        "resumes where it stopped. Existing preferences are left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--type",
+            required=True,
+            help="notification_code of the type to backfill.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=settings.NOTIFICATION_FANOUT_CHUNK_SIZE,
+            help="Number of users backfilled per transaction.",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint of an unfinished backfill and start over.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Store the defaults even though NOTIFICATION_EAGER_PREFERENCES is off.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            notif_type = NotificationType.objects.get(notification_code=options["type"])
+        except NotificationType.DoesNotExist:
+            raise CommandError(f"Unknown notification type: {options['type']}")
+
+        if not settings.NOTIFICATION_EAGER_PREFERENCES and not options["force"]:
+            self.stdout.write(
+                "Users without a preference already receive the default channels of "
+                f"{notif_type.notification_code}, nothing to backfill. "
+                "Use --force to store them anyway."
+            )
+            return
+
+        backfill = self.get_backfill(notif_type, options["restart"])
+        users = User.objects.all()
+        if backfill.total is None:
+            backfill.total = users.count()
+            backfill.started_at = timezone.now()
+            backfill.save(update_fields=["total", "started_at", "updated_at"])
+        elif backfill.last_user_id:
+            self.stdout.write(f"Resuming backfill {backfill.id} after user {backfill.last_user_id}.")
+
+        started = time.monotonic()
+        processed = 0
+        after = backfill.last_user_id
+        try:
+            for upper, size in iter_user_chunks(users, after=after, chunk_size=options["chunk_size"]):
+                chunk_users = get_chunk_users(users, after, upper).values_list("id", flat=True)
+                with transaction.atomic():
+                    provision_default_preferences(chunk_users, [notif_type])
+                    backfill.processed = min(backfill.processed + size, backfill.total)
+                    if upper is not None:
+                        backfill.last_user_id = str(upper)
+                    backfill.save(update_fields=CHECKPOINT_FIELDS)
+                processed += size
+                after = upper
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"{backfill.processed}/{backfill.total} users backfilled "
+                    f"({processed / elapsed if elapsed else 0:.0f} users/s)"
+                )
+        except Exception as e:
+            backfill.status = "failed"
+            backfill.error_message = str(e)
+            backfill.save(update_fields=["status", "error_message", "updated_at"])
+            raise
+
+        backfill.status = "completed"
+        backfill.error_message = None
+        backfill.finished_at = timezone.now()
+        backfill.save(update_fields=["status", "error_message", "finished_at", "updated_at"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Backfilled {notif_type.notification_code} for {backfill.processed} users "
+                f"({backfill.rate or 0} users/s overall)."
+            )
+        )
+
+    def get_backfill(self, notif_type, restart) -> PreferenceBackfill:
+        """
+        Returns the latest backfill of the type to resume if it did not complete,
+        or a new one.
+        """
+        latest = (
+            PreferenceBackfill.objects.filter(notification_type=notif_type)
+            .order_by("-created_at")
+            .first()
+        )
+        if restart or latest is None or latest.status == "completed":
+            return PreferenceBackfill.objects.create(notification_type=notif_type)
+        latest.status = "running"
+        latest.save(update_fields=["status", "updated_at"])
+        return latest
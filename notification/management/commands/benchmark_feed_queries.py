@@ -0,0 +1,173 @@
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from notification.feed import get_feed_sources
+from notification.models import (Notification, NotificationChannel,
+                                 NotificationDelivery)
+from notification.registry import registry
+
+User = get_user_model()
+
+BENCHMARK_PREFIX = "benchmark"
+# Seeded rows are recognized by these markers only, never by their names: the
+# users get an address on a reserved domain, the notifications a metadata flag.
+BENCHMARK_EMAIL_DOMAIN = "notifyhub-benchmark.invalid"
+BENCHMARK_METADATA = {"benchmark": True}
+FEED_INDEXES = ["notification_delivery_history", "notification_delivery_unread"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the delivery queries of the history and unread feeds with and without "
+        "the feed indexes of NotificationDelivery: prints the query plan and the latency "
+        "of the first page of each. The indexes are dropped inside a transaction that is "
+        "rolled back, which needs PostgreSQL and locks the delivery table for the whole "
+        "run, so it only runs with DEBUG or --i-know-this-locks. Use --seed to create "
+        "benchmark data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Number of benchmark deliveries to create before running.",
+        )
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=1000,
+            help="Number of benchmark users the seeded deliveries are spread over.",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Number of timed runs per query.",
+        )
+        parser.add_argument(
+            "--cleanup",
+            action="store_true",
+            help="Delete the seeded benchmark users and notifications and exit.",
+        )
+        parser.add_argument(
+            "--i-know-this-locks",
+            action="store_true",
+            help="Run without DEBUG although DROP INDEX locks the delivery table "
+            "(ACCESS EXCLUSIVE) until the benchmark ends.",
+        )
+
+    def handle(self, *args, **options):
+        if options["cleanup"]:
+            Notification.objects.filter(metadata__benchmark=True).delete()
+            self.get_benchmark_users().delete()
+            self.stdout.write(self.style.SUCCESS("Benchmark data deleted."))
+            return
+
+        if connection.vendor != "postgresql":
+            raise CommandError("The benchmark needs PostgreSQL (transactional DROP INDEX).")
+        if not settings.DEBUG and not options["i_know_this_locks"]:
+            raise CommandError(
+                "Dropping the feed indexes locks the delivery table for the whole run. "
+                "Run with DEBUG or pass --i-know-this-locks."
+            )
+
+        if options["seed"]:
+            self.seed(options["seed"], options["users"])
+
+        user = self.get_benchmark_users().first() or User.objects.first()
+        if user is None:
+            raise CommandError("No user to benchmark, run with --seed.")
+
+        self.stdout.write(
+            f"{NotificationDelivery.objects.count()} deliveries, benchmarking user {user.id}"
+        )
+        self.run_queries("with indexes", user, options["repeat"])
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for name in FEED_INDEXES:
+                    cursor.execute(f"DROP INDEX IF EXISTS {connection.ops.quote_name(name)}")
+            self.run_queries("without indexes", user, options["repeat"])
+            transaction.set_rollback(True)
+
+    def get_benchmark_users(self):
+        return User.objects.filter(email__endswith=f"@{BENCHMARK_EMAIL_DOMAIN}")
+
+    def run_queries(self, label, user, repeat):
+        queries = {
+            "history": get_feed_sources(user)[0],
+            "unread": get_feed_sources(user, unread_only=True)[0],
+        }
+        for name, source in queries.items():
+            page = source.queryset.order_by("-item_at", f"-{source.key}")[:10]
+            self.stdout.write(f"\n== {name}, {label}")
+            self.stdout.write(page.explain(analyze=True))
+
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(page.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(
+                f"{name}, {label}: median {statistics.median(timings):.2f} ms, "
+                f"max {max(timings):.2f} ms over {repeat} runs"
+            )
+
+    def seed(self, count, user_count):
+        """
+        Spreads `count` in-app deliveries over `user_count` benchmark users, one
+        notification per round, with one delivery in ten left unread.
+        """
+        notif_type = registry.get("new_comment") or registry.active()[0]
+        run = uuid.uuid4().hex[:8]
+        users = User.objects.bulk_create(
+            [
+                User(
+                    username=f"{BENCHMARK_PREFIX}_{run}_{index}",
+                    email=f"{BENCHMARK_PREFIX}_{run}_{index}@{BENCHMARK_EMAIL_DOMAIN}",
+                    password=make_password(None),
+                )
+                for index in range(user_count)
+            ],
+            batch_size=5000,
+        )
+        user_ids = [user.id for user in users]
+        now = timezone.now()
+        rounds = -(-count // len(user_ids))
+        created = 0
+        for round_index in range(rounds):
+            notification = Notification.objects.create(
+                notification_type=notif_type,
+                title=f"{BENCHMARK_PREFIX} {round_index}",
+                content=f"Benchmark notification {round_index}",
+                metadata=BENCHMARK_METADATA,
+            )
+            sent_at = now - timedelta(minutes=rounds - round_index)
+            batch = user_ids[: count - created]
+            NotificationDelivery.objects.bulk_create(
+                [
+                    NotificationDelivery(
+                        notification=notification,
+                        user_id=user_id,
+                        channel=NotificationChannel.IN_APP,
+                        status="sent",
+                        sent_at=sent_at,
+                        is_read=(round_index + position) % 10 != 0,
+                    )
+                    for position, user_id in enumerate(batch)
+                ],
+                batch_size=5000,
+            )
+            created += len(batch)
+            if round_index % 50 == 0:
+                self.stdout.write(f"{created}/{count} deliveries seeded")
+        self.stdout.write(self.style.SUCCESS(f"Seeded {created} deliveries for {len(user_ids)} users."))
@@ -0,0 +1,120 @@
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from notification.fanout import get_chunk_users, iter_user_chunks
+from notification.models import NotificationPreference, NotificationPreferenceMask
+from notification.preferences import (CHANNEL_BITS, STORAGE_BITMASK,
+                                      STORAGE_ROWS, get_preference_cache,
+                                      mask_to_channels)
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Converts notification preferences between the row storage (one row per "
+        "channel) and the bitmask storage (one row per type), in keyset chunks of users. "
+        "Switch NOTIFICATION_PREFERENCE_STORAGE once the conversion is done."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--to",
+            choices=[STORAGE_BITMASK, STORAGE_ROWS],
+            default=STORAGE_BITMASK,
+            help="Target storage.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=settings.NOTIFICATION_FANOUT_CHUNK_SIZE,
+            help="Number of users converted per transaction.",
+        )
+        parser.add_argument(
+            "--delete-source",
+            action="store_true",
+            help="Delete the converted rows of the source storage.",
+        )
+
+    def handle(self, *args, **options):
+        convert = self.to_bitmask if options["to"] == STORAGE_BITMASK else self.to_rows
+        users = User.objects.all()
+        started = time.monotonic()
+        processed = 0
+        after = None
+
+        for upper, size in iter_user_chunks(users, chunk_size=options["chunk_size"]):
+            with transaction.atomic():
+                converted = convert(
+                    get_chunk_users(users, after, upper), options["delete_source"]
+                )
+            processed += size
+            after = upper
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"{processed} users converted ({converted} records in last chunk, "
+                f"{processed / elapsed if elapsed else 0:.0f} users/s)"
+            )
+
+        get_preference_cache().clear()
+        self.stdout.write(
+            self.style.SUCCESS(f"Converted the preferences of {processed} users to {options['to']}.")
+        )
+
+    def to_bitmask(self, users, delete_source) -> int:
+        rows = NotificationPreference.objects.filter(user__in=users)
+        masks = defaultdict(lambda: [0, 0])
+        for user_id, type_id, channel, enabled in rows.values_list(
+            "user_id", "notification_type_id", "channel", "enabled"
+        ).order_by():
+            mask = masks[(user_id, type_id)]
+            mask[1] |= CHANNEL_BITS[channel]
+            if enabled:
+                mask[0] |= CHANNEL_BITS[channel]
+
+        NotificationPreferenceMask.objects.bulk_create(
+            [
+                NotificationPreferenceMask(
+                    user_id=user_id,
+                    notification_type_id=type_id,
+                    channels=channels,
+                    overridden=overridden,
+                )
+                for (user_id, type_id), (channels, overridden) in masks.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["user", "notification_type"],
+            update_fields=["channels", "overridden", "updated_at"],
+        )
+        if delete_source:
+            rows.delete()
+        return len(masks)
+
+    def to_rows(self, users, delete_source) -> int:
+        masks = NotificationPreferenceMask.objects.filter(user__in=users)
+        rows = [
+            NotificationPreference(
+                user_id=user_id,
+                notification_type_id=type_id,
+                channel=channel,
+                enabled=bool(mask & CHANNEL_BITS[channel]),
+            )
+            for user_id, type_id, mask, overridden in masks.values_list(
+                "user_id", "notification_type_id", "channels", "overridden"
+            ).order_by()
+            for channel in mask_to_channels(overridden)
+        ]
+        NotificationPreference.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["user", "notification_type", "channel"],
+            update_fields=["enabled", "updated_at"],
+        )
+        if delete_source:
+            masks.delete()
+        return len(rows)
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from notification.digest import emit_digests
+
+
+class Command(BaseCommand):
+    help = (
+        "Aggregates the buffered email and SMS notifications of digestible types into "
+        "one digest notification per user. Run it at the end of every digest period."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--until",
+            default=None,
+            help="Only digest entries buffered before this ISO datetime (default: now). "
+            "Datetimes without an offset are in the current time zone.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=settings.NOTIFICATION_FANOUT_CHUNK_SIZE,
+            help="Number of users aggregated per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        until = options["until"]
+        if until is not None:
+            until = self.parse_until(until)
+        emitted = emit_digests(until=until, chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Emitted {emitted} digests."))
+
+    def parse_until(self, value):
+        try:
+            until = parse_datetime(value)
+        except ValueError:
+            until = None
+        if until is None:
+            raise CommandError(f"--until must be an ISO 8601 datetime, got {value!r}.")
+        if timezone.is_naive(until):
+            until = timezone.make_aware(until)
+        return until
@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from notification.dispatch import dispatch_due
+
+
+class Command(BaseCommand):
+    help = (
+        "Repeatedly claims due pending or failed deliveries in batches and sends them, "
+        "retrying with exponential backoff until they are dead-lettered."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.NOTIFICATION_FANOUT_CHUNK_SIZE,
+            help="Number of deliveries claimed per batch.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5.0,
+            help="Seconds to sleep when no delivery is due.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process the deliveries due now and exit.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        total = 0
+
+        while True:
+            claimed = dispatch_due(batch_size=batch_size)
+            total += claimed
+            if claimed:
+                self.stdout.write(f"Dispatched {claimed} due deliveries.")
+            if claimed < batch_size:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+
+        self.stdout.write(self.style.SUCCESS(f"Retried {total} deliveries."))
@@ -0,0 +1,54 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from notification.jobs import claim_job, run_job
+from notification.preferences import get_preference_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Claims queued notification jobs and runs their fan-out and dispatch. "
+        "Several workers can run concurrently, jobs are claimed with SKIP LOCKED."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--worker-id",
+            default=f"{socket.gethostname()}:{os.getpid()}",
+            help="Identifier recorded on the jobs claimed by this worker.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to sleep when the queue is empty.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Drain the queue and exit instead of polling forever.",
+        )
+
+    def handle(self, *args, **options):
+        worker_id = options["worker_id"]
+        self.stdout.write(f"Notification worker {worker_id} started.")
+
+        while True:
+            job = claim_job(worker_id)
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+
+            run_job(job)
+            stats = get_preference_cache().stats()
+            self.stdout.write(
+                f"Job {job.id}: {job.status} ({job.delivery_count} deliveries, "
+                f"preference cache hit rate {stats['hit_rate']})"
+            )
+
+        self.stdout.write(self.style.SUCCESS("Notification queue drained."))
@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from notification.counters import reconcile_counters
+from notification.fanout import get_chunk_users, iter_user_chunks
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the unread counters from the deliveries in keyset chunks of users "
+        "and fixes the ones that drifted, e.g. after deliveries were deleted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=settings.NOTIFICATION_FANOUT_CHUNK_SIZE,
+            help="Number of users reconciled per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        started = time.monotonic()
+        processed = 0
+        drifted = 0
+        after = None
+
+        for upper, size in iter_user_chunks(users, chunk_size=options["chunk_size"]):
+            user_ids = list(get_chunk_users(users, after, upper).values_list("id", flat=True))
+            with transaction.atomic():
+                drifted += reconcile_counters(user_ids)
+            processed += size
+            after = upper
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"{processed} users reconciled, {drifted} counters fixed "
+                f"({processed / elapsed if elapsed else 0:.0f} users/s)"
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Reconciled {processed} users, fixed {drifted} counters.")
+        )
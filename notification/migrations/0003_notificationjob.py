@@ -0,0 +1,88 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0002_create_notification_types"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="queued",
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "locked_by",
+                    models.CharField(
+                        blank=True,
+                        help_text="Identifier of the worker currently processing the job.",
+                        max_length=255,
+                        null=True,
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Number of times a worker claimed this job.",
+                    ),
+                ),
+                (
+                    "delivery_count",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Number of deliveries created by the fan-out.",
+                    ),
+                ),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                ("error_message", models.TextField(blank=True, null=True)),
+                (
+                    "notification",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="jobs",
+                        to="notification.notification",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Notification Job",
+                "verbose_name_plural": "Notification Jobs",
+                "ordering": ["created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["status", "created_at"],
+                        name="notificatio_status_92aba9_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0003_notificationjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationjob",
+            name="last_user_id",
+            field=models.CharField(
+                blank=True,
+                help_text="Checkpoint: id of the last user whose chunk was committed.",
+                max_length=64,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="notificationjob",
+            name="processed",
+            field=models.PositiveIntegerField(
+                default=0, help_text="Number of users fanned out so far."
+            ),
+        ),
+        migrations.AddField(
+            model_name="notificationjob",
+            name="total",
+            field=models.PositiveIntegerField(
+                blank=True, help_text="Number of users in the audience.", null=True
+            ),
+        ),
+    ]
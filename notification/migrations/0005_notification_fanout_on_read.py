@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0004_notificationjob_progress"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="fanout_on_read",
+            field=models.BooleanField(
+                default=False,
+                help_text="If True, the in-app delivery of this global notification is only created when a user reads it.",
+            ),
+        ),
+    ]
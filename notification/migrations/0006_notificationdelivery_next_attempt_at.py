@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0005_notification_fanout_on_read"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationdelivery",
+            name="next_attempt_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="When the retry scheduler should attempt the delivery again.",
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="notificationdelivery",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("sent", "Sent"),
+                    ("failed", "Failed"),
+                    ("dead", "Dead Letter"),
+                ],
+                default="pending",
+                max_length=10,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notificationdelivery",
+            index=models.Index(
+                fields=["status", "next_attempt_at"],
+                name="notificatio_status_feb6fb_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0006_notificationdelivery_next_attempt_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RateLimitBucket",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=100, unique=True)),
+                (
+                    "tokens",
+                    models.FloatField(help_text="Tokens available at refilled_at."),
+                ),
+                ("refilled_at", models.DateTimeField()),
+            ],
+            options={
+                "verbose_name": "Rate Limit Bucket",
+                "verbose_name_plural": "Rate Limit Buckets",
+            },
+        ),
+    ]
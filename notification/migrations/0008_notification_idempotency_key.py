@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0007_ratelimitbucket"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="idempotency_key",
+            field=models.CharField(
+                blank=True,
+                help_text="Key supplied by the producer to deduplicate retried triggers.",
+                max_length=255,
+                null=True,
+                unique=True,
+            ),
+        ),
+    ]
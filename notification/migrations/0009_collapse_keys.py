@@ -0,0 +1,46 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0008_notification_idempotency_key"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="collapse_key",
+            field=models.CharField(
+                blank=True,
+                help_text="Notifications sharing a collapse key are coalesced into one delivery per user.",
+                max_length=255,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="notificationdelivery",
+            name="collapse_key",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name="notificationdelivery",
+            name="collapsed_count",
+            field=models.PositiveIntegerField(
+                default=1,
+                help_text="Number of notifications coalesced into this delivery.",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notificationdelivery",
+            index=models.Index(
+                condition=models.Q(("collapse_key__isnull", False)),
+                fields=["user", "collapse_key"],
+                name="notification_delivery_collapse",
+            ),
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_digestible_types(apps, schema_editor):
+    """
+    Comments are the high-volume type, their email and SMS sends go to the digest.
+    """
+    NotificationType = apps.get_model("notification", "NotificationType")
+    NotificationType.objects.filter(notification_code="new_comment").update(
+        is_digestible=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0009_collapse_keys"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationtype",
+            name="is_digestible",
+            field=models.BooleanField(
+                default=False,
+                help_text="Email and SMS notifications of this type are buffered into the periodic digest.",
+            ),
+        ),
+        migrations.CreateModel(
+            name="DigestEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "channel",
+                    models.CharField(
+                        choices=[
+                            ("in_app", "In-App"),
+                            ("email", "Email"),
+                            ("sms", "SMS"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "digested_at",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="When the entry was included in a digest.",
+                        null=True,
+                    ),
+                ),
+                (
+                    "notification",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="digest_entries",
+                        to="notification.notification",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Digest Entry",
+                "verbose_name_plural": "Digest Entries",
+                "ordering": ["created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["digested_at", "user"],
+                        name="notificatio_digeste_f3f632_idx",
+                    )
+                ],
+                "unique_together": {("notification", "user", "channel")},
+            },
+        ),
+        migrations.RunPython(
+            mark_digestible_types, reverse_code=migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:37
+
+from django.db import migrations, models
+
+DEFAULT_TEMPLATES = {
+    "new_comment": {
+        "default": "New comment posted: {{ comment|default:'(no content)' }}",
+    },
+    "new_login": {
+        "default": "New login from an unrecognized device.",
+    },
+    "weekly_summary": {
+        "default": "Here is your weekly summary"
+        "{% if items %}: {% for item in items %}{{ item.count }} {{ item.name }}"
+        "{% if not forloop.last %}, {% endif %}{% endfor %}{% endif %}.",
+    },
+}
+
+
+def seed_templates(apps, schema_editor):
+    """
+    Moves the messages that were hardcoded in the trigger view to the types.
+    """
+    NotificationType = apps.get_model("notification", "NotificationType")
+    for code, templates in DEFAULT_TEMPLATES.items():
+        NotificationType.objects.filter(notification_code=code, templates={}).update(
+            templates=templates
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0010_digest"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationtype",
+            name="template_version",
+            field=models.PositiveIntegerField(
+                default=1,
+                help_text="Incremented on every save to invalidate compiled templates.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="notificationtype",
+            name="templates",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                help_text='Django template per channel, e.g. {"default": "...", "sms": "..."}. Channels without a template use the default one.',
+            ),
+        ),
+        migrations.RunPython(seed_templates, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,243 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:39
+
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Frozen copy of notification.renditions as of this migration, so later changes
+# to the live module do not change what the backfill computes.
+
+ALLOWED_TAGS = {
+    "a", "b", "blockquote", "br", "code", "em", "h1", "h2", "h3", "h4", "i",
+    "li", "ol", "p", "pre", "s", "span", "strong", "u", "ul",
+}
+ALLOWED_ATTRIBUTES = {"a": {"href", "title"}}
+ALLOWED_URL_SCHEMES = {"", "http", "https", "mailto"}
+VOID_TAGS = {"br"}
+# Tags dropped together with everything inside them.
+DROPPED_TAGS = {"script", "style", "iframe", "object", "embed", "template", "noscript"}
+BLOCK_TAGS = {
+    "blockquote", "br", "div", "h1", "h2", "h3", "h4", "h5", "h6", "li", "ol",
+    "p", "pre", "table", "tr", "ul",
+}
+
+GSM7_BASIC = (
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# Characters of the GSM-7 extension table take two septets.
+GSM7_EXTENDED = "^{}\\[~]|€\f"
+
+# (single segment, per segment of a multipart message)
+GSM7_LIMITS = (160, 153)
+UCS2_LIMITS = (70, 67)
+SMS_ELLIPSIS = "..."
+
+
+class HTMLSanitizer(HTMLParser):
+    """
+    Allowlist sanitizer for the CKEditor HTML: unknown tags are unwrapped,
+    dangerous ones dropped with their content, attributes other than a safe
+    link href/title removed, and open tags closed so the output is balanced.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        if tag in ("li", "p") and self.open_tags and self.open_tags[-1] == tag:
+            # Implicitly closed by a sibling, as in <li>one<li>two.
+            self.parts.append(f"</{self.open_tags.pop()}>")
+
+        attributes = ""
+        for name, value in attrs:
+            if name not in ALLOWED_ATTRIBUTES.get(tag, ()) or value is None:
+                continue
+            if name == "href":
+                value = "".join(value.split())
+                if urlsplit(value).scheme.lower() not in ALLOWED_URL_SCHEMES:
+                    continue
+            attributes += f' {name}="{escape(value)}"'
+
+        self.parts.append(f"<{tag}{attributes}>")
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.parts.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.parts.append(escape(data, quote=False))
+
+    def get_html(self):
+        self.close()
+        closing = [f"</{tag}>" for tag in reversed(self.open_tags)]
+        return "".join(self.parts + closing)
+
+
+class TextExtractor(HTMLParser):
+    """
+    Converts HTML to plain text, keeping one line per block element.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            self.dropping += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n- " if tag == "li" else "\n")
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.parts.append(data)
+
+    def get_text(self):
+        self.close()
+        lines = (" ".join(line.split()) for line in "".join(self.parts).splitlines())
+        return "\n".join(line for line in lines if line)
+
+
+def sanitize_html(html) -> str:
+    sanitizer = HTMLSanitizer()
+    sanitizer.feed(html or "")
+    return sanitizer.get_html()
+
+
+def html_to_text(html) -> str:
+    extractor = TextExtractor()
+    extractor.feed(html or "")
+    return extractor.get_text()
+
+
+def truncate_sms(text, max_segments=None) -> str:
+    """
+    Truncates text to NOTIFICATION_SMS_MAX_SEGMENTS segments. Text made only of
+    GSM-7 characters gets 160 characters (153 per segment when split), any other
+    text is sent as UCS-2 with 70 (67) code units.
+    """
+    max_segments = max_segments or getattr(settings, "NOTIFICATION_SMS_MAX_SEGMENTS", 1)
+    allowed = GSM7_BASIC + GSM7_EXTENDED
+    if all(char in allowed for char in text):
+        single, multipart = GSM7_LIMITS
+        cost = lambda char: 2 if char in GSM7_EXTENDED else 1  # noqa: E731
+    else:
+        single, multipart = UCS2_LIMITS
+        cost = lambda char: 2 if ord(char) > 0xFFFF else 1  # noqa: E731
+
+    length = sum(cost(char) for char in text)
+    limit = single if max_segments == 1 else multipart * max_segments
+    if length <= max(single, limit):
+        return text
+
+    budget = limit - len(SMS_ELLIPSIS)
+    used = 0
+    end = 0
+    for end, char in enumerate(text):
+        used += cost(char)
+        if used > budget:
+            break
+    return text[:end].rstrip() + SMS_ELLIPSIS
+
+
+def build_renditions(html) -> dict:
+    """
+    Computes the channel renditions of HTML content: sanitized HTML for in-app
+    and email, plain text for the email body and SMS text within the segment
+    limit.
+    """
+    text = html_to_text(html)
+    return {
+        "content_html": sanitize_html(html),
+        "content_text": text,
+        "content_sms": truncate_sms(" ".join(text.split())),
+    }
+
+
+RENDITION_FIELDS = ["content_html", "content_text", "content_sms"]
+
+
+def backfill_renditions(apps, schema_editor):
+    Notification = apps.get_model("notification", "Notification")
+    batch = []
+    for notification in Notification.objects.only("id", "content").iterator(chunk_size=1000):
+        for field, value in build_renditions(notification.content).items():
+            setattr(notification, field, value)
+        batch.append(notification)
+        if len(batch) >= 1000:
+            Notification.objects.bulk_update(batch, RENDITION_FIELDS)
+            batch = []
+    if batch:
+        Notification.objects.bulk_update(batch, RENDITION_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0011_notification_templates"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="content_html",
+            field=models.TextField(
+                blank=True,
+                editable=False,
+                help_text="Sanitized HTML rendition of the content.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="content_sms",
+            field=models.TextField(
+                blank=True,
+                editable=False,
+                help_text="Plain text rendition truncated to the SMS segment limit.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="content_text",
+            field=models.TextField(
+                blank=True,
+                editable=False,
+                help_text="Plain text rendition of the content.",
+            ),
+        ),
+        migrations.RunPython(backfill_renditions, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0012_notification_renditions"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationPreferenceMask",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "channels",
+                    models.PositiveSmallIntegerField(
+                        default=0, help_text="Bitmask of the enabled channels."
+                    ),
+                ),
+                (
+                    "notification_type",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="preference_masks",
+                        to="notification.notificationtype",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Notification Preference Mask",
+                "verbose_name_plural": "Notification Preference Masks",
+                "ordering": ["user", "notification_type"],
+                "unique_together": {("user", "notification_type")},
+            },
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:47
+
+import notification.models
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+IN_APP = "in_app"
+ALL_CHANNELS_MASK = 7
+
+
+def preserve_explicit_preferences(apps, schema_editor):
+    """
+    Until now every channel was opt-in and signup wrote an in_app row for every
+    type. Existing masks become fully overridden, and users without an in_app
+    row had deleted it to opt out, which is kept as a disabled row now that
+    in_app is enabled by default.
+    """
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    NotificationType = apps.get_model("notification", "NotificationType")
+    NotificationPreference = apps.get_model("notification", "NotificationPreference")
+    NotificationPreferenceMask = apps.get_model(
+        "notification", "NotificationPreferenceMask"
+    )
+
+    NotificationPreferenceMask.objects.update(overridden=ALL_CHANNELS_MASK)
+    if NotificationPreferenceMask.objects.exists():
+        # The masks already hold every opt-out explicitly.
+        return
+
+    for notif_type in NotificationType.objects.all():
+        opted_out = User.objects.filter(
+            ~Exists(
+                NotificationPreference.objects.filter(
+                    user=OuterRef("pk"), notification_type=notif_type, channel=IN_APP
+                )
+            )
+        ).values_list("id", flat=True)
+        NotificationPreference.objects.bulk_create(
+            (
+                NotificationPreference(
+                    user_id=user_id,
+                    notification_type=notif_type,
+                    channel=IN_APP,
+                    enabled=False,
+                )
+                for user_id in opted_out.iterator(chunk_size=2000)
+            ),
+            batch_size=2000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0013_notificationpreferencemask"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationpreference",
+            name="enabled",
+            field=models.BooleanField(
+                default=True, help_text="False opts the user out of a default channel."
+            ),
+        ),
+        migrations.AddField(
+            model_name="notificationpreferencemask",
+            name="overridden",
+            field=models.PositiveSmallIntegerField(
+                default=0, help_text="Bitmask of the channels the user set explicitly."
+            ),
+        ),
+        migrations.AddField(
+            model_name="notificationtype",
+            name="default_channels",
+            field=models.JSONField(
+                blank=True,
+                default=notification.models.get_default_channels,
+                help_text="Channels enabled for users without an explicit preference for them.",
+            ),
+        ),
+        migrations.RunPython(
+            preserve_explicit_preferences, reverse_code=migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0014_implicit_default_preferences"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PreferenceBackfill",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="running",
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "last_user_id",
+                    models.CharField(
+                        blank=True,
+                        help_text="Checkpoint: id of the last user whose chunk was committed.",
+                        max_length=64,
+                        null=True,
+                    ),
+                ),
+                (
+                    "processed",
+                    models.PositiveIntegerField(
+                        default=0, help_text="Number of users backfilled so far."
+                    ),
+                ),
+                (
+                    "total",
+                    models.PositiveIntegerField(
+                        blank=True,
+                        help_text="Number of users when the backfill started.",
+                        null=True,
+                    ),
+                ),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                ("error_message", models.TextField(blank=True, null=True)),
+                (
+                    "notification_type",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="backfills",
+                        to="notification.notificationtype",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Preference Backfill",
+                "verbose_name_plural": "Preference Backfills",
+                "ordering": ["created_at"],
+            },
+        ),
+    ]
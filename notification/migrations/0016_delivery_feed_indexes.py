@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:56
+
+import django.db.models.functions.comparison
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0015_preferencebackfill"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notificationdelivery",
+            index=models.Index(
+                models.F("user"),
+                models.OrderBy(
+                    django.db.models.functions.comparison.Coalesce(
+                        "sent_at", "created_at"
+                    ),
+                    descending=True,
+                ),
+                models.OrderBy(models.F("id"), descending=True),
+                name="notification_delivery_history",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notificationdelivery",
+            index=models.Index(
+                models.F("user"),
+                models.OrderBy(
+                    django.db.models.functions.comparison.Coalesce(
+                        "sent_at", "created_at"
+                    ),
+                    descending=True,
+                ),
+                models.OrderBy(models.F("id"), descending=True),
+                condition=models.Q(("channel", "in_app"), ("is_read", False)),
+                name="notification_delivery_unread",
+            ),
+        ),
+    ]
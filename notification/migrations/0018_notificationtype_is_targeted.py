@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:15
+
+from django.db import migrations, models
+
+
+def mark_targeted_types(apps, schema_editor):
+    """
+    new_login was the only event sent to a single user.
+    """
+    NotificationType = apps.get_model("notification", "NotificationType")
+    NotificationType.objects.filter(notification_code="new_login").update(
+        is_targeted=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0017_unreadcounter"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationtype",
+            name="is_targeted",
+            field=models.BooleanField(
+                default=False,
+                help_text="Events of this type go to the user in data.user_id instead of every user.",
+            ),
+        ),
+        migrations.RunPython(
+            mark_targeted_types, reverse_code=migrations.RunPython.noop
+        ),
+    ]
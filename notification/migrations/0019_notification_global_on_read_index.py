@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notification", "0018_notificationtype_is_targeted"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(("fanout_on_read", True), ("is_global", True)),
+                fields=["-created_at", "-id"],
+                name="notification_global_on_read",
+            ),
+        ),
+    ]
@@ -1,9 +1,14 @@
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django_ckeditor_5.fields import CKEditor5Field
 
 from utils.base_model import TimeStampedModel
 
+from .renditions import set_renditions
+
 User = get_user_model()
 
 
@@ -13,6 +18,10 @@ class NotificationChannel(models.TextChoices):
     SMS = "sms", "SMS"
 
 
+def get_default_channels():
+    return [NotificationChannel.IN_APP.value]
+
+
 class NotificationType(TimeStampedModel):
     """
     Defines the type of event that can trigger a notification, e.g., new_comment, new_login.
@@ -23,9 +32,44 @@ class NotificationType(TimeStampedModel):
     is_active = models.BooleanField(
         default=True, help_text="Controls if this type is currently in use."
     )
+    is_digestible = models.BooleanField(
+        default=False,
+        help_text="Email and SMS notifications of this type are buffered into the periodic digest.",
+    )
+    is_targeted = models.BooleanField(
+        default=False,
+        help_text="Events of this type go to the user in data.user_id instead of every user.",
+    )
+    default_channels = models.JSONField(
+        default=get_default_channels,
+        blank=True,
+        help_text="Channels enabled for users without an explicit preference for them.",
+    )
+    templates = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text='Django template per channel, e.g. {"default": "...", "sms": "..."}. '
+        "Channels without a template use the default one.",
+    )
+    template_version = models.PositiveIntegerField(
+        default=1, help_text="Incremented on every save to invalidate compiled templates."
+    )
+
     def __str__(self):
         return self.name
 
+    def clean(self):
+        unknown = set(self.default_channels or []) - set(NotificationChannel.values)
+        if unknown:
+            raise ValidationError(
+                {"default_channels": f"Unknown channels: {', '.join(sorted(unknown))}."}
+            )
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            self.template_version += 1
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Notification Type"
         verbose_name_plural = "Notification Types"
@@ -35,6 +79,8 @@ class NotificationType(TimeStampedModel):
 class NotificationPreference(TimeStampedModel):
     """
     Tracks which user wants to receive which notification type through which channel.
+    A row overrides the type's default channels for its channel: enabled opts in,
+    disabled opts out. Channels without a row follow NotificationType.default_channels.
     """
     
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -42,6 +88,9 @@ class NotificationPreference(TimeStampedModel):
         NotificationType, on_delete=models.CASCADE, related_name="preferences"
     )
     channel = models.CharField(max_length=20, choices=NotificationChannel.choices)
+    enabled = models.BooleanField(
+        default=True, help_text="False opts the user out of a default channel."
+    )
 
     class Meta:
         unique_together = ("user", "notification_type", "channel")
@@ -53,6 +102,39 @@ class NotificationPreference(TimeStampedModel):
         return f"{self.user} - {self.notification_type.notification_code} via {self.channel}"
 
 
+class NotificationPreferenceMask(TimeStampedModel):
+    """
+    Compact preference storage: one row per user and notification type holding
+    the overridden channels and, among them, the enabled ones as bitmasks (see
+    notification.preferences.CHANNEL_BITS). Channels that are not overridden
+    follow the type's default channels. Used instead of NotificationPreference
+    when NOTIFICATION_PREFERENCE_STORAGE is "bitmask".
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    notification_type = models.ForeignKey(
+        NotificationType, on_delete=models.CASCADE, related_name="preference_masks"
+    )
+    channels = models.PositiveSmallIntegerField(
+        default=0, help_text="Bitmask of the enabled channels."
+    )
+    overridden = models.PositiveSmallIntegerField(
+        default=0, help_text="Bitmask of the channels the user set explicitly."
+    )
+
+    class Meta:
+        unique_together = ("user", "notification_type")
+        verbose_name = "Notification Preference Mask"
+        verbose_name_plural = "Notification Preference Masks"
+        ordering = ["user", "notification_type"]
+
+    def __str__(self):
+        return (
+            f"{self.user} - {self.notification_type.notification_code} "
+            f"({self.channels:03b}/{self.overridden:03b})"
+        )
+
+
 class Notification(TimeStampedModel):
     """
     Represents a notification event with title and message content.
@@ -67,23 +149,69 @@ class Notification(TimeStampedModel):
         blank=True,
         help_text="Content of the notification message.",
     )
+    content_html = models.TextField(
+        blank=True, editable=False, help_text="Sanitized HTML rendition of the content."
+    )
+    content_text = models.TextField(
+        blank=True, editable=False, help_text="Plain text rendition of the content."
+    )
+    content_sms = models.TextField(
+        blank=True,
+        editable=False,
+        help_text="Plain text rendition truncated to the SMS segment limit.",
+    )
     is_global = models.BooleanField(
         default=False,
         help_text="If True, this notification should be sent to all users.",
     )
+    fanout_on_read = models.BooleanField(
+        default=False,
+        help_text="If True, the in-app delivery of this global notification is only "
+        "created when a user reads it.",
+    )
     metadata = models.JSONField(
         blank=True,
         null=True,
         help_text="Optional structured data for dynamic notifications.",
     )
+    idempotency_key = models.CharField(
+        max_length=255,
+        unique=True,
+        null=True,
+        blank=True,
+        help_text="Key supplied by the producer to deduplicate retried triggers.",
+    )
+    collapse_key = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        help_text="Notifications sharing a collapse key are coalesced into one delivery per user.",
+    )
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        set_renditions(self)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "content" in update_fields:
+            kwargs["update_fields"] = {
+                *update_fields, "content_html", "content_text", "content_sms"
+            }
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Notification"
         verbose_name_plural = "Notifications"
         ordering = ["-created_at"]
+        indexes = [
+            # Global notifications fanned out on read are read by created_at, newest first.
+            models.Index(
+                fields=["-created_at", "-id"],
+                condition=models.Q(is_global=True, fanout_on_read=True),
+                name="notification_global_on_read",
+            ),
+        ]
 
 
 class NotificationDelivery(TimeStampedModel):
@@ -95,6 +223,7 @@ class NotificationDelivery(TimeStampedModel):
         ("pending", "Pending"),
         ("sent", "Sent"),
         ("failed", "Failed"),
+        ("dead", "Dead Letter"),
     ]
 
     notification = models.ForeignKey(
@@ -116,12 +245,229 @@ class NotificationDelivery(TimeStampedModel):
     attempts = models.PositiveIntegerField(
         default=0, help_text="Number of delivery attempts made."
     )
+    next_attempt_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the retry scheduler should attempt the delivery again.",
+    )
+    collapse_key = models.CharField(max_length=255, null=True, blank=True)
+    collapsed_count = models.PositiveIntegerField(
+        default=1, help_text="Number of notifications coalesced into this delivery."
+    )
 
     class Meta:
         unique_together = ("notification", "user", "channel")
         verbose_name = "Notification Delivery"
         verbose_name_plural = "Notification Deliveries"
         ordering = ["-sent_at", "user"]
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+            models.Index(
+                fields=["user", "collapse_key"],
+                condition=models.Q(collapse_key__isnull=False),
+                name="notification_delivery_collapse",
+            ),
+            # The feed orders deliveries by Coalesce(sent_at, created_at), newest first.
+            models.Index(
+                models.F("user"),
+                Coalesce("sent_at", "created_at").desc(),
+                models.F("id").desc(),
+                name="notification_delivery_history",
+            ),
+            models.Index(
+                models.F("user"),
+                Coalesce("sent_at", "created_at").desc(),
+                models.F("id").desc(),
+                condition=models.Q(is_read=False, channel="in_app"),
+                name="notification_delivery_unread",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user} - {self.notification.title} via {self.channel} ({self.status})"
+
+
+class NotificationJob(TimeStampedModel):
+    """
+    Outbox entry for a triggered notification. Workers claim queued jobs and run
+    the fan-out and dispatch outside of the HTTP request.
+    """
+
+    STATUS_CHOICES = [
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("completed", "Completed"),
+        ("failed", "Failed"),
+    ]
+
+    notification = models.ForeignKey(
+        Notification, on_delete=models.CASCADE, related_name="jobs"
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="queued")
+    locked_by = models.CharField(
+        max_length=255,
+        blank=True,
+        null=True,
+        help_text="Identifier of the worker currently processing the job.",
+    )
+    attempts = models.PositiveIntegerField(
+        default=0, help_text="Number of times a worker claimed this job."
+    )
+    delivery_count = models.PositiveIntegerField(
+        default=0, help_text="Number of deliveries created by the fan-out."
+    )
+    last_user_id = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        help_text="Checkpoint: id of the last user whose chunk was committed.",
+    )
+    processed = models.PositiveIntegerField(
+        default=0, help_text="Number of users fanned out so far."
+    )
+    total = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Number of users in the audience."
+    )
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error_message = models.TextField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Notification Job"
+        verbose_name_plural = "Notification Jobs"
+        ordering = ["created_at"]
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    def __str__(self):
+        return f"Job {self.id} - {self.notification.title} ({self.status})"
+
+    @property
+    def rate(self):
+        """
+        Users fanned out per second since the job was first started.
+        """
+        if not self.started_at:
+            return None
+        end = self.finished_at or timezone.now()
+        elapsed = (end - self.started_at).total_seconds()
+        if elapsed <= 0:
+            return None
+        return round(self.processed / elapsed, 2)
+
+
+class RateLimitBucket(models.Model):
+    """
+    Token bucket shared by every worker process, used to throttle outbound sends
+    per channel or per provider.
+    """
+
+    key = models.CharField(max_length=100, unique=True)
+    tokens = models.FloatField(help_text="Tokens available at refilled_at.")
+    refilled_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Rate Limit Bucket"
+        verbose_name_plural = "Rate Limit Buckets"
+
+    def __str__(self):
+        return f"{self.key} ({self.tokens:.1f} tokens)"
+
+
+class DigestEntry(TimeStampedModel):
+    """
+    Email or SMS notification of a digestible type buffered for a user until the
+    digest of the period is emitted.
+    """
+
+    notification = models.ForeignKey(
+        Notification, on_delete=models.CASCADE, related_name="digest_entries"
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    channel = models.CharField(max_length=20, choices=NotificationChannel.choices)
+    digested_at = models.DateTimeField(
+        null=True, blank=True, help_text="When the entry was included in a digest."
+    )
+
+    class Meta:
+        unique_together = ("notification", "user", "channel")
+        verbose_name = "Digest Entry"
+        verbose_name_plural = "Digest Entries"
+        ordering = ["created_at"]
+        indexes = [models.Index(fields=["digested_at", "user"])]
+
+    def __str__(self):
+        return f"{self.user} - {self.notification.title} via {self.channel}"
+
+
+class PreferenceBackfill(TimeStampedModel):
+    """
+    Checkpointed run of the backfill_preferences command, which stores the
+    default preferences of a notification type for the existing users.
+    """
+
+    STATUS_CHOICES = [
+        ("running", "Running"),
+        ("completed", "Completed"),
+        ("failed", "Failed"),
+    ]
+
+    notification_type = models.ForeignKey(
+        NotificationType, on_delete=models.CASCADE, related_name="backfills"
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="running")
+    last_user_id = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        help_text="Checkpoint: id of the last user whose chunk was committed.",
+    )
+    processed = models.PositiveIntegerField(
+        default=0, help_text="Number of users backfilled so far."
+    )
+    total = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Number of users when the backfill started."
+    )
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error_message = models.TextField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Preference Backfill"
+        verbose_name_plural = "Preference Backfills"
+        ordering = ["created_at"]
+
+    def __str__(self):
+        return f"Backfill {self.id} - {self.notification_type.notification_code} ({self.status})"
+
+    @property
+    def rate(self):
+        """
+        Users backfilled per second since the backfill was first started.
+        """
+        if not self.started_at:
+            return None
+        end = self.finished_at or timezone.now()
+        elapsed = (end - self.started_at).total_seconds()
+        if elapsed <= 0:
+            return None
+        return round(self.processed / elapsed, 2)
+
+
+class UnreadCounter(TimeStampedModel):
+    """
+    Number of unread deliveries of a user per channel, maintained incrementally
+    by the fan-out and the read endpoint (see notification.counters) and
+    corrected by the reconcile_unread_counters command.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    channel = models.CharField(max_length=20, choices=NotificationChannel.choices)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("user", "channel")
+        verbose_name = "Unread Counter"
+        verbose_name_plural = "Unread Counters"
+
+    def __str__(self):
+        return f"{self.user} - {self.channel}: {self.count}"
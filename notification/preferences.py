@@ -0,0 +1,687 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.db.models import (CharField, Exists, F, IntegerField, OuterRef, Q,
+                              Value)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (NotificationChannel, NotificationPreference,
+                     NotificationPreferenceMask)
+from .registry import registry
+
+logger = logging.getLogger("django")
+User = get_user_model()
+
+STORAGE_ROWS = "rows"
+STORAGE_BITMASK = "bitmask"
+
+CHANNEL_BITS = {
+    NotificationChannel.IN_APP.value: 1,
+    NotificationChannel.EMAIL.value: 2,
+    NotificationChannel.SMS.value: 4,
+}
+ALL_CHANNELS_MASK = sum(CHANNEL_BITS.values())
+# Position of each channel in the synthetic ids of bitmask preference entries.
+CHANNEL_INDEX = list(CHANNEL_BITS)
+ENTRY_ID_STRIDE = 8
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class PreferenceCache:
+    """
+    Resolves the channels a user receives a notification type through, keyed by
+    (user_id, notification_type_id).
+
+    Entries live in a size-capped in-process LRU and, when `backend` names a
+    Django cache alias, in that shared cache too. Writes invalidate both through
+    the NotificationPreference signals; since other processes only see the
+    shared cache, local entries also expire after `local_ttl` seconds.
+
+    Shared entries are stored under the current version of their user and the
+    global generation, which invalidation bumps instead of deleting keys. A
+    loader reads the versions before querying the database and writes under
+    them, so an invalidation racing with the load leaves the stale result under
+    a version that is never read again. Local entries follow the same rule with
+    a process-wide epoch.
+    """
+
+    GENERATION_KEY = "notification:preferences:generation"
+
+    def __init__(self, max_size=10000, local_ttl=60, backend=None, timeout=300):
+        self.max_size = max_size
+        self.local_ttl = local_ttl
+        self.backend = caches[backend] if backend else None
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(user_id, type_id):
+        return (str(user_id), int(type_id))
+
+    @staticmethod
+    def backend_key(key, version):
+        generation, user_version = version
+        return f"notification:preferences:{generation}:{user_version}:{key[0]}:{key[1]}"
+
+    @staticmethod
+    def user_version_key(user_id):
+        return f"notification:preferences:version:{user_id}"
+
+    def get_versions(self, keys) -> tuple:
+        """
+        Returns the versions to read and write the keys under: the local epoch
+        and, with a shared cache, the (generation, user version) of every user.
+        """
+        with self._lock:
+            epoch = self._epoch
+        if self.backend is None:
+            return epoch, {}
+
+        user_ids = {key[0] for key in keys}
+        version_keys = [self.user_version_key(user_id) for user_id in user_ids]
+        stored = self.backend.get_many([self.GENERATION_KEY, *version_keys])
+        generation = stored.get(self.GENERATION_KEY, 0)
+        return epoch, {
+            user_id: (generation, stored.get(self.user_version_key(user_id), 0))
+            for user_id in user_ids
+        }
+
+    def get_many(self, keys, versions=None) -> dict:
+        """
+        Returns the cached channel sets of the keys that are cached, locally or
+        in the shared cache.
+        """
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                expires_at, channels = entry
+                if expires_at < now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = channels
+
+        missing = [key for key in keys if key not in found]
+        if self.backend is not None and missing:
+            epoch, shared_versions = versions or self.get_versions(missing)
+            backend_keys = {
+                key: self.backend_key(key, shared_versions[key[0]]) for key in missing
+            }
+            shared = self.backend.get_many(list(backend_keys.values()))
+            shared_found = {
+                key: frozenset(shared[backend_key])
+                for key, backend_key in backend_keys.items()
+                if backend_key in shared
+            }
+            self._store_local(shared_found, epoch)
+            found.update(shared_found)
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, mapping, versions=None):
+        """
+        Caches channel sets loaded under `versions`, as returned by get_versions()
+        before the load.
+        """
+        epoch, shared_versions = versions or self.get_versions(mapping)
+        self._store_local(mapping, epoch)
+        if self.backend is not None and mapping:
+            self.backend.set_many(
+                {
+                    self.backend_key(key, shared_versions[key[0]]): list(channels)
+                    for key, channels in mapping.items()
+                },
+                timeout=self.timeout,
+            )
+
+    def _store_local(self, mapping, epoch):
+        expires_at = time.monotonic() + self.local_ttl
+        with self._lock:
+            if epoch != self._epoch:
+                # Invalidated while loading.
+                return
+            for key, channels in mapping.items():
+                self._entries[key] = (expires_at, channels)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id, type_id):
+        key = self.make_key(user_id, type_id)
+        with self._lock:
+            self._epoch += 1
+            self._entries.pop(key, None)
+        if self.backend is not None:
+            self.backend.set(self.user_version_key(key[0]), time.time_ns(), timeout=None)
+
+    def invalidate_all(self):
+        """
+        Drops every cached resolution, e.g. after the default channels of a type
+        changed.
+        """
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+        if self.backend is not None:
+            self.backend.set(self.GENERATION_KEY, time.time_ns(), timeout=None)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "size": len(self._entries),
+            }
+
+
+def get_preference_cache() -> PreferenceCache:
+    """
+    Returns the process-wide preference cache configured by
+    NOTIFICATION_PREFERENCE_CACHE.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = settings.NOTIFICATION_PREFERENCE_CACHE
+                _cache = PreferenceCache(
+                    max_size=config.get("MAX_SIZE", 10000),
+                    local_ttl=config.get("LOCAL_TTL", 60),
+                    backend=config.get("BACKEND"),
+                    timeout=config.get("TIMEOUT", 300),
+                )
+    return _cache
+
+
+def resolve_channels(pairs) -> dict:
+    """
+    Returns the enabled channels of every (user_id, notification_type_id) pair as
+    a frozenset: the user's overrides applied over the type's default channels.
+    Pairs missing from the cache are resolved with one query per table and
+    cached, including the ones without any channel.
+    """
+    cache = get_preference_cache()
+    keys = {cache.make_key(user_id, type_id) for user_id, type_id in pairs}
+    versions = cache.get_versions(keys)
+    channels = cache.get_many(list(keys), versions)
+
+    missing = keys - channels.keys()
+    if missing:
+        user_ids = {user_id for user_id, _ in missing}
+        type_ids = {type_id for _, type_id in missing}
+        defaults = get_type_defaults(type_ids)
+        overrides = get_overrides(user_ids, type_ids)
+        loaded = {
+            key: apply_overrides(defaults.get(key[1], frozenset()), overrides.get(key, {}))
+            for key in missing
+        }
+        cache.set_many(loaded, versions)
+        channels.update(loaded)
+    return channels
+
+
+def invalidate_preference(user_id, type_id):
+    """
+    Invalidates the cached channels of a user for a type, now and again once the
+    transaction commits, since a load between the write and the commit would
+    still cache the old preference.
+    """
+    cache = get_preference_cache()
+    cache.invalidate(user_id, type_id)
+    transaction.on_commit(lambda: cache.invalidate(user_id, type_id))
+
+
+def invalidate_type_preferences():
+    """
+    Invalidates every cached resolution, now and once the transaction commits.
+    Used when the default channels of a type may have changed.
+    """
+    cache = get_preference_cache()
+    cache.invalidate_all()
+    transaction.on_commit(cache.invalidate_all)
+
+
+def get_storage() -> str:
+    """
+    Returns the preference storage in use, "rows" (one NotificationPreference
+    per channel) or "bitmask" (one NotificationPreferenceMask per type).
+    """
+    return settings.NOTIFICATION_PREFERENCE_STORAGE
+
+
+def channels_to_mask(channels) -> int:
+    mask = 0
+    for channel in channels:
+        mask |= CHANNEL_BITS[channel]
+    return mask
+
+
+def mask_to_channels(mask) -> list:
+    return [channel for channel, bit in CHANNEL_BITS.items() if mask & bit]
+
+
+def get_type_defaults(type_ids=None) -> dict:
+    """
+    Returns the default channels of the given types, or of every type, as
+    {notification_type_id: frozenset}, from the type registry.
+    """
+    if type_ids is None:
+        types = registry.all()
+    else:
+        types = filter(None, (registry.get_by_id(type_id) for type_id in type_ids))
+    return {
+        notif_type.id: frozenset(notif_type.default_channels or ())
+        for notif_type in types
+    }
+
+
+def get_overrides(user_ids, type_ids) -> dict:
+    """
+    Returns the explicit preferences of the users for the types as
+    {(user_id, type_id): {channel: enabled}}, keyed like the preference cache.
+    """
+    overrides = defaultdict(dict)
+    if get_storage() == STORAGE_BITMASK:
+        masks = NotificationPreferenceMask.objects.filter(
+            user_id__in=user_ids, notification_type_id__in=type_ids
+        ).values_list("user_id", "notification_type_id", "channels", "overridden")
+        for user_id, type_id, mask, overridden in masks.order_by():
+            key = PreferenceCache.make_key(user_id, type_id)
+            for channel in mask_to_channels(overridden):
+                overrides[key][channel] = bool(mask & CHANNEL_BITS[channel])
+        return overrides
+
+    preferences = NotificationPreference.objects.filter(
+        user_id__in=user_ids, notification_type_id__in=type_ids
+    ).values_list("user_id", "notification_type_id", "channel", "enabled")
+    for user_id, type_id, channel, enabled in preferences.order_by():
+        overrides[PreferenceCache.make_key(user_id, type_id)][channel] = enabled
+    return overrides
+
+
+def apply_overrides(defaults, overrides) -> frozenset:
+    return frozenset(
+        channel
+        for channel in CHANNEL_BITS
+        if overrides.get(channel, channel in defaults)
+    )
+
+
+def get_audience_preferences(notif_type, users, exclude_channel=None):
+    """
+    Streams the (user_id, channel) pairs of an audience that receive a type: the
+    enabled overrides plus, for each default channel, the users without an
+    override for it. With the bitmask storage the overrides are a bitwise
+    expression on one row per user.
+    """
+    defaults = [
+        channel for channel in notif_type.default_channels if channel != exclude_channel
+    ]
+    chunk_size = settings.NOTIFICATION_FANOUT_CHUNK_SIZE
+    users = users.order_by()
+
+    if get_storage() == STORAGE_BITMASK:
+        default_mask = channels_to_mask(defaults)
+        wanted = ALL_CHANNELS_MASK & ~CHANNEL_BITS.get(exclude_channel, 0)
+        masks = NotificationPreferenceMask.objects.filter(
+            notification_type=notif_type, user__in=users
+        )
+        effective = (
+            masks.annotate(effective=effective_mask_expression(default_mask).bitand(wanted))
+            .filter(effective__gt=0)
+            .values_list("user_id", "effective")
+            .order_by()
+        )
+        if default_mask:
+            implicit = (
+                users.filter(~Exists(masks.filter(user=OuterRef("pk"))))
+                .annotate(effective=Value(default_mask, output_field=IntegerField()))
+                .values_list("id", "effective")
+            )
+            effective = effective.union(implicit, all=True)
+        return (
+            (user_id, channel)
+            for user_id, mask in effective.iterator(chunk_size=chunk_size)
+            for channel in mask_to_channels(mask)
+        )
+
+    preferences = NotificationPreference.objects.filter(
+        notification_type=notif_type, user__in=users
+    )
+    explicit = preferences.filter(enabled=True)
+    if exclude_channel:
+        explicit = explicit.exclude(channel=exclude_channel)
+    queryset = explicit.values_list("user_id", "channel").order_by()
+    for channel in defaults:
+        implicit = (
+            users.filter(
+                ~Exists(preferences.filter(user=OuterRef("pk"), channel=channel))
+            )
+            .annotate(default_channel=Value(channel, output_field=CharField()))
+            .values_list("id", "default_channel")
+        )
+        queryset = queryset.union(implicit, all=True)
+    return queryset.iterator(chunk_size=chunk_size)
+
+
+def effective_mask_expression(default_mask):
+    """
+    Enabled channels of a NotificationPreferenceMask row: its overridden bits
+    taken from `channels`, the others from the type's default mask.
+    """
+    return (
+        F("channels")
+        .bitand(F("overridden"))
+        .bitor((Value(ALL_CHANNELS_MASK) - F("overridden")).bitand(default_mask))
+    )
+
+
+def preference_exists(user, channel, type_field="notification_type"):
+    """
+    Condition testing that the user receives the type referenced by the outer
+    query's `type_field` through the channel, either by an enabled override or
+    because the channel is a default of the type and not overridden.
+    """
+    default_type_ids = [
+        type_id
+        for type_id, defaults in get_type_defaults().items()
+        if channel in defaults
+    ]
+    is_default = Q(**{f"{type_field}__in": default_type_ids})
+
+    if get_storage() == STORAGE_BITMASK:
+        bit = CHANNEL_BITS[channel]
+        overridden = (
+            NotificationPreferenceMask.objects.filter(
+                user=user, notification_type=OuterRef(type_field)
+            )
+            .annotate(is_overridden=F("overridden").bitand(bit))
+            .filter(is_overridden__gt=0)
+        )
+        enabled = overridden.annotate(is_enabled=F("channels").bitand(bit)).filter(
+            is_enabled__gt=0
+        )
+        return Exists(enabled) | (~Exists(overridden) & is_default)
+
+    overrides = NotificationPreference.objects.filter(
+        user=user, notification_type=OuterRef(type_field), channel=channel
+    )
+    return Exists(overrides.filter(enabled=True)) | (~Exists(overrides) & is_default)
+
+
+def preference_source_sql(notif_type):
+    """
+    Derived table of the (user_id, channel) pairs receiving a type, for raw
+    INSERT ... SELECT statements, with its parameters. It mirrors
+    get_audience_preferences: enabled overrides UNION ALL the users without an
+    override crossed with the default channels.
+    """
+    quote = connection.ops.quote_name
+    user_table = quote(User._meta.db_table)
+    user_pk = quote(User._meta.pk.column)
+    defaults = list(notif_type.default_channels)
+    default_channels = " UNION ALL ".join("SELECT %s AS channel" for _ in defaults)
+
+    if get_storage() == STORAGE_BITMASK:
+        mask_table = quote(NotificationPreferenceMask._meta.db_table)
+        channels = " UNION ALL ".join(
+            f"SELECT '{channel}' AS channel, {bit} AS bit"
+            for channel, bit in CHANNEL_BITS.items()
+        )
+        default_mask = channels_to_mask(defaults)
+        sql = (
+            f"SELECT mask.user_id, ch.channel FROM {mask_table} AS mask "
+            f"JOIN ({channels}) AS ch ON (((mask.channels & mask.overridden) | "
+            f"({default_mask} & ({ALL_CHANNELS_MASK} - mask.overridden))) & ch.bit) <> 0 "
+            f"WHERE mask.notification_type_id = %s"
+        )
+        params = [notif_type.id]
+        if defaults:
+            sql += (
+                f" UNION ALL SELECT u.{user_pk} AS user_id, d.channel "
+                f"FROM {user_table} AS u CROSS JOIN ({default_channels}) AS d "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {mask_table} AS o "
+                f"WHERE o.user_id = u.{user_pk} AND o.notification_type_id = %s)"
+            )
+            params += [*defaults, notif_type.id]
+        return f"({sql})", params
+
+    preference_table = quote(NotificationPreference._meta.db_table)
+    sql = (
+        f"SELECT p.user_id, p.channel FROM {preference_table} AS p "
+        f"WHERE p.notification_type_id = %s AND p.enabled = %s"
+    )
+    params = [notif_type.id, True]
+    if defaults:
+        sql += (
+            f" UNION ALL SELECT u.{user_pk} AS user_id, d.channel "
+            f"FROM {user_table} AS u CROSS JOIN ({default_channels}) AS d "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {preference_table} AS o "
+            f"WHERE o.user_id = u.{user_pk} AND o.notification_type_id = %s "
+            f"AND o.channel = d.channel)"
+        )
+        params += [*defaults, notif_type.id]
+    return f"({sql})", params
+
+
+def set_override(user_id, type_id, channel, enabled):
+    """
+    Marks the channel as overridden in a user's mask for a type and sets its
+    bit, creating the row if needed.
+    """
+    bit = CHANNEL_BITS[channel]
+    with transaction.atomic():
+        mask, created = NotificationPreferenceMask.objects.get_or_create(
+            user_id=user_id,
+            notification_type_id=type_id,
+            defaults={"channels": bit if enabled else 0, "overridden": bit},
+        )
+        if not created:
+            channels = (
+                F("channels").bitor(bit)
+                if enabled
+                else F("channels").bitand(ALL_CHANNELS_MASK & ~bit)
+            )
+            NotificationPreferenceMask.objects.filter(pk=mask.pk).update(
+                channels=channels,
+                overridden=F("overridden").bitor(bit),
+                updated_at=timezone.now(),
+            )
+    invalidate_preference(user_id, type_id)
+
+
+def clear_override(user_id, type_id, channel):
+    """
+    Drops the override of the channel from a user's mask for a type, so it
+    follows the type's default again, and deletes masks left without overrides.
+    """
+    kept = ALL_CHANNELS_MASK & ~CHANNEL_BITS[channel]
+    masks = NotificationPreferenceMask.objects.filter(
+        user_id=user_id, notification_type_id=type_id
+    )
+    with transaction.atomic():
+        masks.update(
+            channels=F("channels").bitand(kept),
+            overridden=F("overridden").bitand(kept),
+            updated_at=timezone.now(),
+        )
+        masks.filter(overridden=0).delete()
+    invalidate_preference(user_id, type_id)
+
+
+def provision_default_preferences(user_ids, notification_types=None) -> int:
+    """
+    Stores the default channels of the types (all of them by default) as
+    explicit preferences of the users, with one bulk INSERT that skips the
+    existing ones. Returns the number of rows sent to the database.
+    """
+    if notification_types is None:
+        notification_types = registry.all()
+
+    if get_storage() == STORAGE_BITMASK:
+        records = [
+            NotificationPreferenceMask(
+                user_id=user_id,
+                notification_type=notif_type,
+                channels=channels_to_mask(notif_type.default_channels),
+                overridden=channels_to_mask(notif_type.default_channels),
+            )
+            for user_id in user_ids
+            for notif_type in notification_types
+            if notif_type.default_channels
+        ]
+        NotificationPreferenceMask.objects.bulk_create(records, ignore_conflicts=True)
+    else:
+        records = [
+            NotificationPreference(
+                user_id=user_id, notification_type=notif_type, channel=channel
+            )
+            for user_id in user_ids
+            for notif_type in notification_types
+            for channel in notif_type.default_channels
+        ]
+        NotificationPreference.objects.bulk_create(records, ignore_conflicts=True)
+    # The stored channels equal the defaults the cache already resolved, so no
+    # invalidation is needed even though bulk_create sends no post_save.
+    return len(records)
+
+
+def get_entry_id(type_id, channel) -> int:
+    """
+    Synthetic id of a bitmask preference entry, so the preferences API keeps
+    exposing one item per (type, channel).
+    """
+    return type_id * ENTRY_ID_STRIDE + CHANNEL_INDEX.index(channel)
+
+
+def parse_entry_id(entry_id):
+    type_id, index = divmod(int(entry_id), ENTRY_ID_STRIDE)
+    if index >= len(CHANNEL_INDEX):
+        return None, None
+    return type_id, CHANNEL_INDEX[index]
+
+
+def get_default_entries(explicit) -> list:
+    """
+    Entries for the default channels of every type the user did not override.
+    `explicit` holds the overridden (type_id, channel) pairs. Rows storage
+    entries have no id since nothing is stored for them.
+    """
+    bitmask = get_storage() == STORAGE_BITMASK
+    return [
+        PreferenceEntry(
+            id=get_entry_id(type_id, channel) if bitmask else None,
+            notification_type_id=type_id,
+            channel=channel,
+            enabled=True,
+            is_default=True,
+            created_at=None,
+            updated_at=None,
+        )
+        for type_id, defaults in sorted(get_type_defaults().items())
+        for channel in CHANNEL_INDEX
+        if channel in defaults and (type_id, channel) not in explicit
+    ]
+
+
+def get_preference_entries(user) -> list:
+    """
+    Lists the user's effective preferences, explicit ones first and then the
+    defaults they did not override. Bitmask masks are expanded into entries
+    with the fields of the NotificationPreference API.
+    """
+    if get_storage() != STORAGE_BITMASK:
+        entries = list(NotificationPreference.objects.filter(user=user))
+        explicit = {(entry.notification_type_id, entry.channel) for entry in entries}
+        return entries + get_default_entries(explicit)
+
+    entries = [
+        PreferenceEntry(
+            id=get_entry_id(mask.notification_type_id, channel),
+            notification_type_id=mask.notification_type_id,
+            channel=channel,
+            enabled=bool(mask.channels & CHANNEL_BITS[channel]),
+            is_default=False,
+            created_at=mask.created_at,
+            updated_at=mask.updated_at,
+        )
+        for mask in NotificationPreferenceMask.objects.filter(user=user)
+        for channel in mask_to_channels(mask.overridden)
+    ]
+    explicit = {(entry.notification_type_id, entry.channel) for entry in entries}
+    return entries + get_default_entries(explicit)
+
+
+def get_preference_entry(user, entry_id):
+    """
+    Returns the bitmask preference entry of the user with the given synthetic
+    id, or None.
+    """
+    try:
+        type_id, channel = parse_entry_id(entry_id)
+    except (TypeError, ValueError):
+        return None
+    for entry in get_preference_entries(user):
+        if (entry.notification_type_id, entry.channel) == (type_id, channel):
+            return entry
+    return None
+
+
+class PreferenceEntry:
+    """
+    One (type, channel) item of a bitmask or default preference, shaped like a
+    NotificationPreference for the serializers.
+    """
+
+    def __init__(
+        self, id, notification_type_id, channel, enabled, is_default, created_at, updated_at
+    ):
+        self.id = id
+        self.pk = id
+        self.notification_type_id = notification_type_id
+        self.channel = channel
+        self.enabled = enabled
+        self.is_default = is_default
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+    def serializable_value(self, field_name):
+        # Used by DRF for primary key related fields, as on model instances.
+        return getattr(self, f"{field_name}_id")
+
+
+@receiver(setting_changed)
+def reset_preference_cache(setting, **kwargs):
+    global _cache
+    if setting == "NOTIFICATION_PREFERENCE_CACHE":
+        _cache = None
@@ -0,0 +1,117 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import RateLimitBucket
+
+logger = logging.getLogger("django")
+
+
+class TokenBucket:
+    """
+    Token bucket stored in RateLimitBucket so the limit is shared across worker
+    processes. `rate` tokens are added per second up to `burst`.
+
+    Each acquire is a short transaction locking the bucket row, so it must run
+    outside of any long lived transaction.
+    """
+
+    def __init__(self, key, rate, burst=None):
+        self.key = key
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+
+    def _update(self, fn):
+        with transaction.atomic():
+            bucket, _ = RateLimitBucket.objects.select_for_update().get_or_create(
+                key=self.key, defaults={"tokens": self.burst, "refilled_at": timezone.now()}
+            )
+            # Read once the lock is held and never moved backwards, so time
+            # refilled by the previous holder is not credited again.
+            now = max(timezone.now(), bucket.refilled_at)
+            elapsed = (now - bucket.refilled_at).total_seconds()
+            tokens = min(self.burst, bucket.tokens + elapsed * self.rate)
+            tokens, result = fn(tokens)
+            bucket.tokens = tokens
+            bucket.refilled_at = now
+            bucket.save(update_fields=["tokens", "refilled_at"])
+        return result
+
+    def acquire(self, requested: int) -> int:
+        """
+        Takes up to `requested` tokens and returns how many were granted.
+        """
+
+        def take(tokens):
+            granted = min(requested, int(tokens))
+            return tokens - granted, granted
+
+        return self._update(take)
+
+    def refund(self, count: int):
+        """
+        Returns unused tokens, e.g. when another limiter granted less.
+        """
+        if count > 0:
+            self._update(lambda tokens: (min(self.burst, tokens + count), None))
+
+    def wait_time(self, count: int) -> float:
+        """
+        Seconds until `count` more tokens are refilled.
+        """
+        return count / self.rate
+
+
+def get_limiters(backend):
+    """
+    Returns the token buckets that apply to a backend: the channel limit from its
+    RATE_LIMIT entry in NOTIFICATION_CHANNEL_BACKENDS and, when the backend names
+    a provider, the limit from NOTIFICATION_PROVIDER_RATE_LIMITS.
+    """
+    limiters = []
+    if backend.rate_limit:
+        limiters.append(make_bucket(f"channel:{backend.channel}", backend.rate_limit))
+
+    provider_limit = settings.NOTIFICATION_PROVIDER_RATE_LIMITS.get(backend.provider)
+    if backend.provider and provider_limit:
+        limiters.append(make_bucket(f"provider:{backend.provider}", provider_limit))
+    return limiters
+
+
+def make_bucket(key, limit) -> TokenBucket:
+    """
+    Builds the token bucket of a {"rate": ..., "burst": ...} limit. A rate of
+    zero would never refill, so it is rejected like a negative one.
+    """
+    if float(limit["rate"]) <= 0:
+        raise ValueError(f"Rate limit '{key}' must have a positive rate, got {limit['rate']}.")
+    return TokenBucket(key, limit["rate"], limit.get("burst"))
+
+
+def acquire(limiters, requested: int):
+    """
+    Acquires `requested` sends from every limiter. Returns the number granted by
+    all of them and the seconds to wait before the remainder can be sent.
+    """
+    granted = requested
+    wait = 0.0
+    taken = []
+    for limiter in limiters:
+        allowed = limiter.acquire(granted)
+        if allowed < granted:
+            wait = max(wait, limiter.wait_time(granted - allowed))
+        taken.append((limiter, allowed))
+        granted = allowed
+
+    # Buckets acquired before a stricter one granted less get their surplus back.
+    for limiter, allowed in taken:
+        limiter.refund(allowed - granted)
+
+    if granted < requested:
+        logger.info(
+            f"Rate limited: {requested - granted} of {requested} sends deferred "
+            f"by {wait:.1f}s"
+        )
+    return granted, wait
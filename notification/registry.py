@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from .models import NotificationType
+
+logger = logging.getLogger("django")
+
+
+class NotificationTypeRegistry:
+    """
+    In-process snapshot of the NotificationType table, loaded lazily with one
+    query and indexed by code (active types only) and by id (every type).
+
+    Saving or deleting a type invalidates the snapshot of the process through
+    the post_save/post_delete signals. Other processes reload it after `ttl`
+    seconds. Every reload bumps `version`, and a load that raced with an
+    invalidation is not installed.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.version = 0
+        self._by_code = None
+        self._by_id = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def _snapshot(self):
+        by_code, by_id = self._by_code, self._by_id
+        if by_code is not None and self._expires_at > time.monotonic():
+            return by_code, by_id
+
+        version = self.version
+        types = list(NotificationType.objects.all())
+        by_id = {notif_type.id: notif_type for notif_type in types}
+        by_code = {
+            notif_type.notification_code: notif_type
+            for notif_type in types
+            if notif_type.is_active
+        }
+        with self._lock:
+            if self.version == version:
+                self.version += 1
+                self._by_code, self._by_id = by_code, by_id
+                self._expires_at = time.monotonic() + self.ttl
+        logger.debug(f"Notification type registry loaded: {len(types)} types")
+        return by_code, by_id
+
+    def get(self, code):
+        """
+        Returns the active type with the given code, or None.
+        """
+        return self._snapshot()[0].get(code)
+
+    def get_by_id(self, type_id):
+        """
+        Returns the type with the given id, active or not, or None.
+        """
+        return self._snapshot()[1].get(type_id)
+
+    def codes(self) -> list:
+        return sorted(self._snapshot()[0])
+
+    def active(self) -> list:
+        return sorted(self._snapshot()[0].values(), key=lambda t: t.notification_code)
+
+    def all(self) -> list:
+        return sorted(self._snapshot()[1].values(), key=lambda t: t.notification_code)
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._by_code = self._by_id = None
+
+
+registry = NotificationTypeRegistry(ttl=settings.NOTIFICATION_TYPE_REGISTRY_TTL)
@@ -0,0 +1,151 @@
+import logging
+import re
+import threading
+
+from django.template import Context, Engine
+
+from .models import NotificationChannel
+from .renditions import build_renditions, truncate_sms
+
+logger = logging.getLogger("django")
+
+DEFAULT_TEMPLATE = "default"
+RENDITION_FIELDS = ["content_html", "content_text", "content_sms"]
+
+# HTML channels escape the event data, SMS is plain text.
+_html_engine = Engine(autoescape=True)
+_text_engine = Engine(autoescape=False)
+
+# Templates referring to the recipient must be rendered per user.
+PERSONALIZED_RE = re.compile(r"\{[{%][^}]*\buser\b")
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+class CompiledTemplate:
+    def __init__(self, source, engine):
+        self.template = engine.from_string(source)
+        self.is_personalized = bool(PERSONALIZED_RE.search(source))
+
+    def render(self, context):
+        # A Context escapes by default, whatever the engine was built with.
+        return self.template.render(Context(context, autoescape=self.template.engine.autoescape))
+
+
+def get_template(notif_type, channel):
+    """
+    Returns the compiled template of a type for a channel, falling back to the
+    type's default template, or None when the type has none.
+
+    Templates are compiled once per process and cached by (type, template
+    version, channel); saving a type bumps its version, so stale entries are
+    never used and are dropped on the next compile.
+    """
+    key = (notif_type.id, notif_type.template_version, channel)
+    template = _compiled.get(key)
+    if template is not None:
+        return template
+
+    source = get_source(notif_type, channel)
+    if source is None:
+        return None
+
+    engine = _text_engine if channel == NotificationChannel.SMS else _html_engine
+    template = CompiledTemplate(source, engine)
+    with _compiled_lock:
+        for stale in [k for k in _compiled if k[0] == key[0] and k[1] != key[1]]:
+            del _compiled[stale]
+        _compiled[key] = template
+    return template
+
+
+def get_source(notif_type, channel):
+    templates = notif_type.templates or {}
+    return templates.get(channel, templates.get(DEFAULT_TEMPLATE))
+
+
+def invalidate_type(type_id):
+    """
+    Drops every compiled template of a notification type.
+    """
+    with _compiled_lock:
+        for key in [k for k in _compiled if k[0] == type_id]:
+            del _compiled[key]
+
+
+def render(notif_type, channel, context=None) -> str:
+    """
+    Renders the type's template for a channel. Types without a template render
+    their name.
+    """
+    template = get_template(notif_type, channel)
+    if template is None:
+        return notif_type.name
+    return template.render(context or {})
+
+
+def render_many(notif_type, channel, context, users) -> list:
+    """
+    Batch render for fan-out: renders the template for every user, with the user
+    added to the shared context. Templates that do not refer to the user are
+    rendered once and the result is shared by all recipients.
+    """
+    template = get_template(notif_type, channel)
+    if template is None:
+        return [notif_type.name] * len(users)
+    if not template.is_personalized:
+        return [template.render(context)] * len(users)
+    return [template.render({**context, "user": user}) for user in users]
+
+
+def render_deliveries(channel, deliveries) -> list:
+    """
+    Returns the renditions (content_html, content_text, content_sms) of a batch
+    of deliveries for their channel, rendered per notification.
+
+    The renditions precomputed on the notification come from the in-app
+    rendering and are used as is when the channel resolves to the same template
+    and the template is not personalized, or when the type has no template at
+    all. Otherwise the channel template is rendered (once per notification
+    unless personalized) and converted.
+    """
+    by_notification = {}
+    for delivery in deliveries:
+        by_notification.setdefault(delivery.notification_id, []).append(delivery)
+
+    renditions = {}
+    for notification_deliveries in by_notification.values():
+        notification = notification_deliveries[0].notification
+        notif_type = notification.notification_type
+        template = get_template(notif_type, channel)
+        if template is None or (
+            not template.is_personalized
+            and get_source(notif_type, channel)
+            == get_source(notif_type, NotificationChannel.IN_APP)
+        ):
+            stored = {field: getattr(notification, field) for field in RENDITION_FIELDS}
+            for delivery in notification_deliveries:
+                renditions[delivery.id] = stored
+            continue
+
+        rendered = render_many(
+            notif_type,
+            channel,
+            notification.metadata or {},
+            [delivery.user for delivery in notification_deliveries],
+        )
+        converted = {}
+        for delivery, content in zip(notification_deliveries, rendered):
+            if content not in converted:
+                converted[content] = convert(channel, content)
+            renditions[delivery.id] = converted[content]
+    return [renditions[delivery.id] for delivery in deliveries]
+
+
+def convert(channel, content) -> dict:
+    if channel == NotificationChannel.SMS:
+        # SMS templates are rendered as plain text.
+        text = " ".join(content.split())
+        return {"content_html": "", "content_text": text, "content_sms": truncate_sms(text)}
+    return build_renditions(content)
@@ -1,10 +1,20 @@
+import uuid
+
+from django.db import transaction
 from rest_framework import serializers
 
-from .models import (NotificationChannel, NotificationDelivery,
+from .models import (NotificationChannel, NotificationJob,
                      NotificationPreference, NotificationType)
+from .preferences import (clear_override, get_entry_id, get_preference_entry,
+                          set_override)
+from .registry import registry
 
 
 class NotificationPreferenceSerializer(serializers.ModelSerializer):
+    is_default = serializers.SerializerMethodField(
+        help_text="True for channels enabled by the type's defaults, which have no stored row."
+    )
+
     class Meta:
         model = NotificationPreference
         exclude = ["user"]
@@ -13,6 +23,47 @@ class NotificationPreferenceSerializer(serializers.ModelSerializer):
         validated_data["user"] = self.context["request"].user
         return NotificationPreference.objects.create(**validated_data)
 
+    def get_is_default(self, obj) -> bool:
+        return getattr(obj, "is_default", False)
+
+
+class NotificationPreferenceEntrySerializer(serializers.Serializer):
+    """
+    Bitmask preferences exposed with the fields of NotificationPreferenceSerializer,
+    one entry per overridden or default (type, channel).
+    """
+
+    id = serializers.IntegerField(read_only=True)
+    created_at = serializers.DateTimeField(read_only=True)
+    updated_at = serializers.DateTimeField(read_only=True)
+    notification_type = serializers.PrimaryKeyRelatedField(
+        queryset=NotificationType.objects.all()
+    )
+    channel = serializers.ChoiceField(choices=NotificationChannel.choices)
+    enabled = serializers.BooleanField(default=True)
+    is_default = serializers.BooleanField(read_only=True)
+
+    def create(self, validated_data):
+        user = self.context["request"].user
+        type_id = validated_data["notification_type"].id
+        channel = validated_data["channel"]
+        set_override(user.id, type_id, channel, validated_data["enabled"])
+        return get_preference_entry(user, get_entry_id(type_id, channel))
+
+    def update(self, instance, validated_data):
+        user = self.context["request"].user
+        type_id = validated_data.get(
+            "notification_type", instance.notification_type_id
+        )
+        type_id = getattr(type_id, "id", type_id)
+        channel = validated_data.get("channel", instance.channel)
+        enabled = validated_data.get("enabled", instance.enabled)
+        with transaction.atomic():
+            if (type_id, channel) != (instance.notification_type_id, instance.channel):
+                clear_override(user.id, instance.notification_type_id, instance.channel)
+            set_override(user.id, type_id, channel, enabled)
+        return get_preference_entry(user, get_entry_id(type_id, channel))
+
 
 class NotificationTypeList(serializers.ModelSerializer):
     class Meta:
@@ -22,30 +73,120 @@ class NotificationTypeList(serializers.ModelSerializer):
 
 
 class NotificationTriggerSerializer(serializers.Serializer):
-    event = serializers.ChoiceField(
-        choices=["new_comment", "new_login", "weekly_summary"],
-        help_text="Type of notification event to trigger.",
+    event = serializers.CharField(
+        max_length=100,
+        help_text="Code of the active notification type to trigger, e.g. new_comment.",
     )
     data = serializers.DictField(
         child=serializers.CharField(),
-        help_text="Additional data required for the event, e.g., user_id for new_login.",
+        help_text="Additional data required for the event, e.g., user_id for targeted types "
+        "such as new_login.",
     )
+    idempotency_key = serializers.CharField(
+        max_length=255,
+        required=False,
+        help_text="Retried triggers with the same key return the original notification. "
+        "Can also be sent as the Idempotency-Key header.",
+    )
+    collapse_key = serializers.CharField(
+        max_length=255,
+        required=False,
+        help_text="Events with the same collapse key update the user's pending or unread "
+        "delivery instead of creating a new one.",
+    )
+
+    def validate(self, attrs):
+        notification_type = registry.get(attrs["event"])
+        if notification_type is None:
+            raise serializers.ValidationError(
+                {"event": [f'"{attrs["event"]}" is not a valid choice.']}
+            )
+        attrs["notification_type"] = notification_type
 
+        user_id = attrs["data"].get("user_id")
+        if notification_type.is_targeted and not user_id:
+            raise serializers.ValidationError(
+                {"data": {"user_id": f"Required for {attrs['event']} events."}}
+            )
+        if user_id:
+            try:
+                uuid.UUID(user_id)
+            except ValueError:
+                raise serializers.ValidationError(
+                    {"data": {"user_id": "Must be a valid user id (UUID)."}}
+                )
+        return attrs
 
-class NotificationDeliverySerializer(serializers.ModelSerializer):
+
+class NotificationFeedSerializer(serializers.Serializer):
+    """
+    Item of the history and unread lists. Global notifications that are fanned out
+    on read have no delivery yet, their id is null and they are marked as read
+    through notification_id.
+    """
+
+    id = serializers.IntegerField(source="item_id", allow_null=True, read_only=True)
+    notification_id = serializers.IntegerField(
+        source="item_notification", read_only=True
+    )
     notification = serializers.CharField(
-        source="notification.content", allow_null=True, default="No notification"
+        source="item_content", allow_null=True, read_only=True
     )
+    is_read = serializers.BooleanField(source="item_is_read", read_only=True)
+    count = serializers.IntegerField(source="item_count", read_only=True)
 
-    class Meta:
-        model = NotificationDelivery
-        fields = ["id", "notification", "is_read"]
-        read_only_fields = ["id", "is_read"]
+
+# Output name and feed column of every field of NotificationFeedSerializer.
+FEED_ITEM_FIELDS = [
+    ("id", "item_id"),
+    ("notification_id", "item_notification"),
+    ("notification", "item_content"),
+    ("is_read", "item_is_read"),
+    ("count", "item_count"),
+]
+
+
+def serialize_feed_items(items) -> list:
+    """
+    Fast path of NotificationFeedSerializer for the projected feed rows, which
+    already hold plain values.
+    """
+    return [{name: item[column] for name, column in FEED_ITEM_FIELDS} for item in items]
 
 
 class NotificationReadSerializer(serializers.Serializer):
     notifications = serializers.ListField(
         child=serializers.IntegerField(),
+        required=False,
+        default=list,
         help_text="List of NotificationDelivery IDs to mark as read",
     )
-    
+    global_notifications = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        default=list,
+        help_text="List of global Notification IDs (items without a delivery id) to mark as read",
+    )
+
+
+class NotificationJobSerializer(serializers.ModelSerializer):
+    rate = serializers.FloatField(
+        read_only=True, allow_null=True, help_text="Users fanned out per second."
+    )
+
+    class Meta:
+        model = NotificationJob
+        fields = [
+            "id",
+            "notification",
+            "status",
+            "processed",
+            "total",
+            "rate",
+            "delivery_count",
+            "attempts",
+            "started_at",
+            "finished_at",
+            "error_message",
+        ]
+        read_only_fields = fields
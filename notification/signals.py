@@ -1,9 +1,15 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .models import (NotificationChannel, NotificationPreference,
+from .models import (NotificationPreference, NotificationPreferenceMask,
                      NotificationType)
+from .preferences import (invalidate_preference, invalidate_type_preferences,
+                          provision_default_preferences)
+from .registry import registry
+from .rendering import invalidate_type
 
 User = get_user_model()
 
@@ -13,13 +19,40 @@ def create_default_preferences(sender, instance, created, **kwargs):
     if not created:
         return
 
-    notification_types = NotificationType.objects.all()
-    channels = NotificationChannel.values
+    # Type defaults apply to users without preferences, rows are only written
+    # when eager preferences are configured.
+    if not settings.NOTIFICATION_EAGER_PREFERENCES:
+        return
+
+    # One bulk INSERT once the signup transaction commits: a rolled back signup
+    # writes nothing and the cost does not grow with the number of types.
+    transaction.on_commit(lambda: provision_default_preferences([instance.pk]))
+
+
+@receiver(post_save, sender=NotificationType)
+@receiver(post_delete, sender=NotificationType)
+def invalidate_templates(sender, instance, **kwargs):
+    invalidate_type(instance.id)
+
+
+@receiver(post_save, sender=NotificationType)
+@receiver(post_delete, sender=NotificationType)
+def invalidate_type_registry(sender, instance, **kwargs):
+    registry.invalidate()
+    # A reload between the write and the commit would still see the old row.
+    transaction.on_commit(registry.invalidate)
+
+
+@receiver(post_save, sender=NotificationType)
+@receiver(post_delete, sender=NotificationType)
+def invalidate_type_preference_cache(sender, instance, **kwargs):
+    # Resolutions of every user depend on the type's default channels.
+    invalidate_type_preferences()
+
 
-    for notif_type in notification_types:
-        for channel in channels:
-            NotificationPreference.objects.get_or_create(
-                user=instance,
-                notification_type=notif_type,
-                channel=NotificationChannel.IN_APP,
-            )
+@receiver(post_save, sender=NotificationPreference)
+@receiver(post_delete, sender=NotificationPreference)
+@receiver(post_save, sender=NotificationPreferenceMask)
+@receiver(post_delete, sender=NotificationPreferenceMask)
+def invalidate_preference_cache(sender, instance, **kwargs):
+    invalidate_preference(instance.user_id, instance.notification_type_id)
@@ -1,3 +1,1339 @@
-from django.test import TestCase
+import base64
+import threading
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .backends import (BaseChannelBackend, InAppBackend, SmtpEmailBackend,
+                       get_backend, mark_sent)
+from .counters import get_unread_counts, reconcile_counters
+from .dispatch import dispatch_due, dispatch_notification, get_retry_delay
+from .fanout import FANOUT_ENGINE_PYTHON, FANOUT_ENGINE_SQL
+from .jobs import claim_job, run_job
+from .models import (DigestEntry, Notification, NotificationChannel,
+                     NotificationDelivery, NotificationJob,
+                     NotificationPreference, NotificationPreferenceMask,
+                     NotificationType, PreferenceBackfill,
+                     RateLimitBucket, UnreadCounter)
+from .preferences import (STORAGE_BITMASK, PreferenceCache, clear_override,
+                          get_audience_preferences, get_entry_id,
+                          get_preference_cache, get_storage, parse_entry_id,
+                          preference_exists, preference_source_sql,
+                          resolve_channels, set_override)
+from .ratelimit import TokenBucket, acquire, get_limiters
+from .registry import registry
+from .rendering import get_template, render, render_many
+from .renditions import html_to_text, sanitize_html, truncate_sms
+
+User = get_user_model()
+
+
+def url(name):
+    return reverse(name, kwargs={"version": "v1"})
+
+
+class NotificationTestCase(TestCase):
+    def setUp(self):
+        registry.invalidate()
+        get_preference_cache().clear()
+        self.admin = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="secret"
+        )
+        self.users = [
+            User.objects.create_user(
+                username=f"user{index}", email=f"user{index}@example.com", password="secret"
+            )
+            for index in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def trigger(self, event, data=None, **extra):
+        return self.client.post(
+            url("notification-trigger"), {"event": event, "data": data or {}, **extra}, format="json"
+        )
+
+    def run_worker(self):
+        while (job := claim_job("test-worker")) is not None:
+            run_job(job)
+
+    def login(self, user):
+        user.is_active = True
+        user.save(update_fields=["is_active"])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+        return client
+
+
+class SqlFanOutEngineTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        for code in ["weekly_summary", "new_comment"]:
+            notif_type = registry.get(code)
+            NotificationPreference.objects.create(
+                user=self.users[0], notification_type=notif_type, channel="in_app", enabled=False
+            )
+            NotificationPreference.objects.create(
+                user=self.users[1], notification_type=notif_type, channel="email"
+            )
+
+    def fan_out(self, event, engine):
+        with override_settings(NOTIFICATION_FANOUT_ENGINE=engine):
+            notification_id = self.trigger(event).data["notification_id"]
+            self.run_worker()
+        deliveries = NotificationDelivery.objects.filter(notification_id=notification_id)
+        entries = DigestEntry.objects.filter(notification_id=notification_id)
+        return (
+            set(deliveries.values_list("user_id", "channel")),
+            set(entries.values_list("user_id", "channel")),
+            NotificationJob.objects.get(notification_id=notification_id).delivery_count,
+        )
+
+    def test_sql_engine_matches_python_engine(self):
+        expected = {
+            (self.admin.id, "in_app"),
+            (self.users[1].id, "in_app"),
+            (self.users[1].id, "email"),
+            (self.users[2].id, "in_app"),
+        }
+        deliveries, entries, count = self.fan_out("weekly_summary", "sql")
+
+        self.assertEqual(deliveries, expected)
+        self.assertEqual(entries, set())
+        self.assertEqual(count, len(expected))
+        self.assertEqual(self.fan_out("weekly_summary", "python"), (deliveries, entries, count))
+
+    def test_sql_engine_buffers_digestible_channels(self):
+        deliveries, entries, count = self.fan_out("new_comment", "sql")
+
+        self.assertNotIn((self.users[1].id, "email"), deliveries)
+        self.assertEqual(entries, {(self.users[1].id, "email")})
+        self.assertEqual(self.fan_out("new_comment", "python"), (deliveries, entries, count))
+
+
+class FanOutJobTests(NotificationTestCase):
+    def test_replayed_fanout_creates_and_counts_no_duplicates(self):
+        job_id = self.trigger("weekly_summary").data["job_id"]
+        self.run_worker()
+        deliveries = NotificationDelivery.objects.filter(notification__jobs=job_id)
+        self.assertEqual(deliveries.count(), User.objects.count())
+
+        # A worker resuming from an old checkpoint replays the committed chunks.
+        NotificationJob.objects.filter(pk=job_id).update(
+            status="queued", last_user_id=None, processed=0
+        )
+        self.run_worker()
+
+        job = NotificationJob.objects.get(pk=job_id)
+        self.assertEqual(job.status, "completed")
+        self.assertEqual(deliveries.count(), User.objects.count())
+        self.assertEqual(job.delivery_count, User.objects.count())
+
+    def test_job_reclaimed_by_another_worker_is_not_overwritten(self):
+        self.trigger("weekly_summary")
+        job = claim_job("worker-1")
+        NotificationJob.objects.filter(pk=job.pk).update(locked_by="worker-2")
+
+        run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "running")
+        self.assertEqual(job.locked_by, "worker-2")
+        self.assertFalse(NotificationDelivery.objects.exists())
+
+    @override_settings(NOTIFICATION_FANOUT_CHUNK_SIZE=2)
+    def test_job_progress_is_checkpointed_per_chunk(self):
+        job_id = self.trigger("weekly_summary").data["job_id"]
+        self.run_worker()
+
+        response = self.client.get(
+            reverse("notification-job-detail", kwargs={"version": "v1", "pk": job_id})
+        )
+        self.assertEqual(response.data["status"], "completed")
+        self.assertEqual(response.data["processed"], User.objects.count())
+        self.assertEqual(response.data["total"], User.objects.count())
+        self.assertEqual(response.data["delivery_count"], User.objects.count())
+
+
+@override_settings(NOTIFICATION_GLOBAL_FANOUT_ON_READ=True)
+class FanOutOnReadTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.users[0]
+        self.user_client = self.login(self.user)
+        self.notification_id = self.trigger("weekly_summary").data["notification_id"]
+        self.run_worker()
+
+    def test_global_items_are_merged_into_the_feed_and_count(self):
+        in_app = NotificationDelivery.objects.filter(channel=NotificationChannel.IN_APP)
+        self.assertFalse(in_app.exists())
+
+        items = self.user_client.get(url("notification-history")).data["results"]
+        self.assertEqual(len(items), 1)
+        self.assertIsNone(items[0]["id"])
+        self.assertEqual(items[0]["notification_id"], self.notification_id)
+        self.assertEqual(self.user_client.get(url("notification-unread-count")).data["count"], 1)
+
+    def test_read_materializes_the_delivery(self):
+        self.user_client.post(
+            url("notification-read"), {"global_notifications": [self.notification_id]}, format="json"
+        )
+
+        delivery = NotificationDelivery.objects.get(user=self.user)
+        self.assertTrue(delivery.is_read)
+        items = self.user_client.get(url("notification-history")).data["results"]
+        self.assertEqual([item["id"] for item in items], [delivery.id])
+        self.assertEqual(self.user_client.get(url("notification-unread")).data["results"], [])
+        self.assertEqual(self.user_client.get(url("notification-unread-count")).data["count"], 0)
+
+    def test_users_opted_out_of_in_app_do_not_see_global_items(self):
+        NotificationPreference.objects.create(
+            user=self.user,
+            notification_type=registry.get("weekly_summary"),
+            channel="in_app",
+            enabled=False,
+        )
+
+        self.assertEqual(self.user_client.get(url("notification-history")).data["results"], [])
+        self.assertEqual(self.user_client.get(url("notification-unread-count")).data["count"], 0)
+
+
+class BarrierBackend(BaseChannelBackend):
+    """
+    Backend whose batches only complete once `parties` of them run at the same
+    time, recording the threads they ran on.
+    """
+
+    def __init__(self, channel, parties=1, **kwargs):
+        super().__init__(channel, **kwargs)
+        self.barrier = threading.Barrier(parties, timeout=5)
+        self.threads = set()
+
+    def send_batch(self, deliveries):
+        self.threads.add(threading.current_thread().name)
+        self.barrier.wait()
+        for delivery in deliveries:
+            mark_sent(delivery)
+
+
+@override_settings(
+    NOTIFICATION_CHANNEL_BACKENDS={
+        "in_app": {"BACKEND": "notification.backends.InAppBackend"},
+        "email": {
+            "BACKEND": "notification.tests.BarrierBackend",
+            "CONCURRENCY": 2,
+            "BATCH_SIZE": 2,
+            "OPTIONS": {"parties": 2},
+        },
+    }
+)
+class ConcurrentDispatchTests(NotificationTestCase):
+    def test_batches_are_sent_concurrently_on_the_channel_pool(self):
+        weekly = registry.get("weekly_summary")
+        NotificationPreference.objects.bulk_create(
+            NotificationPreference(user=user, notification_type=weekly, channel="email")
+            for user in self.users + [self.admin]
+        )
+        self.trigger("weekly_summary")
+
+        self.run_worker()
+
+        deliveries = NotificationDelivery.objects.all()
+        self.assertEqual(deliveries.filter(status="sent").count(), 2 * User.objects.count())
+        threads = get_backend("email").threads
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith("notification-email") for name in threads))
+
+
+@override_settings(
+    NOTIFICATION_CHANNEL_BACKENDS={
+        "in_app": {
+            "BACKEND": "notification.backends.FakeBackend",
+            "OPTIONS": {"failure_rate": 1.0},
+        }
+    },
+    NOTIFICATION_RETRY_MAX_ATTEMPTS=2,
+)
+class RetryTests(NotificationTestCase):
+    def test_failed_delivery_is_retried_then_dead_lettered(self):
+        self.trigger("new_login", {"user_id": str(self.users[0].id)})
+        self.run_worker()
+
+        delivery = NotificationDelivery.objects.get()
+        self.assertEqual(delivery.status, "failed")
+        self.assertEqual(delivery.attempts, 1)
+        self.assertGreater(delivery.next_attempt_at, delivery.last_attempted_at)
+        self.assertEqual(dispatch_due(now=delivery.next_attempt_at - timedelta(seconds=1)), 0)
+
+        self.assertEqual(dispatch_due(now=delivery.next_attempt_at), 1)
+
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.status, "dead")
+        self.assertEqual(delivery.attempts, 2)
+        self.assertIsNone(delivery.next_attempt_at)
+        self.assertEqual(dispatch_due(now=timezone.now() + timedelta(days=1)), 0)
+
+    @override_settings(NOTIFICATION_RETRY_BASE_SECONDS=30, NOTIFICATION_RETRY_MAX_SECONDS=100)
+    def test_backoff_doubles_up_to_the_cap(self):
+        for attempts, delay in [(1, 30), (2, 60), (3, 100), (10, 100)]:
+            self.assertTrue(delay / 2 <= get_retry_delay(attempts) <= delay)
+
+
+class TokenBucketTests(NotificationTestCase):
+    def age_bucket(self, key, seconds):
+        RateLimitBucket.objects.filter(key=key).update(
+            refilled_at=F("refilled_at") - timedelta(seconds=seconds)
+        )
+
+    def test_tokens_refill_at_the_rate(self):
+        bucket = TokenBucket("test", rate=10, burst=20)
+        self.assertEqual(bucket.acquire(25), 20)
+        self.assertEqual(bucket.acquire(1), 0)
+
+        self.age_bucket("test", 1)
+
+        self.assertEqual(bucket.acquire(15), 10)
+
+    def test_grants_are_capped_at_the_burst(self):
+        bucket = TokenBucket("test", rate=10, burst=20)
+        bucket.acquire(20)
+
+        self.age_bucket("test", 3600)
+
+        self.assertEqual(bucket.acquire(100), 20)
+
+    def test_refill_time_never_moves_backwards(self):
+        # A holder that read the clock later already refilled up to refilled_at.
+        refilled_at = timezone.now() + timedelta(seconds=5)
+        RateLimitBucket.objects.create(key="test", tokens=0, refilled_at=refilled_at)
+
+        self.assertEqual(TokenBucket("test", rate=10).acquire(1), 0)
+        self.assertEqual(RateLimitBucket.objects.get(key="test").refilled_at, refilled_at)
+
+    def test_surplus_is_refunded_to_buckets_acquired_before_a_stricter_one(self):
+        channel = TokenBucket("channel:sms", rate=10, burst=10)
+        provider = TokenBucket("provider:sms", rate=2, burst=2)
+
+        granted, wait = acquire([channel, provider], 5)
+
+        self.assertEqual(granted, 2)
+        self.assertEqual(wait, 1.5)
+        tokens = dict(RateLimitBucket.objects.values_list("key", "tokens"))
+        # Give or take the tokens refilled while the test runs.
+        self.assertAlmostEqual(tokens["channel:sms"], 8, delta=0.5)
+        self.assertAlmostEqual(tokens["provider:sms"], 0, delta=0.5)
+
+    def test_non_positive_rates_are_rejected(self):
+        for rate in [0, -1]:
+            backend = InAppBackend("in_app", rate_limit={"rate": rate})
+            with self.assertRaises(ValueError):
+                get_limiters(backend)
+
+    @override_settings(
+        NOTIFICATION_CHANNEL_BACKENDS={
+            "in_app": {
+                "BACKEND": "notification.backends.InAppBackend",
+                "RATE_LIMIT": {"rate": 1, "burst": 2},
+            }
+        }
+    )
+    def test_deliveries_over_the_limit_are_deferred(self):
+        notification = Notification.objects.create(
+            notification_type=registry.get("weekly_summary"), title="Summary", content="Hi"
+        )
+        NotificationDelivery.objects.bulk_create(
+            NotificationDelivery(notification=notification, user=user, channel="in_app")
+            for user in self.users + [self.admin]
+        )
+        started = timezone.now()
+
+        dispatch_notification(notification)
+
+        sent = NotificationDelivery.objects.filter(status="sent")
+        deferred = NotificationDelivery.objects.filter(status="pending")
+        self.assertEqual(sent.count(), 2)
+        self.assertEqual(deferred.count(), 2)
+        for delivery in deferred:
+            # Not an attempt, and due once the two missing tokens are refilled.
+            self.assertEqual(delivery.attempts, 0)
+            self.assertGreaterEqual(delivery.next_attempt_at, started + timedelta(seconds=2))
+            self.assertLess(delivery.next_attempt_at, timezone.now() + timedelta(seconds=3))
+
+
+FAILING_RECIPIENT = "fail@example.com"
+
+
+class FlakyEmailBackend(BaseEmailBackend):
+    """
+    Email backend recording the messages it accepts and rejecting the ones
+    sent to FAILING_RECIPIENT.
+    """
+
+    opened = 0
+    sent = []
+
+    def open(self):
+        FlakyEmailBackend.opened += 1
+
+    def send_messages(self, email_messages):
+        for message in email_messages:
+            if FAILING_RECIPIENT in message.to:
+                raise ConnectionError("Recipient refused.")
+            self.sent.append(message.to[0])
+        return len(email_messages)
+
+
+class SmtpEmailBackendTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        FlakyEmailBackend.opened = 0
+        FlakyEmailBackend.sent = []
+
+    def send_batch(self):
+        notification = Notification.objects.create(
+            notification_type=registry.get("weekly_summary"), title="Summary", content="Hi"
+        )
+        NotificationDelivery.objects.bulk_create(
+            NotificationDelivery(notification=notification, user=user, channel="email")
+            for user in self.users
+        )
+        deliveries = list(
+            NotificationDelivery.objects.select_related("user", "notification").order_by("id")
+        )
+        backend = SmtpEmailBackend("email", email_backend="notification.tests.FlakyEmailBackend")
+        backend.send_batch(deliveries)
+        return [delivery.status for delivery in deliveries]
+
+    def test_batch_reuses_one_connection(self):
+        self.assertEqual(self.send_batch(), ["sent"] * 3)
+        self.assertEqual(FlakyEmailBackend.opened, 1)
+        self.assertEqual(FlakyEmailBackend.sent, [user.email for user in self.users])
+
+    def test_failure_does_not_resend_accepted_messages(self):
+        self.users[1].email = FAILING_RECIPIENT
+        self.users[1].save(update_fields=["email"])
+
+        self.assertEqual(self.send_batch(), ["sent", "failed", "sent"])
+        self.assertEqual(FlakyEmailBackend.sent, [self.users[0].email, self.users[2].email])
+        # The connection is reopened after the failure.
+        self.assertEqual(FlakyEmailBackend.opened, 2)
+
+
+class BulkTriggerTests(NotificationTestCase):
+    def post_ndjson(self, body):
+        return self.client.post(
+            url("notification-trigger-bulk"), body, content_type="application/x-ndjson"
+        )
+
+    def test_json_array(self):
+        user = self.users[0]
+        response = self.client.post(
+            url("notification-trigger-bulk"),
+            [
+                {"event": "weekly_summary", "data": {}},
+                {"event": "new_login", "data": {"user_id": str(user.id)}},
+            ],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["accepted"], 2)
+        global_result, targeted_result = response.data["results"]
+        self.assertTrue(NotificationJob.objects.filter(pk=global_result["job_id"]).exists())
+        self.assertEqual(targeted_result["deliveries"], 1)
+        delivery = NotificationDelivery.objects.get(notification=targeted_result["notification_id"])
+        self.assertEqual(delivery.user, user)
+        # Due immediately for the retry scheduler.
+        self.assertIsNotNone(delivery.next_attempt_at)
+
+    def test_ndjson_stream(self):
+        body = b'{"event": "weekly_summary", "data": {}}\n\n{"event": "new_comment", "data": {}}\n'
+
+        response = self.post_ndjson(body)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["accepted"], 2)
+        self.assertEqual(Notification.objects.count(), 2)
+
+    @override_settings(NOTIFICATION_BULK_TRIGGER_MAX_EVENTS=2)
+    def test_too_many_events_are_rejected(self):
+        event = {"event": "weekly_summary", "data": {}}
+        response = self.client.post(url("notification-trigger-bulk"), [event] * 3, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_invalid_events_are_reported_per_event(self):
+        response = self.client.post(
+            url("notification-trigger-bulk"),
+            [
+                {"event": "weekly_summary", "data": {}},
+                {"event": "unknown", "data": {}},
+                {"event": "new_login", "data": {}},
+            ],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data["accepted"], response.data["rejected"]), (1, 2))
+        valid, unknown, missing_user = response.data["results"]
+        self.assertIn("notification_id", valid)
+        self.assertIn("event", unknown["errors"])
+        self.assertIn("data", missing_user["errors"])
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_malformed_ndjson_is_rejected(self):
+        for body in [b'{"event": "weekly_summary", "data": {}}\n{oops\n', b"\xff\xfe{}\n"]:
+            response = self.post_ndjson(body)
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Notification.objects.exists())
+
+
+class IdempotencyTests(NotificationTestCase):
+    def test_retried_key_returns_the_original_notification(self):
+        first = self.trigger("weekly_summary", idempotency_key="summary-1")
+        retry = self.client.post(
+            url("notification-trigger"),
+            {"event": "weekly_summary", "data": {}},
+            format="json",
+            HTTP_IDEMPOTENCY_KEY="summary-1",
+        )
+
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(retry.status_code, 200)
+        self.assertTrue(retry.data["duplicate"])
+        self.assertEqual(retry.data["notification_id"], first.data["notification_id"])
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertEqual(NotificationJob.objects.count(), 1)
+
+    def test_key_is_reused_after_the_window(self):
+        first = self.trigger("weekly_summary", idempotency_key="summary-1")
+        Notification.objects.update(
+            created_at=timezone.now()
+            - timedelta(seconds=settings.NOTIFICATION_IDEMPOTENCY_WINDOW_SECONDS + 1)
+        )
+
+        again = self.trigger("weekly_summary", idempotency_key="summary-1")
+
+        self.assertEqual(again.status_code, 202)
+        self.assertNotEqual(again.data["notification_id"], first.data["notification_id"])
+        self.assertEqual(Notification.objects.filter(idempotency_key="summary-1").count(), 1)
+
+    def test_bulk_flags_keys_repeated_within_the_request(self):
+        event = {"event": "weekly_summary", "data": {}, "idempotency_key": "summary-1"}
+        response = self.client.post(url("notification-trigger-bulk"), [event, event], format="json")
+
+        self.assertEqual(response.data["accepted"], 1)
+        self.assertEqual(response.data["duplicates"], 1)
+        first, second = response.data["results"]
+        self.assertEqual(second["notification_id"], first["notification_id"])
+        self.assertTrue(second["duplicate"])
+
+
+class CollapseTests(NotificationTestCase):
+    def test_repeated_events_collapse_into_one_delivery(self):
+        user = self.users[0]
+        for _ in range(3):
+            self.trigger("new_login", {"user_id": str(user.id)}, collapse_key="logins")
+            self.run_worker()
+
+        delivery = NotificationDelivery.objects.get(user=user)
+        self.assertEqual(delivery.collapsed_count, 3)
+        self.assertEqual(delivery.notification, Notification.objects.order_by("-id").first())
+
+    def test_different_keys_do_not_collapse(self):
+        user = self.users[0]
+        self.trigger("new_login", {"user_id": str(user.id)}, collapse_key="logins-a")
+        self.trigger("new_login", {"user_id": str(user.id)}, collapse_key="logins-b")
+        self.run_worker()
+
+        self.assertEqual(NotificationDelivery.objects.filter(user=user).count(), 2)
+
+    def test_bulk_events_collapse_within_the_request(self):
+        user = self.users[0]
+        event = {"event": "new_login", "data": {"user_id": str(user.id)}, "collapse_key": "logins"}
+
+        self.client.post(url("notification-trigger-bulk"), [event] * 3, format="json")
+
+        delivery = NotificationDelivery.objects.get(user=user)
+        self.assertEqual(delivery.collapsed_count, 3)
+        self.assertEqual(delivery.notification, Notification.objects.order_by("-id").first())
+
+
+class DigestTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.users[0]
+        NotificationPreference.objects.create(
+            user=self.user, notification_type=registry.get("new_comment"), channel="email"
+        )
+        self.trigger("new_comment", {"comment": "First"})
+        self.trigger("new_comment", {"comment": "Second"})
+        self.run_worker()
+
+    def digest(self, **options):
+        call_command("notification_digest", stdout=StringIO(), **options)
+
+    def test_buffered_entries_are_emitted_as_one_digest(self):
+        self.assertEqual(DigestEntry.objects.filter(user=self.user).count(), 2)
+        self.assertFalse(NotificationDelivery.objects.filter(channel="email").exists())
+
+        self.digest()
+
+        digest = Notification.objects.get(notification_type=registry.get("weekly_summary"))
+        self.assertEqual(digest.metadata["user_id"], str(self.user.id))
+        self.assertEqual(digest.content, "Here is your weekly summary: 2 New Comment.")
+        delivery = NotificationDelivery.objects.get(notification=digest)
+        self.assertEqual((delivery.user, delivery.channel), (self.user, "email"))
+        self.assertIsNotNone(delivery.next_attempt_at)
+        self.assertFalse(DigestEntry.objects.filter(digested_at__isnull=True).exists())
+
+        self.digest()
+        digests = Notification.objects.filter(notification_type=digest.notification_type)
+        self.assertEqual(digests.count(), 1)
+
+    def test_until_only_digests_older_entries(self):
+        self.digest(until="2000-01-01T00:00:00")
+
+        self.assertEqual(DigestEntry.objects.filter(digested_at__isnull=True).count(), 2)
+
+        until = timezone.localtime() + timedelta(minutes=1)
+        self.digest(until=until.replace(tzinfo=None).isoformat())
+
+        self.assertFalse(DigestEntry.objects.filter(digested_at__isnull=True).exists())
+
+    def test_invalid_until_is_rejected(self):
+        for value in ["last week", "2024-02-30T10:00:00"]:
+            with self.assertRaises(CommandError):
+                self.digest(until=value)
+
+
+class TemplateRenderingTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.notif_type = NotificationType.objects.get(notification_code="new_comment")
+        self.set_templates({"default": "Comment: {{ comment }}", "sms": "SMS: {{ comment }}"})
+
+    def set_templates(self, templates):
+        self.notif_type.templates = templates
+        self.notif_type.save()
+        self.notif_type = registry.get("new_comment")
+
+    def test_html_channels_escape_the_event_data(self):
+        context = {"comment": "<b>hi</b>"}
+
+        self.assertEqual(render(self.notif_type, "in_app", context), "Comment: &lt;b&gt;hi&lt;/b&gt;")
+        self.assertEqual(render(self.notif_type, "email", context), "Comment: &lt;b&gt;hi&lt;/b&gt;")
+        self.assertEqual(render(self.notif_type, "sms", context), "SMS: <b>hi</b>")
+
+    def test_types_without_templates_render_their_name(self):
+        self.set_templates({})
+
+        self.assertEqual(render(self.notif_type, "in_app"), "New Comment")
+
+    def test_templates_are_compiled_once(self):
+        template = get_template(self.notif_type, "in_app")
+
+        self.assertIs(get_template(self.notif_type, "in_app"), template)
+        self.assertIsNot(get_template(self.notif_type, "sms"), template)
+
+    def test_saving_a_type_recompiles_its_templates(self):
+        template = get_template(self.notif_type, "in_app")
+
+        self.set_templates({"default": "Updated: {{ comment }}"})
+
+        self.assertIsNot(get_template(self.notif_type, "in_app"), template)
+        self.assertEqual(render(self.notif_type, "in_app", {"comment": "x"}), "Updated: x")
+        self.assertEqual(render(self.notif_type, "sms", {"comment": "x"}), "Updated: x")
+
+    def test_personalized_templates_render_per_user(self):
+        self.set_templates({"default": "Hi {{ user.username }}"})
+
+        rendered = render_many(self.notif_type, "in_app", {}, self.users)
+
+        self.assertEqual(rendered, [f"Hi {user.username}" for user in self.users])
+
+    def test_trigger_renders_the_type_template(self):
+        notification_id = self.trigger("new_comment", {"comment": "Nice"}).data["notification_id"]
+
+        self.assertEqual(Notification.objects.get(pk=notification_id).content, "Comment: Nice")
+
+
+class HTMLSanitizerTests(SimpleTestCase):
+    def test_script_and_style_are_dropped_with_their_content(self):
+        html = "<p>Hi<script>alert(1)</script><style>p {color: red}</style> there</p>"
+
+        self.assertEqual(sanitize_html(html), "<p>Hi there</p>")
+
+    def test_unsafe_hrefs_are_removed(self):
+        for href in [
+            "javascript:alert(1)",
+            "JAVASCRIPT:alert(1)",
+            "jav&#x61;script:alert(1)",
+            "&#106;avascript:alert(1)",
+            " java\tscript:alert(1)",
+            "data:text/html,<script>alert(1)</script>",
+        ]:
+            with self.subTest(href=href):
+                self.assertEqual(sanitize_html(f'<a href="{href}">x</a>'), "<a>x</a>")
+
+    def test_attributes_outside_the_allowlist_are_stripped(self):
+        html = (
+            '<p style="color: red" onclick="steal()">t</p>'
+            '<a href="https://example.com/?a=1&b=2" title="t" target="_blank" onclick="x()">x</a>'
+        )
+
+        self.assertEqual(
+            sanitize_html(html),
+            '<p>t</p><a href="https://example.com/?a=1&amp;b=2" title="t">x</a>',
+        )
+
+    def test_unknown_tags_are_unwrapped_and_text_escaped(self):
+        html = '<div><img src=x onerror="alert(1)">1 < 2 & 3</div>'
+
+        self.assertEqual(sanitize_html(html), "1 &lt; 2 &amp; 3")
+
+    def test_unbalanced_tags_are_closed(self):
+        self.assertEqual(sanitize_html("<p><b>bold"), "<p><b>bold</b></p>")
+        self.assertEqual(
+            sanitize_html("<ul><li>one<li>two</ul>"), "<ul><li>one</li><li>two</li></ul>"
+        )
+        self.assertEqual(sanitize_html("a</b>c"), "ac")
+
+    def test_text_rendition_keeps_one_line_per_block(self):
+        html = "<p>Hello <b>world</b></p><ul><li>one</li><li>two</li></ul><script>x</script>"
+
+        self.assertEqual(html_to_text(html), "Hello world\n- one\n- two")
+
+
+class TruncateSmsTests(SimpleTestCase):
+    def test_gsm7_text_gets_160_characters(self):
+        self.assertEqual(truncate_sms("a" * 160, max_segments=1), "a" * 160)
+        self.assertEqual(truncate_sms("a" * 161, max_segments=1), "a" * 157 + "...")
+
+    def test_gsm7_extension_characters_count_twice(self):
+        self.assertEqual(truncate_sms("€" * 80, max_segments=1), "€" * 80)
+        self.assertEqual(truncate_sms("€" * 81, max_segments=1), "€" * 78 + "...")
+
+    def test_other_text_is_limited_to_70_ucs2_units(self):
+        self.assertEqual(truncate_sms("ж" * 70, max_segments=1), "ж" * 70)
+        self.assertEqual(truncate_sms("ж" * 71, max_segments=1), "ж" * 67 + "...")
+        # Characters outside the BMP take two code units.
+        self.assertEqual(truncate_sms("😀" * 36, max_segments=1), "😀" * 33 + "...")
+
+    def test_multipart_messages_use_the_per_segment_limit(self):
+        self.assertEqual(truncate_sms("a" * 306, max_segments=2), "a" * 306)
+        self.assertEqual(truncate_sms("a" * 307, max_segments=2), "a" * 303 + "...")
+        self.assertEqual(truncate_sms("ж" * 135, max_segments=2), "ж" * 131 + "...")
+
+    @override_settings(NOTIFICATION_SMS_MAX_SEGMENTS=2)
+    def test_segments_default_to_the_setting(self):
+        self.assertEqual(truncate_sms("a" * 200), "a" * 200)
+
+
+SHARED_PREFERENCE_CACHE = {"MAX_SIZE": 100, "LOCAL_TTL": 0, "BACKEND": "default", "TIMEOUT": 60}
+
+
+class PreferenceCacheTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        caches["default"].clear()
+        self.weekly = registry.get("weekly_summary")
+        self.pair = (self.users[0].id, self.weekly.id)
+        self.key = PreferenceCache.make_key(*self.pair)
+
+    def test_resolutions_are_cached_until_a_preference_changes(self):
+        self.assertEqual(resolve_channels([self.pair])[self.key], {"in_app"})
+        with self.assertNumQueries(0):
+            resolve_channels([self.pair])
+
+        NotificationPreference.objects.create(
+            user=self.users[0], notification_type=self.weekly, channel="email"
+        )
+
+        self.assertEqual(resolve_channels([self.pair])[self.key], {"in_app", "email"})
+
+    def test_default_channel_changes_invalidate_every_user(self):
+        pairs = [(user.id, self.weekly.id) for user in self.users]
+        resolve_channels(pairs)
+
+        notif_type = NotificationType.objects.get(pk=self.weekly.id)
+        notif_type.default_channels = ["email"]
+        notif_type.save()
+
+        self.assertEqual(set(resolve_channels(pairs).values()), {frozenset({"email"})})
+
+    def test_load_racing_an_invalidation_is_not_cached(self):
+        for config in [settings.NOTIFICATION_PREFERENCE_CACHE, SHARED_PREFERENCE_CACHE]:
+            with self.subTest(backend=config["BACKEND"]), override_settings(
+                NOTIFICATION_PREFERENCE_CACHE=config
+            ):
+                cache = get_preference_cache()
+                versions = cache.get_versions([self.key])
+                cache.invalidate(*self.pair)
+
+                cache.set_many({self.key: frozenset({"email"})}, versions)
+
+                self.assertEqual(cache.get_many([self.key]), {})
+
+    def test_invalidations_reach_other_processes_through_versioned_keys(self):
+        writer = PreferenceCache(local_ttl=0, backend="default")
+        reader = PreferenceCache(local_ttl=0, backend="default")
+        for invalidate in [lambda: writer.invalidate(*self.pair), writer.invalidate_all]:
+            writer.set_many({self.key: frozenset({"in_app"})})
+            self.assertEqual(reader.get_many([self.key]), {self.key: {"in_app"}})
+
+            invalidate()
+
+            self.assertEqual(reader.get_many([self.key]), {})
+
+    def test_stats_endpoint(self):
+        resolve_channels([self.pair])
+        resolve_channels([self.pair])
+
+        response = self.client.get(url("notification-preference-cache-stats"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["hits"], 1)
+        self.assertEqual(response.data["misses"], 1)
+        self.assertEqual(response.data["hit_rate"], 0.5)
+        user_client = self.login(self.users[0])
+        response = user_client.get(url("notification-preference-cache-stats"))
+        self.assertEqual(response.status_code, 403)
+
+
+class PreferenceApiTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.users[0]
+        self.user_client = self.login(self.user)
+        self.weekly = registry.get("weekly_summary")
+        self.pair = (self.user.id, self.weekly.id)
+
+    def detail_url(self, pk):
+        return reverse("notificationpreference-detail", kwargs={"version": "v1", "pk": pk})
+
+    def preferences(self):
+        items = self.user_client.get(url("notificationpreference-list")).data["results"]
+        return {(item["notification_type"], item["channel"]): item for item in items}
+
+    def channels(self):
+        return resolve_channels([self.pair])[PreferenceCache.make_key(*self.pair)]
+
+    def test_list_includes_the_type_defaults(self):
+        preferences = self.preferences()
+
+        self.assertEqual(set(preferences), {(t.id, "in_app") for t in registry.all()})
+        self.assertTrue(all(item["is_default"] for item in preferences.values()))
+        self.assertTrue(all(item["enabled"] for item in preferences.values()))
+
+    def test_create_patch_and_delete(self):
+        response = self.user_client.post(
+            url("notificationpreference-list"),
+            {"notification_type": self.weekly.id, "channel": "email", "enabled": True},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        pk = response.data["id"]
+        self.assertEqual(self.channels(), {"in_app", "email"})
+        self.assertFalse(self.preferences()[(self.weekly.id, "email")]["is_default"])
+
+        response = self.user_client.patch(self.detail_url(pk), {"enabled": False}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.channels(), {"in_app"})
+        self.assertFalse(self.preferences()[(self.weekly.id, "email")]["enabled"])
+
+        response = self.user_client.delete(self.detail_url(pk))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.channels(), {"in_app"})
+        self.assertNotIn((self.weekly.id, "email"), self.preferences())
+        self.assertFalse(NotificationPreference.objects.exists())
+        self.assertFalse(NotificationPreferenceMask.objects.exists())
+
+    def test_opting_out_of_a_default_channel(self):
+        response = self.user_client.post(
+            url("notificationpreference-list"),
+            {"notification_type": self.weekly.id, "channel": "in_app", "enabled": False},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.channels(), set())
+        entry = self.preferences()[(self.weekly.id, "in_app")]
+        self.assertEqual((entry["enabled"], entry["is_default"]), (False, False))
+
+    def test_defaults_are_not_stored(self):
+        self.assertIsNone(self.preferences()[(self.weekly.id, "in_app")]["id"])
+
+
+@override_settings(NOTIFICATION_PREFERENCE_STORAGE="bitmask")
+class BitmaskPreferenceApiTests(PreferenceApiTests):
+    def test_defaults_are_not_stored(self):
+        entry = self.preferences()[(self.weekly.id, "in_app")]
+
+        self.assertEqual(entry["id"], get_entry_id(self.weekly.id, "in_app"))
+        self.assertFalse(NotificationPreferenceMask.objects.exists())
+
+    def test_synthetic_ids_round_trip(self):
+        for channel in ["in_app", "email", "sms"]:
+            self.assertEqual(
+                parse_entry_id(get_entry_id(self.weekly.id, channel)), (self.weekly.id, channel)
+            )
+        self.assertEqual(parse_entry_id(self.weekly.id * 8 + 7), (None, None))
+
+    def test_unknown_entry_ids_are_not_found(self):
+        for pk in [get_entry_id(self.weekly.id, "email"), self.weekly.id * 8 + 7, "abc"]:
+            with self.subTest(pk=pk):
+                self.assertEqual(self.user_client.get(self.detail_url(pk)).status_code, 404)
+
+    def test_default_entries_can_be_updated(self):
+        pk = get_entry_id(self.weekly.id, "in_app")
+
+        response = self.user_client.patch(self.detail_url(pk), {"enabled": False}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.channels(), set())
+        mask = NotificationPreferenceMask.objects.get()
+        self.assertEqual((mask.channels, mask.overridden), (0, 1))
+
+    def test_masks_hold_the_enabled_and_overridden_channels(self):
+        def mask():
+            row = NotificationPreferenceMask.objects.filter(user=self.user).first()
+            return row and (row.channels, row.overridden)
+
+        set_override(self.user.id, self.weekly.id, "email", True)
+        self.assertEqual(mask(), (0b010, 0b010))
+        set_override(self.user.id, self.weekly.id, "in_app", False)
+        self.assertEqual(mask(), (0b010, 0b011))
+        self.assertEqual(self.channels(), {"email"})
+
+        clear_override(self.user.id, self.weekly.id, "email")
+        self.assertEqual(mask(), (0b000, 0b001))
+        clear_override(self.user.id, self.weekly.id, "in_app")
+        self.assertIsNone(mask())
+        self.assertEqual(self.channels(), {"in_app"})
+
+
+class ConvertPreferencesTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        weekly = registry.get("weekly_summary")
+        comment = registry.get("new_comment")
+        NotificationPreference.objects.bulk_create(
+            [
+                NotificationPreference(
+                    user=self.users[0], notification_type=weekly, channel="in_app", enabled=False
+                ),
+                NotificationPreference(user=self.users[0], notification_type=weekly, channel="email"),
+                NotificationPreference(user=self.users[1], notification_type=comment, channel="sms"),
+            ]
+        )
+        self.pairs = [(user.id, t.id) for user in self.users for t in registry.all()]
+
+    def convert(self, to):
+        call_command(
+            "convert_preferences", to=to, delete_source=True, chunk_size=1, stdout=StringIO()
+        )
+
+    def test_round_trip(self):
+        rows = set(
+            NotificationPreference.objects.values_list(
+                "user_id", "notification_type_id", "channel", "enabled"
+            )
+        )
+        channels = resolve_channels(self.pairs)
+
+        self.convert("bitmask")
+
+        self.assertFalse(NotificationPreference.objects.exists())
+        masks = NotificationPreferenceMask.objects.values_list(
+            "user_id", "notification_type__notification_code", "channels", "overridden"
+        )
+        self.assertEqual(
+            set(masks),
+            {
+                (self.users[0].id, "weekly_summary", 0b010, 0b011),
+                (self.users[1].id, "new_comment", 0b100, 0b100),
+            },
+        )
+        with override_settings(NOTIFICATION_PREFERENCE_STORAGE="bitmask"):
+            self.assertEqual(resolve_channels(self.pairs), channels)
+
+        self.convert("rows")
+
+        self.assertFalse(NotificationPreferenceMask.objects.exists())
+        converted = NotificationPreference.objects.values_list(
+            "user_id", "notification_type_id", "channel", "enabled"
+        )
+        self.assertEqual(set(converted), rows)
+        self.assertEqual(resolve_channels(self.pairs), channels)
+
+
+class ImplicitPreferenceTests(NotificationTestCase):
+    """
+    Users without overrides receive the type's default channels; overrides opt
+    in to other channels or out of a default one.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.weekly = registry.get("weekly_summary")
+        self.set_preference(self.users[0], "in_app", False)
+        self.set_preference(self.users[1], "email", True)
+        self.expected = {
+            (self.admin.id, "in_app"),
+            (self.users[1].id, "in_app"),
+            (self.users[1].id, "email"),
+            (self.users[2].id, "in_app"),
+        }
+
+    def set_preference(self, user, channel, enabled):
+        if get_storage() == STORAGE_BITMASK:
+            set_override(user.id, self.weekly.id, channel, enabled)
+        else:
+            NotificationPreference.objects.create(
+                user=user, notification_type=self.weekly, channel=channel, enabled=enabled
+            )
+
+    def test_audience_preferences(self):
+        users = User.objects.all()
+
+        self.assertEqual(set(get_audience_preferences(self.weekly, users)), self.expected)
+        self.assertEqual(
+            set(get_audience_preferences(self.weekly, users, exclude_channel="in_app")),
+            {(self.users[1].id, "email")},
+        )
+
+    def test_preference_source_sql(self):
+        source, params = preference_source_sql(self.weekly)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT pref.user_id, pref.channel FROM {source} AS pref", params)
+            rows = cursor.fetchall()
+
+        to_python = User._meta.pk.to_python
+        self.assertEqual(len(rows), len(self.expected))
+        self.assertEqual({(to_python(user_id), channel) for user_id, channel in rows}, self.expected)
+
+    def test_preference_exists(self):
+        def receives(user, channel):
+            types = NotificationType.objects.filter(preference_exists(user, channel, "pk"))
+            return self.weekly.id in set(types.values_list("id", flat=True))
+
+        self.assertFalse(receives(self.users[0], "in_app"))
+        self.assertTrue(receives(self.users[1], "in_app"))
+        self.assertTrue(receives(self.users[1], "email"))
+        self.assertFalse(receives(self.users[2], "email"))
+
+    def test_fan_out_on_both_engines(self):
+        for engine in [FANOUT_ENGINE_PYTHON, FANOUT_ENGINE_SQL]:
+            with self.subTest(engine=engine), override_settings(NOTIFICATION_FANOUT_ENGINE=engine):
+                notification_id = self.trigger("weekly_summary").data["notification_id"]
+                self.run_worker()
+
+                deliveries = NotificationDelivery.objects.filter(notification_id=notification_id)
+                self.assertEqual(set(deliveries.values_list("user_id", "channel")), self.expected)
+
+
+@override_settings(NOTIFICATION_PREFERENCE_STORAGE="bitmask")
+class BitmaskImplicitPreferenceTests(ImplicitPreferenceTests):
+    """
+    The same merge with the overrides stored as bitmasks.
+    """
+
+
+class SignupProvisioningTests(NotificationTestCase):
+    def signup(self):
+        return User.objects.create_user(
+            username="newcomer", email="newcomer@example.com", password="secret"
+        )
+
+    def test_implicit_defaults_store_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            user = self.signup()
+
+        self.assertFalse(NotificationPreference.objects.filter(user=user).exists())
+
+    @override_settings(NOTIFICATION_EAGER_PREFERENCES=True)
+    def test_eager_defaults_are_stored_once_the_signup_commits(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            user = self.signup()
+            self.assertFalse(NotificationPreference.objects.filter(user=user).exists())
+
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        stored = NotificationPreference.objects.filter(user=user)
+        self.assertEqual(
+            set(stored.values_list("notification_type_id", "channel")),
+            {(t.id, channel) for t in registry.all() for channel in t.default_channels},
+        )
+
+    @override_settings(NOTIFICATION_EAGER_PREFERENCES=True, NOTIFICATION_PREFERENCE_STORAGE="bitmask")
+    def test_eager_defaults_on_the_bitmask_storage(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            user = self.signup()
+
+        masks = NotificationPreferenceMask.objects.filter(user=user)
+        self.assertEqual(masks.count(), len(registry.all()))
+        self.assertEqual(set(masks.values_list("channels", "overridden")), {(0b001, 0b001)})
+
+
+@override_settings(NOTIFICATION_EAGER_PREFERENCES=True)
+class BackfillPreferencesTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.weekly = registry.get("weekly_summary")
+        self.user_ids = sorted(User.objects.values_list("id", flat=True))
+
+    def backfill(self, **options):
+        call_command(
+            "backfill_preferences", type="weekly_summary", chunk_size=1, stdout=StringIO(), **options
+        )
+
+    def backfilled(self):
+        preferences = NotificationPreference.objects.filter(notification_type=self.weekly)
+        return sorted(preferences.values_list("user_id", flat=True))
+
+    def test_backfill_stores_the_defaults_of_every_user(self):
+        self.backfill()
+
+        self.assertEqual(self.backfilled(), self.user_ids)
+        backfill = PreferenceBackfill.objects.get()
+        self.assertEqual(backfill.status, "completed")
+        self.assertEqual((backfill.processed, backfill.total), (4, 4))
+
+    def test_interrupted_backfill_resumes_after_its_checkpoint(self):
+        PreferenceBackfill.objects.create(
+            notification_type=self.weekly,
+            status="failed",
+            last_user_id=str(self.user_ids[1]),
+            processed=2,
+            total=4,
+            started_at=timezone.now(),
+        )
+
+        self.backfill()
+
+        self.assertEqual(self.backfilled(), self.user_ids[2:])
+        backfill = PreferenceBackfill.objects.get()
+        self.assertEqual((backfill.status, backfill.processed), ("completed", 4))
+
+    def test_restart_ignores_the_checkpoint(self):
+        PreferenceBackfill.objects.create(
+            notification_type=self.weekly, status="failed", last_user_id=str(self.user_ids[1])
+        )
+
+        self.backfill(restart=True)
+
+        self.assertEqual(self.backfilled(), self.user_ids)
+
+    @override_settings(NOTIFICATION_EAGER_PREFERENCES=False)
+    def test_implicit_defaults_need_force(self):
+        self.backfill()
+        self.assertEqual(self.backfilled(), [])
+
+        self.backfill(force=True)
+        self.assertEqual(self.backfilled(), self.user_ids)
+
+
+class TypeRegistryTests(NotificationTestCase):
+    def test_targeted_event_without_user_is_rejected(self):
+        response = self.trigger("new_login", {})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("user_id", response.data["data"])
+        self.assertFalse(Notification.objects.exists())
+
+    def test_targeting_follows_the_type(self):
+        NotificationType.objects.filter(notification_code="weekly_summary").update(is_targeted=True)
+        registry.invalidate()
+        user = self.users[0]
+
+        self.trigger("weekly_summary", {"user_id": str(user.id)})
+        self.run_worker()
+
+        self.assertEqual(
+            list(NotificationDelivery.objects.values_list("user_id", flat=True)), [user.id]
+        )
+
+    def test_trigger_resolves_types_without_querying_them(self):
+        registry.active()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.trigger("weekly_summary")
+
+        tables = " ".join(query["sql"] for query in queries)
+        self.assertNotIn(NotificationType._meta.db_table, tables)
+
+    def test_saved_types_are_reloaded(self):
+        notif_type = NotificationType.objects.get(notification_code="weekly_summary")
+        registry.active()
+
+        notif_type.is_active = False
+        notif_type.save()
+
+        self.assertIsNone(registry.get("weekly_summary"))
+        self.assertEqual(self.trigger("weekly_summary").status_code, 400)
+
+
+class UnreadCounterTests(NotificationTestCase):
+    def test_counters_follow_fanout_and_reads(self):
+        self.trigger("weekly_summary")
+        self.trigger("weekly_summary")
+        self.run_worker()
+        user = self.users[0]
+        self.assertEqual(get_unread_counts(user)[NotificationChannel.IN_APP], 2)
+
+        client = self.login(user)
+        delivery = NotificationDelivery.objects.filter(user=user).first()
+        for _ in range(2):
+            # Reading an item twice only decrements once.
+            client.post(url("notification-read"), {"notifications": [delivery.id]}, format="json")
+
+        response = client.get(url("notification-unread-count"))
+        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(response.data["channels"][NotificationChannel.IN_APP], 1)
+
+    def test_reconcile_fixes_drifted_counters(self):
+        self.trigger("weekly_summary")
+        self.run_worker()
+        user = self.users[0]
+        UnreadCounter.objects.filter(user=user).update(count=7)
+
+        drifted = reconcile_counters([user.id, self.users[1].id])
+
+        self.assertEqual(drifted, 1)
+        self.assertEqual(get_unread_counts(user)[NotificationChannel.IN_APP], 1)
+
+    def test_collapsed_deliveries_are_counted_once(self):
+        user = self.users[0]
+        for _ in range(3):
+            self.trigger("new_login", {"user_id": str(user.id)}, collapse_key="logins")
+            self.run_worker()
+
+        self.assertEqual(get_unread_counts(user)[NotificationChannel.IN_APP], 1)
+
+
+class FeedTestCase(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.users[0]
+        self.client = self.login(self.user)
+        now = timezone.now()
+        notifications = Notification.objects.bulk_create(
+            Notification(
+                notification_type=registry.get("weekly_summary"),
+                title=f"Summary {index}",
+                content_html=f"<p>Summary {index}</p>",
+            )
+            for index in range(25)
+        )
+        # Groups of five deliveries share a timestamp, so pages split ties on id.
+        NotificationDelivery.objects.bulk_create(
+            NotificationDelivery(
+                notification=notification,
+                user=self.user,
+                channel=NotificationChannel.IN_APP,
+                status="sent",
+                sent_at=now - timedelta(minutes=index // 5),
+                is_read=index % 2 == 0,
+            )
+            for index, notification in enumerate(notifications)
+        )
+        self.deliveries = NotificationDelivery.objects.filter(user=self.user).order_by(
+            "-sent_at", "-id"
+        )
+
+
+class FeedCursorTests(FeedTestCase):
+    def read_all(self, path):
+        ids = []
+        while path:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            ids += [item["id"] for item in response.data["results"]]
+            path = response.data["next"]
+        return ids
+
+    def test_pages_cover_the_history_once_in_order(self):
+        ids = self.read_all(url("notification-history"))
+
+        self.assertEqual(ids, list(self.deliveries.values_list("id", flat=True)))
+
+    def test_unread_pages_only_hold_unread_items(self):
+        ids = self.read_all(url("notification-unread"))
+
+        unread = self.deliveries.filter(is_read=False)
+        self.assertEqual(ids, list(unread.values_list("id", flat=True)))
+
+    def test_last_page_has_no_next_link(self):
+        response = self.client.get(url("notification-history"))
+        response = self.client.get(response.data["next"])
+        response = self.client.get(response.data["next"])
+
+        self.assertEqual(len(response.data["results"]), 5)
+        self.assertIsNone(response.data["next"])
+
+    def test_since_only_returns_newer_items(self):
+        since = self.deliveries[4].sent_at - timedelta(seconds=1)
+
+        response = self.client.get(url("notification-history"), {"since": since.isoformat()})
+
+        self.assertEqual(len(response.data["results"]), 5)
+        self.assertIsNone(response.data["next"])
+
+    def test_invalid_cursor_is_not_found(self):
+        tampered = [
+            base64.urlsafe_b64encode(payload).decode()
+            for payload in [b'["not a date",1,2]', b'["2024-02-30T10:00:00",1,2]']
+        ]
+        for cursor in ["garbage", *tampered]:
+            response = self.client.get(url("notification-history"), {"cursor": cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_invalid_since_and_until_are_rejected(self):
+        for name in ["since", "until"]:
+            for value in ["yesterday", "2024-02-30T10:00:00"]:
+                with self.subTest(name=name, value=value):
+                    response = self.client.get(url("notification-history"), {name: value})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn(name, response.data)
+
+
+class FeedQueryBudgetTests(FeedTestCase):
+    """
+    A page costs the JWT user lookup plus one query per feed source, whatever
+    the depth of the cursor.
+    """
+
+    def assertWithinBudget(self, path, params=None):
+        with self.assertNumQueries(settings.NOTIFICATION_FEED_QUERY_BUDGET):
+            response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_history_page(self):
+        registry.active()
+        self.assertWithinBudget(url("notification-history"))
+
+    def test_unread_page(self):
+        registry.active()
+        self.assertWithinBudget(url("notification-unread"))
+
+    def test_cursor_page(self):
+        registry.active()
+        first = self.client.get(url("notification-history"))
+        response = self.assertWithinBudget(first.data["next"])
+        self.assertEqual(len(response.data["results"]), 10)
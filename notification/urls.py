@@ -2,12 +2,16 @@ from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
 from .views import (
+    NotificationBulkTriggerView,
     NotificationHistoryView,
+    NotificationJobDetailView,
     NotificationPreferenceViewSet,
     NotificationReadView,
     NotificationTriggerView,
     NotificationTypeList,
+    NotificationUnreadCountView,
     NotificationUnReadListView,
+    PreferenceCacheStatsView,
 )
 
 router = DefaultRouter()
@@ -36,10 +40,30 @@ urlpatterns = router.urls + [
         NotificationTriggerView.as_view(),
         name="notification-trigger",
     ),
+    path(
+        "jobs/<int:pk>/",
+        NotificationJobDetailView.as_view(),
+        name="notification-job-detail",
+    ),
+    path(
+        "trigger/bulk/",
+        NotificationBulkTriggerView.as_view(),
+        name="notification-trigger-bulk",
+    ),
+    path(
+        "preference-cache/stats/",
+        PreferenceCacheStatsView.as_view(),
+        name="notification-preference-cache-stats",
+    ),
     path("read/", NotificationReadView.as_view(), name="notification-read"),
     path(
         "unread/",
         NotificationUnReadListView.as_view(),
         name="notification-unread",
     ),
+    path(
+        "unread/count/",
+        NotificationUnreadCountView.as_view(),
+        name="notification-unread-count",
+    ),
 ]
@@ -1,21 +1,41 @@
 import logging
+import time
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import transaction
-from django.utils import timezone
+from django.db import IntegrityError, connection, transaction
+from django.http import Http404
 from drf_spectacular.utils import extend_schema
 from rest_framework import generics, status, viewsets
 from rest_framework.generics import ListAPIView
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from .counters import decrement_unread, get_unread_counts
+from .fanout import create_targeted_deliveries
+from .feed import (get_feed_sources, get_unread_global_notifications,
+                   mark_global_notifications_read)
+from .idempotency import find_notifications, release_keys
+from .jobs import enqueue_notification
 from .models import (Notification, NotificationChannel, NotificationDelivery,
-                     NotificationPreference, NotificationType)
-from .serializers import (NotificationDeliverySerializer,
+                     NotificationJob, NotificationPreference, NotificationType)
+from .pagination import FeedCursorPagination
+from .parsers import NDJSONParser
+from .preferences import (STORAGE_BITMASK, clear_override,
+                          get_preference_cache, get_preference_entries,
+                          get_preference_entry, get_storage,
+                          invalidate_preference)
+from .rendering import render
+from .renditions import set_renditions
+from .serializers import (NotificationFeedSerializer,
+                          NotificationJobSerializer,
+                          NotificationPreferenceEntrySerializer,
                           NotificationPreferenceSerializer,
                           NotificationReadSerializer,
-                          NotificationTriggerSerializer, NotificationTypeList)
+                          NotificationTriggerSerializer, NotificationTypeList,
+                          serialize_feed_items)
 
 User = get_user_model()
 logger = logging.getLogger("django")
@@ -29,8 +49,45 @@ class NotificationPreferenceViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        if self.uses_bitmask or self.action == "list":
+            # Lists include the type defaults the user did not override.
+            return get_preference_entries(user)
         return self.queryset.filter(user=user)
 
+    @property
+    def uses_bitmask(self):
+        return get_storage() == STORAGE_BITMASK
+
+    def get_serializer_class(self):
+        if self.uses_bitmask:
+            return NotificationPreferenceEntrySerializer
+        return super().get_serializer_class()
+
+    def filter_queryset(self, queryset):
+        if isinstance(queryset, list):
+            return queryset
+        return super().filter_queryset(queryset)
+
+    def get_object(self):
+        if not self.uses_bitmask:
+            return super().get_object()
+        entry = get_preference_entry(self.request.user, self.kwargs["pk"])
+        if entry is None:
+            raise Http404("No preference matches the given query.")
+        return entry
+
+    def perform_update(self, serializer):
+        if not self.uses_bitmask:
+            # post_save only invalidates the new (user, type); the old one changes too.
+            invalidate_preference(serializer.instance.user_id, serializer.instance.notification_type_id)
+        super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        if self.uses_bitmask:
+            clear_override(self.request.user.id, instance.notification_type_id, instance.channel)
+            return
+        super().perform_destroy(instance)
+
 
 @extend_schema(tags=["Notifications Trigger"])
 class NotificationTriggerView(APIView):
@@ -42,158 +99,238 @@ class NotificationTriggerView(APIView):
     permission_classes = [IsAdminUser]
     serializer_class = NotificationTriggerSerializer
 
-    SUPPORTED_EVENTS = ["new_comment", "new_login", "weekly_summary"]
-
     def post(self, request, *args, **kwargs):
         serializer = NotificationTriggerSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
         event_code = serializer.validated_data["event"]
         data = serializer.validated_data["data"]
+        idempotency_key = serializer.validated_data.get(
+            "idempotency_key"
+        ) or request.headers.get("Idempotency-Key")
 
         logger.info(f"Notification trigger requested: event={event_code}, data={data}")
 
-        if event_code not in self.SUPPORTED_EVENTS:
-            logger.warning(f"Unsupported event type: {event_code}")
+        if idempotency_key and len(idempotency_key) > 255:
             return Response(
-                {"error": "Invalid or unsupported event name."},
+                {"error": "Idempotency key must be at most 255 characters."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        expired_keys = []
+        if idempotency_key:
+            recent, expired_keys = find_notifications([idempotency_key])
+            if idempotency_key in recent:
+                return self._duplicate_response(idempotency_key, recent[idempotency_key])
+
+        # Resolved from the type registry during validation.
+        notify_type = serializer.validated_data["notification_type"]
+        notification = self._build_notification(notify_type, data)
+        notification.idempotency_key = idempotency_key
+        notification.collapse_key = serializer.validated_data.get("collapse_key")
+        logger.info(f"Generated message for event {event_code}: {notification.content}")
+
+        # The fan-out and the dispatch run in the notification worker, the request
+        # only writes the notification and its outbox job.
         try:
-            notify_type = NotificationType.objects.get(notification_code=event_code)
-        except NotificationType.DoesNotExist:
-            logger.error(f"Notification type not found: {event_code}")
-            return Response(
-                {"error": "Notification type not found."},
-                status=status.HTTP_404_NOT_FOUND,
-            )
-
-        message = self._generate_message(event_code, data)
-        logger.info(f"Generated message for event {event_code}: {message}")
-
-        with transaction.atomic():
-            notification = Notification.objects.create(
-                notification_type=notify_type,
-                title=notify_type.name,
-                content=message,
-                is_global=True if event_code != "new_login" else False,
-                created_at=timezone.now(),
-            )
-
-            logger.info(f"Notification created: id={notification.id}")
-            # Determine recipients based on event type for specific notifications event new_login for provided user_id
-            # For other events, we assume all users should receive the notification.
-            users = self._get_target_users(event_code, data)
-            logger.info(f"Target users: {[user.id for user in users]}")
-
-            # Deliver the notification to users based on their preferences provided
-            delivery_count = self._create_deliveries(notification, notify_type, users)
+            with transaction.atomic():
+                release_keys(expired_keys)
+                notification.save()
+                job = enqueue_notification(notification)
+        except IntegrityError:
+            # A concurrent request with the same key won the unique index.
+            recent, _ = find_notifications([idempotency_key])
+            if idempotency_key not in recent:
+                raise
+            return self._duplicate_response(idempotency_key, recent[idempotency_key])
+
+        logger.info(f"Notification created: id={notification.id}, job={job.id}")
 
         return Response(
             {
-                "detail": f"Notification triggered: {delivery_count} deliveries created.",
+                "detail": "Notification queued for delivery.",
                 "notification_id": notification.id,
+                "job_id": job.id,
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    def _duplicate_response(self, idempotency_key, notification_id):
+        logger.info(
+            f"Duplicate trigger ignored: idempotency_key={idempotency_key}, "
+            f"notification={notification_id}"
+        )
+        return Response(
+            {
+                "detail": "Duplicate trigger, the notification was already queued.",
+                "notification_id": notification_id,
+                "duplicate": True,
             },
             status=status.HTTP_200_OK,
         )
 
-    def _generate_message(self, event_code: str, data: dict) -> str:
+    def _build_notification(self, notify_type, data: dict):
         """
-        Dynamically generates message content based on event type.
+        Builds the (unsaved) notification for an event. Events of targeted
+        types go to the user in data.user_id, the others to all users. The
+        content is rendered from the type's template with the event data.
         """
-        if event_code == "new_comment":
-            return f"New comment posted: {data.get('comment', '(no content)')}"
-        elif event_code == "new_login":
-            return "New login from an unrecognized device."
-        elif event_code == "weekly_summary":
-            return "Here is your weekly summary."
-        return "Notification."
-
-    def _get_target_users(self, event_code: str, data: dict):
-        """
-        Resolves which users should receive the notification.
-        """
-        if event_code == "new_login":
-            user_id = data.get("user_id")
-            if user_id:
-                return User.objects.filter(id=user_id)
-            return User.objects.none()
-        else:
-            return User.objects.all()
+        is_global = not notify_type.is_targeted
+        return Notification(
+            notification_type=notify_type,
+            title=notify_type.name,
+            content=render(notify_type, NotificationChannel.IN_APP, data),
+            is_global=is_global,
+            fanout_on_read=is_global and settings.NOTIFICATION_GLOBAL_FANOUT_ON_READ,
+            metadata=data,
+        )
 
-    def _create_deliveries(self, notification, notif_type, users) -> int:
-        """
-        For each user, checks preferences and creates a delivery per channel.
-        """
-        count = 0
-        for user in users:
-            #As the NotificationPreference model is already created with all provided channels if not 
-            # provided, we can directly Create Notification Preference accordg to the user and notification type and channels.
-            #TODO: This should be handled in a separate management command or signal to avoid duplication.
-            # This is a mockup, in real case you would check existing preferences.
-            # For simplicity, we assume all users have preferences set for in_app channels.
-            preferences = NotificationPreference.objects.filter( 
-                user=user,
-                notification_type=notif_type,
+
+@extend_schema(tags=["Notifications Trigger"], request=NotificationTriggerSerializer(many=True))
+class NotificationBulkTriggerView(NotificationTriggerView):
+    """
+    Accepts many events per request, either as a JSON array or as an NDJSON
+    stream (Content-Type: application/x-ndjson).
+
+    Events are validated in one pass, notification types are resolved from the
+    in-process type registry and the notifications are written with bulk_create. Global events get
+    an outbox job each, targeted events get their deliveries created inline and
+    due immediately for the dispatcher. The response holds one result per event,
+    in request order.
+
+    Events carrying an idempotency_key already used within the dedup window (or
+    earlier in the same request) are not created again; their result points to
+    the original notification and is flagged as duplicate.
+    """
+
+    parser_classes = [JSONParser, NDJSONParser]
+
+    def post(self, request, *args, **kwargs):
+        events = request.data
+        if isinstance(events, dict):
+            events = events.get("events")
+        if not isinstance(events, list):
+            return Response(
+                {"error": "Expected a list of events."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(events) > settings.NOTIFICATION_BULK_TRIGGER_MAX_EVENTS:
+            return Response(
+                {
+                    "error": "Too many events, at most "
+                    f"{settings.NOTIFICATION_BULK_TRIGGER_MAX_EVENTS} per request."
+                },
+                status=status.HTTP_400_BAD_REQUEST,
             )
 
-            for pref in preferences:
-                # Create a delivery record for each channel preference and make it ready to send for now simulating the send.
-                # TODO:In Future Notifiation is Send accordingly choosen channel and using scheduler to send faile status messages and track attempts and throttle them.
-                delivery = NotificationDelivery.objects.create(
-                    notification=notification,
-                    user=user,
-                    channel=pref.channel,
-                )
-                self._mock_send(delivery)
-                count += 1
+        results = [{"index": index} for index in range(len(events))]
+        valid = []
+        for index, event in enumerate(events):
+            serializer = NotificationTriggerSerializer(data=event)
+            if not serializer.is_valid():
+                results[index]["errors"] = serializer.errors
+                continue
+            valid.append((index, serializer.validated_data))
+
+        recent, expired_keys = find_notifications(
+            event.get("idempotency_key") for _, event in valid
+        )
 
-        logger.info(f"Total deliveries created: {count}")
-        return count
+        accepted = []
+        duplicates = []
+        first_seen = {}
+        for index, event in valid:
+            notify_type = event["notification_type"]
+            idempotency_key = event.get("idempotency_key")
+            if idempotency_key in recent or idempotency_key in first_seen:
+                duplicates.append((index, idempotency_key))
+                continue
+
+            notification = self._build_notification(notify_type, event["data"])
+            notification.idempotency_key = idempotency_key
+            notification.collapse_key = event.get("collapse_key")
+            if idempotency_key:
+                first_seen[idempotency_key] = notification
+            accepted.append((index, notification))
 
-    def _mock_send(self, delivery: NotificationDelivery):
-        """
-        Simulates sending a notification based on channel.
-        This is where real integration (email, SMS) would go.
-        """
         try:
-            if delivery.channel == NotificationChannel.IN_APP:
-                logger.debug(f"In-app notification queued for user={delivery.user.id}")
-            elif delivery.channel == NotificationChannel.EMAIL:
-                logger.debug(
-                    f"[MOCK EMAIL] To: {delivery.user.email} - {delivery.notification.content}"
+            with transaction.atomic():
+                release_keys(expired_keys)
+                for _, notification in accepted:
+                    set_renditions(notification)
+                notifications = Notification.objects.bulk_create(
+                    [notification for _, notification in accepted]
                 )
-            elif delivery.channel == NotificationChannel.SMS:
-                recipient = getattr(
-                    delivery.user, "phone_number", delivery.user.username
+                global_notifications = [n for n in notifications if n.is_global]
+                jobs = NotificationJob.objects.bulk_create(
+                    [NotificationJob(notification=n) for n in global_notifications]
                 )
-                logger.debug(
-                    f"[MOCK SMS] To: {recipient} - {delivery.notification.content}"
+                delivery_counts = create_targeted_deliveries(
+                    [n for n in notifications if not n.is_global]
                 )
-            # simulation the sending message as sent 
-            # TODO:Wherever,Later we will use actual sending logic for failure.
+        except IntegrityError:
+            # A concurrent request used one of the keys, nothing of this request
+            # was written and retrying it resolves the duplicates.
+            return Response(
+                {"error": "Idempotency key conflict with a concurrent request, retry."},
+                status=status.HTTP_409_CONFLICT,
+            )
 
-            delivery.status = "sent" 
+        job_ids = {job.notification_id: job.id for job in jobs}
+        for index, notification in accepted:
+            results[index]["notification_id"] = notification.id
+            if notification.is_global:
+                results[index]["job_id"] = job_ids[notification.id]
+            else:
+                results[index]["deliveries"] = delivery_counts.get(notification.id, 0)
+        for index, idempotency_key in duplicates:
+            notification_id = recent.get(idempotency_key)
+            if notification_id is None:
+                notification_id = first_seen[idempotency_key].id
+            results[index]["notification_id"] = notification_id
+            results[index]["duplicate"] = True
+
+        rejected = len(events) - len(accepted) - len(duplicates)
+        logger.info(
+            f"Bulk trigger: {len(accepted)} events accepted, "
+            f"{len(duplicates)} duplicates, {rejected} rejected"
+        )
+        return Response(
+            {
+                "accepted": len(accepted),
+                "duplicates": len(duplicates),
+                "rejected": rejected,
+                "results": results,
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
 
-            delivery.sent_at = timezone.now()
-            logger.info(
-                f"Delivery marked as sent: user={delivery.user.id}, channel={delivery.channel}"
-            )
 
-        except Exception as e:
-            delivery.status = "failed"
-            delivery.error_message = str(e)
-            logger.error(
-                f"Failed to send notification: user={delivery.user.id}, "
-                f"channel={delivery.channel}, error={e}"
-            )
+@extend_schema(tags=["Notifications Trigger"])
+class NotificationJobDetailView(generics.RetrieveAPIView):
+    """
+    Reports the progress of a fan-out job: processed and total users and the rate.
+    """
+
+    permission_classes = [IsAdminUser]
+    serializer_class = NotificationJobSerializer
+    queryset = NotificationJob.objects.all()
 
-        delivery.save()
 
-        # For Now NotificationTypeList is used to list all the notification types available in the system.
-        # TODO:In Future, we can create a NotificationType API to create new notification types.
+@extend_schema(tags=["Notification Preferences"])
+class PreferenceCacheStatsView(APIView):
+    """
+    Hit rate of the preference cache of the process serving the request.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_preference_cache().stats(), status=status.HTTP_200_OK)
 
+
+# For Now NotificationTypeList is used to list all the notification types available in the system.
+# TODO:In Future, we can create a NotificationType API to create new notification types.
 @extend_schema(tags=["Notifications View"])
 class NotificationTypeList(ListAPIView):
     """This view lists all notification types"""
@@ -203,31 +340,108 @@ class NotificationTypeList(ListAPIView):
     permission_classes = [IsAuthenticated]
 
 
+class QueryCounter:
+    """
+    Database execute wrapper counting the queries it sees.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class FeedListView(ListAPIView):
+    """
+    Base of the feed lists. Pages are read as values() projections with the
+    notification content joined up front and turned into plain dicts without
+    running a DRF serializer per item; NotificationFeedSerializer only
+    documents the items.
+
+    Every query of the request is counted, authentication included, against
+    NOTIFICATION_FEED_QUERY_BUDGET: the tests assert a page stays within it and
+    requests above it are logged.
+    """
 
-@extend_schema(tags=["Notifications View"])
-class NotificationHistoryView(ListAPIView):
     permission_classes = [IsAuthenticated]
-    serializer_class = NotificationDeliverySerializer
-    queryset = NotificationDelivery.objects.all()
+    serializer_class = NotificationFeedSerializer
+    pagination_class = FeedCursorPagination
+    filter_backends = []
+    unread_only = False
 
     def get_queryset(self):
-        return self.queryset.filter(user=self.request.user)
+        return get_feed_sources(self.request.user, unread_only=self.unread_only)
+
+    def dispatch(self, request, *args, **kwargs):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = super().dispatch(request, *args, **kwargs)
+
+        elapsed = (time.perf_counter() - started) * 1000
+        if counter.count > settings.NOTIFICATION_FEED_QUERY_BUDGET:
+            logger.warning(
+                f"Feed query budget exceeded: view={type(self).__name__}, "
+                f"queries={counter.count}, budget={settings.NOTIFICATION_FEED_QUERY_BUDGET}, "
+                f"elapsed={elapsed:.1f}ms"
+            )
+        else:
+            logger.debug(
+                f"Feed page served: view={type(self).__name__}, "
+                f"queries={counter.count}, elapsed={elapsed:.1f}ms"
+            )
+        return response
 
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(serialize_feed_items(page))
 
 
+@extend_schema(tags=["Notifications View"])
+class NotificationHistoryView(FeedListView):
+    """
+    Lists the user's deliveries merged with the unread global notifications that
+    are fanned out on read, newest first, with keyset cursor pagination.
+    """
+
+
+@extend_schema(tags=["Notifications View"])
+class NotificationUnReadListView(FeedListView):
+    """
+    Lists the user's unread in-app deliveries merged with the unread global
+    notifications that are fanned out on read, newest first, with keyset cursor
+    pagination.
+    """
+
+    unread_only = True
 
 
 @extend_schema(tags=["Notifications View"])
-class NotificationUnReadListView(ListAPIView):
+class NotificationUnreadCountView(APIView):
+    """
+    Unread counts of the user for notification badges, read from the unread
+    counters instead of counting deliveries. With
+    NOTIFICATION_GLOBAL_FANOUT_ON_READ, unread global notifications have no
+    delivery yet and are counted from the notification_global_on_read index and
+    added to in_app.
+    """
+
     permission_classes = [IsAuthenticated]
-    serializer_class = NotificationDeliverySerializer
-    queryset = NotificationDelivery.objects.all()
 
-    def get_queryset(self):
-        return self.queryset.filter(
-            user=self.request.user, is_read=False, channel="in_app"
+    def get(self, request, *args, **kwargs):
+        channels = get_unread_counts(request.user)
+        if settings.NOTIFICATION_GLOBAL_FANOUT_ON_READ:
+            channels[NotificationChannel.IN_APP] += get_unread_global_notifications(
+                request.user
+            ).count()
+        return Response(
+            {"count": sum(channels.values()), "channels": channels},
+            status=status.HTTP_200_OK,
         )
 
+
 @extend_schema(tags=["Notifications View"])
 class NotificationReadView(generics.GenericAPIView):
     permission_classes = [IsAuthenticated]
@@ -239,13 +453,23 @@ class NotificationReadView(generics.GenericAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         notifications = serializer.validated_data["notifications"]
+        global_notifications = serializer.validated_data["global_notifications"]
 
         #The notifications is made to is_read  as defualt as channel in_app logically but if require email or sms we can add that logic here.
         # For now, we are only marking in-app notifications as read.
         try:
-            updated_count = NotificationDelivery.objects.filter(
-                user=self.request.user, id__in=notifications, channel="in_app"
-            ).update(is_read=True)
+            with transaction.atomic():
+                updated_count = NotificationDelivery.objects.filter(
+                    user=self.request.user,
+                    id__in=notifications,
+                    channel="in_app",
+                    is_read=False,
+                ).update(is_read=True)
+                decrement_unread(self.request.user.id, NotificationChannel.IN_APP, updated_count)
+                # Global notifications fanned out on read get their delivery row now.
+                updated_count += mark_global_notifications_read(
+                    self.request.user, global_notifications
+                )
             return Response(
                 {"detail": f"Marked {updated_count} notifications as read."},
                 status=status.HTTP_200_OK,
@@ -254,4 +478,4 @@ class NotificationReadView(generics.GenericAPIView):
             return Response(
                 {"messages": {"error": f"Failed to update notifications: {str(e)}"}},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
\ No newline at end of file
+            )